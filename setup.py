@@ -25,6 +25,7 @@ setup(
     package=[""],
     include_package_data=True,
     install_requires=required,
+    extras_require={'numpy': ['numpy']},
     author="Philipp Grimm",
     description="Protocol adapter from esp3 to esp2 for Home Assistant Eltako Integration",
     long_description=long_description,
@@ -0,0 +1,48 @@
+import queue
+from typing import Callable
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+
+class BoundedReceiveQueue(queue.Queue):
+    ''' Receive queue which never blocks the producer. When the capacity is reached messages are dropped according to the drop policy and counted. '''
+
+    def __init__(self, maxsize:int=0, drop_policy:str=DROP_OLDEST):
+        """_summary_
+
+        Args:
+            maxsize (int, optional): Capacity of the queue. 0 means unbounded. Defaults to 0.
+            drop_policy (str, optional): DROP_OLDEST removes the oldest message to make room, DROP_NEWEST discards the new message. Defaults to DROP_OLDEST.
+        """
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown drop policy '{drop_policy}'")
+        super(BoundedReceiveQueue, self).__init__(maxsize)
+        self.drop_policy = drop_policy
+        self.dropped = 0
+
+    def put(self, item, block=True, timeout=None):
+        ''' Puts item into the queue and never blocks. block and timeout are only there for compatibility with queue.Queue. '''
+        with self.mutex:
+            if self.maxsize > 0 and self._qsize() >= self.maxsize:
+                self.dropped += 1
+                if self.drop_policy == DROP_NEWEST:
+                    return
+                # the dropped item is counted as done
+                self._get()
+                self.unfinished_tasks -= 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+
+class NotifyingQueue(queue.Queue):
+    ''' Queue which calls a function after every put, e.g. to wake up a thread which waits in select(). '''
+
+    def __init__(self, on_put:Callable[[], None], maxsize:int=0):
+        super(NotifyingQueue, self).__init__(maxsize)
+        self._on_put = on_put
+
+    def put(self, item, block=True, timeout=None):
+        super(NotifyingQueue, self).put(item, block, timeout)
+        self._on_put()
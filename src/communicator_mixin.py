@@ -0,0 +1,222 @@
+import socket
+import threading
+import time
+from typing import Union
+
+from enocean.protocol.packet import Packet
+
+from eltakobus.message import ESP2Message
+
+from .frame_ring import FrameRingWriter
+from .lifecycle import ReconnectBackoff, ReconnectRequested
+from .message_stream import MessageHub
+from .rate_limiter import AddressRateLimiter
+from .state_cache import DeviceStateCache
+from .tcp_utils import SelectorWakeup, connect_tcp
+
+
+class CommunicatorMixin():
+    ''' Delivery of received messages and reconnection handling shared by ESP3SerialCommunicator, TCP2SerialCommunicator
+    and ESP2TCP2SerialCommunicator. Expects the attributes of the thread based communicator classes (_stop_flag,
+    _outside_callback, logger or log).
+
+    The communicator object is never started as thread itself. start() runs run() in an owned worker thread which is
+    replaced on restart(), so that a stopped communicator can be started again. '''
+
+    def _init_communicator(self,
+                           reconnection_initial_delay:float,
+                           reconnection_timeout:float,
+                           callback_batching:bool,
+                           callback_batch_interval:float,
+                           state_cache:DeviceStateCache,
+                           rate_limiter:AddressRateLimiter,
+                           frame_ring:FrameRingWriter):
+        self._reconnect_backoff = ReconnectBackoff(reconnection_initial_delay, reconnection_timeout)
+        self._reconnect_requested = False
+        self._message_hub = MessageHub()
+        # the loop runs in a worker thread, a new one is created for every start because a thread can only be started once
+        self._worker:threading.Thread = None
+
+        self._callback_batching = callback_batching
+        self._callback_batch_interval = callback_batch_interval
+        self._callback_batch = []
+        self._callback_batch_started = 0
+
+        self._state_cache = state_cache
+        self._rate_limiter = rate_limiter
+        self._frame_ring = frame_ring
+
+    def messages(self, addresses=None, rorgs=None, predicate=None, batched:bool=False, maxsize:int=0):
+        """Async iterator over received messages (same messages the callback would receive). Usage: `async for msg in com.messages(): ...`
+
+        Args:
+            addresses (Iterable, optional): Only messages from these sender addresses are passed. Defaults to None.
+            rorgs (Iterable[int], optional): Only radio telegrams of these RORGs (ESP2 org is mapped to RORG) are passed. Defaults to None.
+            predicate (Callable, optional): Custom filter which is called on the communicator thread. Defaults to None.
+            batched (bool, optional): Yields lists of all messages received in one burst instead of single messages. Defaults to False.
+            maxsize (int, optional): Max number of messages buffered for a slow consumer, oldest are dropped. 0 means unbounded. Defaults to 0.
+        """
+        return self._message_hub.messages(addresses, rorgs, predicate, batched, maxsize)
+
+    def get_statistics(self) -> dict:
+        if self._rate_limiter is None:
+            return {}
+        return self._rate_limiter.get_statistics()
+
+    def _deliver(self, msg:Union[ESP2Message, Packet]):
+        if self._rate_limiter is None:
+            self._deliver_now(msg)
+        else:
+            for m in self._rate_limiter.offer(msg, time.monotonic()):
+                self._deliver_now(m)
+
+    def _flush_rate_limiter(self, force:bool=False):
+        ''' Passes the latest telegrams of all addresses whose rate limit interval is over. '''
+        if self._rate_limiter is None:
+            return
+        messages = self._rate_limiter.flush_all() if force else self._rate_limiter.due(time.monotonic())
+        for m in messages:
+            self._deliver_now(m)
+
+    def _deliver_now(self, msg:Union[ESP2Message, Packet]):
+        self._message_hub.publish(msg)
+        if self._outside_callback:
+            if self._callback_batching:
+                if not self._callback_batch:
+                    self._callback_batch_started = time.monotonic()
+                self._callback_batch.append(msg)
+            else:
+                self._outside_callback(msg)
+
+    def _flush_callback_batch(self, force:bool=False):
+        ''' Passes collected messages to the callback if the batch interval is over. '''
+        if not self._callback_batch:
+            return
+        if not force and time.monotonic() - self._callback_batch_started < self._callback_batch_interval:
+            return
+
+        batch = self._callback_batch
+        self._callback_batch = []
+        callback = self._outside_callback
+        if callback:
+            callback(batch)
+
+    def _next_delivery_timeout(self, timeout:float | None) -> float | None:
+        ''' Shortens the given wait timeout to the time when the callback batch or a rate limit interval is due. '''
+        if self._callback_batching and self._callback_batch:
+            batch_timeout = max(0, self._callback_batch_started + self._callback_batch_interval - time.monotonic())
+            timeout = batch_timeout if timeout is None else min(timeout, batch_timeout)
+        if self._rate_limiter is not None:
+            rate_limit_timeout = self._rate_limiter.next_deadline(time.monotonic())
+            if rate_limit_timeout is not None:
+                timeout = rate_limit_timeout if timeout is None else min(timeout, rate_limit_timeout)
+        return timeout
+
+    def _stop_delivery(self):
+        ''' Passes all pending messages and closes subscriptions when the communicator thread ends. '''
+        self._flush_rate_limiter(force=True)
+        self._flush_callback_batch(force=True)
+        self._message_hub.close()
+        if self._state_cache is not None:
+            self._state_cache.save()
+
+    def _interrupt_wait(self) -> None:
+        ''' Wakes up the communicator thread when it waits for data, e.g. because a telegram was queued. '''
+
+    def start(self):
+        ''' Runs the communicator loop (run()) in a new worker thread. '''
+        if self.is_alive():
+            raise RuntimeError("Communicator is already running.")
+        self._worker = threading.Thread(target=self.run, name=self.name, daemon=self.daemon)
+        self._worker.start()
+
+    def is_alive(self) -> bool:
+        return self._worker is not None and self._worker.is_alive()
+
+    def join(self, timeout:float=None):
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+    def stop(self):
+        super().stop()
+        self._reconnect_backoff.interrupt()
+        self._interrupt_wait()
+
+    def reconnect(self):
+        ''' Drops the current connection and connects again right away. Restarts the communicator if it is not running. '''
+        if not self.is_alive():
+            self.restart()
+            return
+        self._reconnect_backoff.reset()
+        self._reconnect_requested = True
+        self._reconnect_backoff.interrupt()
+        self._interrupt_wait()
+
+    def restart(self, timeout:float=10):
+        ''' Stops the communicator (if running) and starts it again with a fresh connection in a new worker thread. '''
+        if self.is_alive():
+            self.stop()
+            self.join(timeout)
+            if self.is_alive():
+                raise RuntimeError("Communicator thread did not stop in time.")
+        self._stop_flag.clear()
+        self._reconnect_requested = False
+        self._reconnect_backoff.reset()
+        self.start()
+
+    def _wait_for_reconnection(self, reason:Exception) -> None:
+        ''' Waits before the next connection attempt unless the reconnect was requested. Returns early when stopped. '''
+        if isinstance(reason, ReconnectRequested):
+            return
+        delay = self._reconnect_backoff.next_delay()
+        # ESP3 communicators call their logger 'logger', ESP2 communicators 'log'
+        logger = getattr(self, 'logger', None) or self.log
+        logger.info("Connection lost. Wait %.1f seconds for reconnection.", delay)
+        self._reconnect_backoff.wait(delay)
+
+
+class TCPConnectionMixin():
+    ''' Connection setup and connection statistics shared by TCP2SerialCommunicator and ESP2TCP2SerialCommunicator. '''
+
+    def _init_tcp_connection(self, host:str, port:int, connect_timeout:float, tcp_connection_timeout:float):
+        self._host = host
+        self._port = port
+        self._connect_timeout = connect_timeout
+        self._tcp_connection_timeout = tcp_connection_timeout
+        self._wakeup = SelectorWakeup()
+
+        self._connect_time = None
+        self._reconnect_time = None
+        self._reconnect_count = 0
+        self._disconnected_at = None
+
+    def get_statistics(self) -> dict:
+        statistics = super().get_statistics()
+        statistics.update({
+            'connect_time': self._connect_time,
+            'reconnect_time': self._reconnect_time,
+            'reconnects': self._reconnect_count,
+        })
+        return statistics
+
+    def _interrupt_wait(self) -> None:
+        self._wakeup.wake()
+
+    def _open_connection(self) -> socket.socket:
+        ''' Connects to the gateway and records connect and reconnect time. '''
+        connect_started = time.monotonic()
+        sock = connect_tcp(self._host, self._port, self._connect_timeout)
+        self._connect_time = time.monotonic() - connect_started
+        self._reconnect_backoff.reset()
+        if self._disconnected_at is not None:
+            # time from detecting the disconnect until the connection is back
+            self._reconnect_time = time.monotonic() - self._disconnected_at
+            self._reconnect_count += 1
+            self._disconnected_at = None
+            self.log.info("Reconnected to %s:%s after %.3f seconds", self._host, self._port, self._reconnect_time)
+        sock.settimeout(self._tcp_connection_timeout if self._auto_reconnect else None)
+        return sock
+
+    def _connection_lost(self) -> None:
+        if self._disconnected_at is None:
+            self._disconnected_at = time.monotonic()
@@ -1,4 +1,5 @@
-import socket
+import datetime
+import selectors
 import time
 import logging
 import queue
@@ -7,7 +8,22 @@ from eltakobus.error import ParseError
 from eltakobus.serial import RS485SerialInterfaceV2
 from eltakobus.message import ESP2Message, prettify
 
-class ESP2TCP2SerialCommunicator(RS485SerialInterfaceV2):
+## only for debug (allows to run this file directly, e.g. python src/esp2_tcp_com.py)
+if not __package__:
+    import os
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = 'src'
+
+from .bounded_queue import NotifyingQueue
+from .communicator_mixin import CommunicatorMixin, TCPConnectionMixin
+from .frame_ring import FrameRingWriter
+from .lifecycle import ReconnectRequested
+from .rate_limiter import AddressRateLimiter
+from .state_cache import DeviceStateCache
+from .tcp_utils import enable_tcp_keepalive
+
+class ESP2TCP2SerialCommunicator(TCPConnectionMixin, CommunicatorMixin, RS485SerialInterfaceV2):
 
     KEEP_ALIVE_MESSAGES = [
         b'IM2M'     # keep-alive-message for PioTek LAN Gateway
@@ -18,18 +34,44 @@ class ESP2TCP2SerialCommunicator(RS485SerialInterfaceV2):
                  port,
                  log=None, 
                  callback=None, 
-                 reconnection_timeout:float=10,     # actually this is the time to wait until next reconnection will be tried out
+                 reconnection_timeout:float=10,     # actually this is the max time to wait until next reconnection will be tried out
+                 reconnection_initial_delay:float=0.5,
                  auto_reconnect=True,
-                 tcp_connection_timeout:float = 1):
+                 tcp_connection_timeout:float = 1,
+                 callback_batching:bool=False,
+                 callback_batch_interval:float=0,
+                 kernel_keep_alive:bool=False,
+                 state_cache:DeviceStateCache=None,
+                 rate_limiter:AddressRateLimiter=None,
+                 frame_ring:FrameRingWriter=None,
+                 connect_timeout:float=3,
+                 gateway_id:int=0):
+        """ESP2TCP2SerialCommunicator connects to a TCP bridge which forwards ESP2 telegrams.
+
+        Args:
+            host (str): IP Address or hostname of TCP ESP2 Bridge
+            port (int): Port of ESP2 Bridge
+            log (logging.Logger, optional): Logger. Defaults to logging.getLogger('eltakobus.tcp2serial').
+            callback (Callable[ESP2Message, None], optional): Callback function which takes received message for data processing. Defaults to None.
+            reconnection_timeout (float, optional): Max time in seconds to wait between two reconnection attempts. Defaults to 10.
+            reconnection_initial_delay (float, optional): Time to wait before the first reconnection attempt. It doubles (with random jitter) after every failed attempt up to reconnection_timeout. Defaults to 0.5.
+            auto_reconnect (bool, optional): When enabled tries to restart the connection after unwanted disconnect. Defaults to True.
+            tcp_connection_timeout (float, optional): Connection timeout of TCP operation. Defaults to 1.
+            connect_timeout (float, optional): Max time for establishing the TCP connection. All resolved addresses of host are tried in parallel and resolved addresses are cached. Defaults to 3.
+            callback_batching (bool, optional): Callback receives a list of all messages parsed from one read instead of single messages. Every message has its timestamp in attribute 'received'. Defaults to False.
+            callback_batch_interval (float, optional): When batching is enabled messages are collected for at least X seconds before the callback is called. 0 means one batch per read. Defaults to 0.
+            kernel_keep_alive (bool, optional): Dead connections are detected by TCP keep-alive of the OS instead of reconnecting after 10 seconds without received data. Defaults to False.
+            state_cache (DeviceStateCache, optional): Keeps the latest telegram of every device so that states are available via get_device_states() right after startup. Defaults to None.
+            rate_limiter (AddressRateLimiter, optional): Limits how often telegrams of one address are passed to the callback and subscribers. Only the latest telegram within an interval is passed. Defaults to None.
+            frame_ring (FrameRingWriter, optional): Publishes every received telegram into a shared memory ring buffer which other processes on the same host can follow with FrameRingReader. Defaults to None.
+            gateway_id (int, optional): Identifies this gateway in the state cache when it is shared by several communicators. Defaults to 0.
+        """
         
+        self._kernel_keep_alive = kernel_keep_alive
         self._RECONNECTION_TIMEOUT = 10
-        self._tcp_connection_timeout = tcp_connection_timeout
-        self.__recon_time = reconnection_timeout
         self._outside_callback = callback
         self._auto_reconnect = auto_reconnect
-
-        self._host = host
-        self._port = port
+        self._gateway_id = gateway_id
 
         super(ESP2TCP2SerialCommunicator, self).__init__(
             filename = None, 
@@ -44,6 +86,9 @@ class ESP2TCP2SerialCommunicator(RS485SerialInterfaceV2):
 
         self.daemon = True
         self.__ser = None
+        self._init_communicator(reconnection_initial_delay, reconnection_timeout, callback_batching, callback_batch_interval, state_cache, rate_limiter, frame_ring)
+        self._init_tcp_connection(host, port, connect_timeout, tcp_connection_timeout)
+        self.transmit = NotifyingQueue(self._interrupt_wait)
 
     @property
     def host(self):
@@ -64,6 +109,18 @@ class ESP2TCP2SerialCommunicator(RS485SerialInterfaceV2):
         self.log.debug("connection test successful")
 
 
+    def get_device_states(self) -> list[ESP2Message]:
+        ''' Returns the latest telegram of every device known by the state cache. Attribute 'received' contains the time of reception. '''
+        if self._state_cache is None:
+            return []
+
+        result = []
+        for frame in self._state_cache.snapshot(self._gateway_id):
+            msg = frame.to_message()
+            msg.received = datetime.datetime.fromtimestamp(frame.timestamp)
+            result.append(msg)
+        return result
+
     def send_message(self, msg:ESP2Message):
         self.transmit.put((time.time(), msg))
 
@@ -83,23 +140,33 @@ class ESP2TCP2SerialCommunicator(RS485SerialInterfaceV2):
         return not self._stop_flag.is_set()
 
     def run(self):
-        timeout_count = 0
         self.log.info('TCP2SerialCommunicator started')
         self._fire_status_change_handler(connected=False)
         data = []
+        selector = None
+        idle_timeout = None
+        last_received = time.time()
         while not self._stop_flag.is_set():
             try:
+                if self._reconnect_requested and self.__ser is not None:
+                    raise ReconnectRequested(f"Reconnect to {self._host}:{self._port} requested.")
+
                 # Initialize serial port
                 if self.__ser is None:
-                    
-                    self.__ser = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    self.__ser.connect((self._host, self._port))
-                    if self._auto_reconnect:
-                        self.__ser.settimeout(self._tcp_connection_timeout)
-                    else:
-                        self.__ser.settimeout(None)
+                    self._reconnect_requested = False
+                    self.__ser = self._open_connection()
 
-                    self.log.info(f"Established TCP connection to {self._host}:{self._port} (blocking: {not self._auto_reconnect}, tcp timeout: {self._tcp_connection_timeout} sec, serial timeout: {self._RECONNECTION_TIMEOUT} sec)")
+                    # without kernel keep-alive a connection is considered dead after some time without received data
+                    idle_timeout = self._RECONNECTION_TIMEOUT if self._auto_reconnect else None
+                    if self._kernel_keep_alive and enable_tcp_keepalive(self.__ser, self._RECONNECTION_TIMEOUT):
+                        idle_timeout = None
+
+                    selector = selectors.DefaultSelector()
+                    selector.register(self.__ser, selectors.EVENT_READ)
+                    selector.register(self._wakeup, selectors.EVENT_READ)
+                    last_received = time.time()
+
+                    self.log.info(f"Established TCP connection to {self._host}:{self._port} (blocking: {not self._auto_reconnect}, tcp timeout: {self._tcp_connection_timeout} sec, serial timeout: {self._RECONNECTION_TIMEOUT} sec, kernel keep-alive: {idle_timeout is None})")
                     
                     self.is_serial_connected.set()
                     self._fire_status_change_handler(connected=True)
@@ -113,9 +180,30 @@ class ESP2TCP2SerialCommunicator(RS485SerialInterfaceV2):
                     self.log.debug("send msg: %s", msg)
                     self.__ser.sendall( msg.serialize() )
 
+                timeout = None
+                if idle_timeout is not None:
+                    timeout = last_received + idle_timeout - time.time()
+                    if timeout < 0:
+                        raise ConnectionError(f"No data received from {self._host}:{self._port} for {idle_timeout} seconds.")
+                timeout = self._next_delivery_timeout(timeout)
+
+                # Wait until data arrives, something needs to be sent or a timer is due.
+                ready_to_read = False
+                for key, _ in selector.select(timeout):
+                    if key.fileobj is self._wakeup:
+                        self._wakeup.clear()
+                    else:
+                        ready_to_read = True
+
+                self._flush_rate_limiter()
+
                 # Read chars from serial port as hex numbers
-                try:
-                    data.extend( self.__ser.recv(1024) )
+                if ready_to_read:
+                    received = self.__ser.recv(1024)
+                    if not received:
+                        raise ConnectionError(f"Connection closed by {self._host}:{self._port}")
+                    data.extend( received )
+                    last_received = time.time()
                     # print(hex(int.from_bytes(data, "big")))
                     while len(data) >= 14:
                         try:
@@ -124,39 +212,44 @@ class ESP2TCP2SerialCommunicator(RS485SerialInterfaceV2):
                             data = data[1:]
                         else:
                             data = data[14:]
-                            self._outside_callback(msg)
-                    timeout_count = 0
-
-                except socket.timeout as e:
-                    if self._auto_reconnect:
-                        timeout_count += 1
-                        if timeout_count > self._RECONNECTION_TIMEOUT:  # after 10s without receiving something disconnect
-                            timeout_count = 0
-                            self.__ser.close()
-                    else:
-                        self.log.debug(f"auto-reconnect is disabled ({self._auto_reconnect})")
-                        raise e
-                        
-                time.sleep(0)
+                            msg.received = datetime.datetime.now()
+                            if self._frame_ring is not None:
+                                self._frame_ring.write_message(msg)
+                            if self._state_cache is not None:
+                                self._state_cache.update(msg, self._gateway_id)
+                            self._deliver(msg)
+
+                if self._callback_batching:
+                    self._flush_callback_batch()
 
             except Exception as e:
+                self._connection_lost()
                 self._fire_status_change_handler(connected=False)
                 self.is_serial_connected.clear()
-                self.log.exception(e)
+                if isinstance(e, ReconnectRequested):
+                    self.log.info(e)
+                else:
+                    self.log.exception(e)
+                if selector is not None:
+                    selector.close()
+                    selector = None
                 if self.__ser is not None:
                     self.__ser.close()
                 self.__ser = None
-                if self._auto_reconnect:
-                    self.log.info("TCP2Serial communication crashed. Wait %s seconds for reconnection.", self.__recon_time)
-                    time.sleep(self.__recon_time)
+                data = []
+                if self._auto_reconnect or isinstance(e, ReconnectRequested):
+                    self._wait_for_reconnection(e)
                 else:
                     self._stop_flag.set()
 
+        if selector is not None:
+            selector.close()
         if self.__ser is not None:
             self.__ser.close()
             self.__ser = None
         self.is_serial_connected.clear()
         self._fire_status_change_handler(connected=False)
+        self._stop_delivery()
         self.log.info('TCP2SerialCommunicator stopped')
 
 
@@ -1,14 +1,16 @@
 from __future__ import print_function, unicode_literals, division, absolute_import
 # -*- encoding: utf-8 -*-
 import asyncio
+import concurrent.futures
 import datetime
 import logging
+import queue
 import serial
 import time
 import threading
 
-from typing import Callable, Union
-import queue
+from collections import deque
+from typing import Callable, NamedTuple, Union
 
 from enocean.communicators.communicator import Communicator
 from enocean.protocol.packet import Packet, RadioPacket, RORG, PACKET, UTETeachInPacket
@@ -19,7 +21,76 @@ from eltakobus.message import ESP2Message, RPSMessage, Regular1BSMessage,  Regul
 from eltakobus.eep import CentralCommandSwitching, A5_38_08
 from eltakobus.util import b2s
 
-class ESP3SerialCommunicator(Communicator):
+## only for debug (allows to run this file directly, e.g. python src/esp3_serial_com.py)
+if not __package__:
+    import os
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = 'src'
+
+from .bounded_queue import BoundedReceiveQueue, DROP_OLDEST, NotifyingQueue
+from .communicator_mixin import CommunicatorMixin
+from .frame_ring import FrameRingWriter
+from .lifecycle import ReconnectRequested
+from .link_quality import LinkQualityIndex
+from .rate_limiter import AddressRateLimiter
+from .send_cache import PrebuiltTelegram, TelegramLRUCache
+from .state_cache import DeviceStateCache
+
+# ESP3 return code which is not part of enocean's RETURN_CODE: gateway has no free buffer for the telegram (busy)
+RET_NO_FREE_BUFFER = 0x07
+# return codes after which a telegram is sent again
+RETRY_RETURN_CODES = (RETURN_CODE.ERROR, RET_NO_FREE_BUFFER)
+
+
+class SendError(Exception):
+    ''' Telegram was not acknowledged with RET_OK by the gateway. '''
+
+    def __init__(self, message:str, return_code:int=None):
+        super(SendError, self).__init__(message)
+        self.return_code = return_code
+
+
+class SendTimeoutError(SendError):
+    ''' Gateway did not respond to a telegram in time. '''
+
+
+class GatewayVersion(NamedTuple):
+    ''' Answer of CO_RD_VERSION '''
+    app_version: str
+    api_version: str
+    chip_id: bytes
+    chip_version: bytes
+    app_description: str
+
+
+class GatewayIdentity(NamedTuple):
+    ''' Result of async_start(). Values are None if the gateway did not answer the query. '''
+    base_id: list | None
+    version: GatewayVersion | None
+    repeater_mode: int | None
+    timings: dict                       # seconds per startup phase: connect, base_id, version, repeater_mode (each measured after connect) and total
+
+
+class _PendingSend():
+    ''' Telegram in the send pipeline. future is None if nobody waits for the response. '''
+
+    __slots__ = ('packet', 'future', 'attempts', 'deadline')
+
+    def __init__(self, packet, future:concurrent.futures.Future=None):
+        self.packet = packet
+        self.future = future
+        self.attempts = 0
+        self.deadline = 0
+
+    def build(self):
+        return self.packet.build()
+
+    def __str__(self):
+        return str(self.packet)
+
+
+class ESP3SerialCommunicator(CommunicatorMixin, Communicator):
     ''' Serial port communicator class for EnOcean radio '''
 
     def __init__(self, 
@@ -29,7 +100,21 @@ class ESP3SerialCommunicator(Communicator):
                  baud_rate:int=57600, 
                  auto_reconnect:bool=True,
                  reconnection_timeout:float=10,
+                 reconnection_initial_delay:float=0.5,
                  esp2_translation_enabled:bool=False, 
+                 callback_batching:bool=False,
+                 callback_batch_interval:float=0,
+                 receive_queue_size:int=0,
+                 receive_drop_policy:str=DROP_OLDEST,
+                 state_cache:DeviceStateCache=None,
+                 send_cache_size:int=128,
+                 send_window:int=0,
+                 send_timeout:float=1,
+                 send_retries:int=2,
+                 rate_limiter:AddressRateLimiter=None,
+                 frame_ring:FrameRingWriter=None,
+                 link_quality:LinkQualityIndex=None,
+                 gateway_id:int=0,
                  ):
         """_summary_
 
@@ -39,8 +124,22 @@ class ESP3SerialCommunicator(Communicator):
             callback (Callable[Union[ESP2Message, Packet], None], optional): Callback function which takes received message for data processing. Defaults to None.
             baud_rate (int, optional): For connecting to serial port. Defaults to 57600.
             auto_reconnect (bool, optional): When enabled tries to restart the connection after unwanted disconnect. Defaults to True.
-            reconnection_timeout (float, optional): When there is a disconnect this adapter will wait for X seconds before trying to restart. Defaults to 10.
+            reconnection_timeout (float, optional): Max time in seconds to wait between two reconnection attempts. Defaults to 10.
+            reconnection_initial_delay (float, optional): Time to wait before the first reconnection attempt. It doubles (with random jitter) after every failed attempt up to reconnection_timeout. Defaults to 0.5.
             esp2_translation_enabled (bool, optional): Converts ESP3 messages into ESP2 and passes it to the callback function otherwise ESP3 message will be passed. Defaults to False.
+            callback_batching (bool, optional): Callback receives a list of all messages parsed from one read instead of single messages. Every message has its timestamp in attribute 'received'. Defaults to False.
+            callback_batch_interval (float, optional): When batching is enabled messages are collected for at least X seconds before the callback is called. 0 means one batch per read. Defaults to 0.
+            receive_queue_size (int, optional): Capacity of the receive queue which is filled when no callback is set. 0 means unbounded. Defaults to 0.
+            receive_drop_policy (str, optional): What to drop when the receive queue is full: 'drop_oldest' or 'drop_newest'. Defaults to 'drop_oldest'.
+            state_cache (DeviceStateCache, optional): Keeps the latest telegram of every device so that states are available via get_device_states() right after startup. Defaults to None.
+            send_cache_size (int, optional): Number of ESP2 messages for which the translated ESP3 telegram is kept so that repeated commands skip the conversion. 0 disables the cache. Defaults to 128.
+            send_window (int, optional): Max number of telegrams which wait for their response from the gateway at the same time. When enabled send() waits for RET_OK and raises SendError otherwise. 0 disables acknowledgement tracking. Defaults to 0.
+            send_timeout (float, optional): Time to wait for the response of a telegram when send_window is enabled. After a timeout all telegrams in flight are sent again after a quiet period of the same length, so send() waits at most send_timeout * 2 * (send_retries + 1) seconds including the time in the queue. Defaults to 1.
+            send_retries (int, optional): How often a telegram is sent again after RET_ERROR, no free buffer or timeout when send_window is enabled. Defaults to 2.
+            rate_limiter (AddressRateLimiter, optional): Limits how often telegrams of one address are passed to the callback and subscribers. Only the latest telegram within an interval is passed. Defaults to None.
+            frame_ring (FrameRingWriter, optional): Publishes every received telegram into a shared memory ring buffer which other processes on the same host can follow with FrameRingReader. Defaults to None.
+            link_quality (LinkQualityIndex, optional): Collects signal strength and sub-telegram counts of received radio telegrams per sender. Defaults to None.
+            gateway_id (int, optional): Identifies this gateway in the link quality index and state cache when they are shared by several communicators. Defaults to 0.
         """
         
         self.esp2_translation_enabled = esp2_translation_enabled
@@ -52,15 +151,65 @@ class ESP3SerialCommunicator(Communicator):
         self.logger = logger
 
         self._baud_rate = baud_rate
-        self.__recon_time = reconnection_timeout 
         self.is_serial_connected = threading.Event()
         self.status_changed_handler = None
         self.daemon = True
         self.__ser = None
+        self._init_communicator(reconnection_initial_delay, reconnection_timeout, callback_batching, callback_batch_interval, state_cache, rate_limiter, frame_ring)
+
+        self.receive = BoundedReceiveQueue(receive_queue_size, receive_drop_policy)
+        # telegrams to send interrupt the blocking read so that they do not wait for the read timeout
+        self.transmit = NotifyingQueue(self._interrupt_wait)
+        self._response_waiters = []
+        self._response_waiters_lock = threading.Lock()
+        self._connected_waiters:list[concurrent.futures.Future] = []
+        self._send_cache = TelegramLRUCache(send_cache_size)
+
+        self._send_window = send_window
+        self._send_timeout = send_timeout
+        self._send_retries = send_retries
+        self._send_backlog:deque[_PendingSend] = deque()
+        self._in_flight:deque[_PendingSend] = deque()
+        self._send_paused_until = 0
+        self._send_retry_count = 0
+        self._send_failure_count = 0
+        self._send_discarded_responses = 0
+        self._link_quality = link_quality
+        self._gateway_id = gateway_id
 
     def set_callback(self, callback):
         self._outside_callback = callback
 
+    def get_statistics(self) -> dict:
+        statistics = super().get_statistics()
+        statistics.update({
+            'receive_queue_size': self.receive.qsize(),
+            'receive_queue_dropped': self.receive.dropped,
+            'send_cache_hits': self._send_cache.hits,
+            'send_cache_misses': self._send_cache.misses,
+            'send_cache_hit_rate': self._send_cache.hit_rate,
+            'send_in_flight': len(self._in_flight),
+            'send_retries': self._send_retry_count,
+            'send_failures': self._send_failure_count,
+            'send_discarded_responses': self._send_discarded_responses,
+        })
+        return statistics
+
+    def get_device_states(self) -> list[Union[ESP2Message, Packet]]:
+        ''' Returns the latest telegram of every device known by the state cache in the same form as it is passed to the callback. Attribute 'received' contains the time of reception. '''
+        if self._state_cache is None:
+            return []
+
+        result = []
+        for frame in self._state_cache.snapshot(self._gateway_id):
+            msg = frame.to_message()
+            if isinstance(msg, Packet) and self.esp2_translation_enabled:
+                msg = ESP3SerialCommunicator.convert_esp3_to_esp2_message(msg)
+            if msg is not None:
+                msg.received = datetime.datetime.fromtimestamp(frame.timestamp)
+                result.append(msg)
+        return result
+
     def is_active(self) -> bool:
         return not self._stop_flag.is_set() and self.is_serial_connected.is_set()     
 
@@ -69,6 +218,13 @@ class ESP3SerialCommunicator(Communicator):
         self._fire_status_change_handler(self.is_active())
 
     def _fire_status_change_handler(self, connected:bool) -> None:
+        if connected:
+            with self._response_waiters_lock:
+                waiters = self._connected_waiters
+                self._connected_waiters = []
+            for future in waiters:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(True)
         try:
             if self.status_changed_handler:
                 self.status_changed_handler(connected)
@@ -154,82 +310,279 @@ class ESP3SerialCommunicator(Communicator):
 
     def __callback_wrapper(self, msg: Packet):
         if msg.packet_type == PACKET.RESPONSE and msg.data[0] != RETURN_CODE.OK:
-            self.logger.error(f"Received ESP3 response with return code {RETURN_CODE(msg.data[0]).name} ({msg.data[0]}) - {str(msg)} ")
+            code_name = RETURN_CODE(msg.data[0]).name if msg.data[0] in RETURN_CODE._value2member_map_ else 'UNKNOWN'
+            self.logger.error(f"Received ESP3 response with return code {code_name} ({msg.data[0]}) - {str(msg)} ")
             return
 
-        if self._outside_callback:
-            if self.esp2_translation_enabled:
-                # only when message is radio telegram
-                if msg.packet_type == PACKET.RADIO or msg.packet_type == PACKET.RESPONSE:
-                    esp2_msg = ESP3SerialCommunicator.convert_esp3_to_esp2_message(msg)
-                    
-                    if esp2_msg is None:
-                        if msg.packet_type == PACKET.RESPONSE and len(msg.response_data) == 0:
-                            self.logger.debug("[ESP3SerialCommunicator] Received acknowledgement!")
-                        else:
-                            self.logger.warn("[ESP3SerialCommunicator] Cannot convert to esp2 message (%s).", msg)
+        if self.esp2_translation_enabled:
+            # only when message is radio telegram
+            if msg.packet_type == PACKET.RADIO or msg.packet_type == PACKET.RESPONSE:
+                esp2_msg = ESP3SerialCommunicator.convert_esp3_to_esp2_message(msg)
+                
+                if esp2_msg is None:
+                    if msg.packet_type == PACKET.RESPONSE and len(msg.response_data) == 0:
+                        self.logger.debug("[ESP3SerialCommunicator] Received acknowledgement!")
                     else:
-                        self._outside_callback(esp2_msg)
+                        self.logger.warn("[ESP3SerialCommunicator] Cannot convert to esp2 message (%s).", msg)
+                else:
+                    esp2_msg.received = msg.received
+                    self._deliver(esp2_msg)
+
+        else:
+            self._deliver(msg)
+
+    def _interrupt_wait(self) -> None:
+        ser = self.__ser
+        if ser is not None and hasattr(ser, 'cancel_read'):
+            try:
+                ser.cancel_read()
+            except Exception:
+                # port is being closed
+                pass
+
+    async def async_start(self, timeout:float=10) -> GatewayIdentity:
+        """Starts the communicator (if it is not running) and returns when the gateway is connected and identified.
+        Base id, version and repeater mode are requested at the same time. Several gateways can be started in parallel e.g. with asyncio.gather().
 
+        Args:
+            timeout (float, optional): Max time in seconds to wait for the connection. Every query additionally waits max 1 second for its answer. Defaults to 10.
+
+        Raises:
+            asyncio.TimeoutError: Gateway was not connected within timeout.
+        """
+        started = time.monotonic()
+        if not self.is_alive():
+            self.restart()
+
+        connected = concurrent.futures.Future()
+        with self._response_waiters_lock:
+            if self.is_serial_connected.is_set():
+                connected.set_result(True)
             else:
-                self._outside_callback(msg)
+                self._connected_waiters.append(connected)
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(connected), timeout)
+        finally:
+            with self._response_waiters_lock:
+                if connected in self._connected_waiters:
+                    self._connected_waiters.remove(connected)
+
+        timings = {'connect': time.monotonic() - started}
+        connected_at = time.monotonic()
+
+        async def timed(phase:str, awaitable):
+            result = await awaitable
+            timings[phase] = time.monotonic() - connected_at
+            return result
 
-    def reconnect(self):
-        self._stop_flag.set()
-        self._stop_flag.wait()
-        self.start()
+        base_id, version, repeater_mode = await asyncio.gather(
+            timed('base_id', self.async_base_id),
+            timed('version', self.async_version()),
+            timed('repeater_mode', self.get_repeater_mode()))
+        timings['total'] = time.monotonic() - started
+
+        return GatewayIdentity(base_id, version, repeater_mode, timings)
 
     async def send(self, packet) -> bool:
-        if self.esp2_translation_enabled:
-            if not isinstance(packet, Packet):
-                esp3_msg = ESP3SerialCommunicator.convert_esp2_to_esp3_message(packet)
-                self.logger.info(f"Converted esp2 ({str(packet)} - {b2s(packet.serialize())}) message to esp3 ({str(esp3_msg)} - {b2s(esp3_msg.build())})")
-            else:
-                esp3_msg = packet
-            
-            if esp3_msg is None:
+        ''' Sends an ESP3 packet or an ESP2 message (when ESP2 translation is enabled). If send_window is enabled it waits until the gateway confirmed the telegram and raises SendError if it did not. '''
+        if isinstance(packet, PrebuiltTelegram):
+            telegram = packet
+        elif self.esp2_translation_enabled and not isinstance(packet, Packet):
+            telegram = self._translate_for_sending(packet)
+            if telegram is None:
                 self.logger.warn(f"[ESP3SerialCommunicator] Cannot convert to esp3 message ({str(packet)}).")
+                return False
+        elif isinstance(packet, Packet):
+            telegram = packet
+        else:
+            self.logger.error('Object to send must be an instance of Packet')
+            return False
+
+        self.logger.info("Send ESP3 message %s", telegram)
+        if self._send_window <= 0:
+            self.transmit.put(telegram)
+            return True
+
+        if not self.is_serial_connected.is_set():
+            raise SendError("Gateway is not connected.")
+        pending = _PendingSend(telegram, concurrent.futures.Future())
+        self.transmit.put(pending)
+        # the deadline starts when the telegram is queued so that send() also returns if the communicator thread does
+        # not get to it, e.g. while it waits for a reconnection. The cancelled telegram is not sent anymore.
+        timeout = self._send_timeout * 2 * (self._send_retries + 1)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(pending.future), timeout)
+        except asyncio.TimeoutError:
+            self._send_failure_count += 1
+            raise SendTimeoutError(f"Telegram ({pending}) was not confirmed within {timeout} seconds.")
+
+    def _translate_for_sending(self, message: ESP2Message) -> PrebuiltTelegram | None:
+        ''' Converts an ESP2 message into a serialized ESP3 telegram. Repeated messages are taken from the send cache. '''
+        key = message.serialize()
+        telegram = self._send_cache.get(key)
+        if telegram is not None:
+            return telegram
+
+        esp3_msg = ESP3SerialCommunicator.convert_esp2_to_esp3_message(message)
+        if esp3_msg is None:
+            return None
+
+        telegram = PrebuiltTelegram(bytes(esp3_msg.build()), str(esp3_msg))
+        self._send_cache.put(key, telegram)
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(f"Converted esp2 ({str(message)} - {b2s(key)}) message to esp3 ({str(esp3_msg)} - {b2s(telegram.wire)})")
+        return telegram
+
+    def _transmit_pending(self, write:Callable[[bytearray], None]):
+        ''' Writes telegrams of the transmit queue. With a send window only that many telegrams are written before their responses arrived. '''
+        if self._send_window <= 0:
+            while True:
+                packet = self._get_from_send_queue()
+                if not packet:
+                    break
+                self.logger.debug("send msg: %s", packet)
+                write(bytearray(packet.build()))
+            return
+
+        self._check_send_timeouts()
+        if time.monotonic() < self._send_paused_until:
+            return
+        while len(self._in_flight) < self._send_window:
+            if self._send_backlog:
+                pending = self._send_backlog.popleft()
             else:
-                self.logger.info(f"Send ESP3 message {str(esp3_msg)}")
-                return super().send(esp3_msg)
+                item = self._get_from_send_queue()
+                if not item:
+                    break
+                pending = item if isinstance(item, _PendingSend) else _PendingSend(item)
+            if pending.future is not None and pending.future.cancelled():
+                # send() gave up waiting
+                continue
+
+            pending.attempts += 1
+            pending.deadline = time.monotonic() + self._send_timeout
+            self.logger.debug("send msg: %s", pending)
+            write(bytearray(pending.build()))
+            self._in_flight.append(pending)
+
+    def _next_send_deadline(self) -> float | None:
+        ''' Returns seconds until the oldest telegram in flight times out or sending continues after a timeout. '''
+        now = time.monotonic()
+        if now < self._send_paused_until:
+            return self._send_paused_until - now
+        if not self._in_flight:
+            return None
+        return max(0, self._in_flight[0].deadline - now)
+
+    def _check_send_timeouts(self):
+        ''' Responses do not reference their telegram. A late response of a timed out telegram would be taken for the
+        response of the next telegram in flight and shift all following results. So after a timeout all telegrams in
+        flight count as unconfirmed and are sent again after a quiet period of send_timeout in which arriving responses
+        are discarded. Telegrams which already reached the gateway can be sent twice. '''
+        if not self._in_flight or self._in_flight[0].deadline > time.monotonic():
+            return
+        self._send_paused_until = time.monotonic() + self._send_timeout
+        while self._in_flight:
+            # from the newest so that the backlog keeps the order
+            pending = self._in_flight.pop()
+            self._retry_or_fail(pending, SendTimeoutError(f"No response for telegram ({pending}) within {self._send_timeout} seconds."))
+
+    def _on_send_response(self, packet:Packet):
+        ''' Responses arrive in the order of the sent telegrams, so the oldest telegram in flight is answered. '''
+        if not self._in_flight:
+            # late response of a telegram which timed out
+            self._send_discarded_responses += 1
+            return
+        pending = self._in_flight.popleft()
+        code = packet.data[0] if len(packet.data) > 0 else RETURN_CODE.ERROR
+        if code == RETURN_CODE.OK:
+            self._resolve_send(pending.future, result=True)
+        elif code in RETRY_RETURN_CODES:
+            self._retry_or_fail(pending, SendError(f"Gateway rejected telegram ({pending}) with return code {code}.", code))
         else:
-            self.logger.info(f"Send ESP3 message {str(packet)}")
-            return super().send(packet)
+            self._send_failure_count += 1
+            self._resolve_send(pending.future, exception=SendError(f"Gateway rejected telegram ({pending}) with return code {code}.", code))
+
+    def _retry_or_fail(self, pending:_PendingSend, error:SendError):
+        if pending.attempts <= self._send_retries:
+            self._send_retry_count += 1
+            self._send_backlog.appendleft(pending)
+        else:
+            self._send_failure_count += 1
+            self._resolve_send(pending.future, exception=error)
+
+    def _fail_pending_sends(self, reason:str):
+        ''' Fails all telegrams which wait for their response or are still queued e.g. when the connection is lost. '''
+        while self._in_flight:
+            self._resolve_send(self._in_flight.popleft().future, exception=SendError(reason))
+        while self._send_backlog:
+            self._resolve_send(self._send_backlog.popleft().future, exception=SendError(reason))
+        self._send_paused_until = 0
+
+        # telegrams nobody waits for (e.g. requests of base id) stay in the queue
+        others = []
+        while True:
+            try:
+                item = self.transmit.get(block=False)
+            except queue.Empty:
+                break
+            if isinstance(item, _PendingSend):
+                self._resolve_send(item.future, exception=SendError(reason))
+            else:
+                others.append(item)
+        for item in others:
+            self.transmit.put(item)
+
+    def _resolve_send(self, future:concurrent.futures.Future, result=None, exception:Exception=None):
+        # future is None if nobody waits for it and cancelled if the waiting coroutine was cancelled
+        if future is None or not future.set_running_or_notify_cancel():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
 
     def run(self):
         self.logger.info('SerialCommunicator started')
         self._fire_status_change_handler(connected=False)
         while not self._stop_flag.is_set():
             try:
+                if self._reconnect_requested and self.__ser is not None:
+                    raise ReconnectRequested(f"Reconnect to {self._filename} requested.")
+
                 # Initialize serial port
                 if self.__ser is None:
+                    self._reconnect_requested = False
                     self.__ser = serial.Serial(self._filename, self._baud_rate, timeout=0.1)
+                    self._reconnect_backoff.reset()
                     self.logger.info("Established serial connection to %s - baudrate: %d", self._filename, self._baud_rate)
                     self.is_serial_connected.set()
                     self._fire_status_change_handler(connected=True)
 
                 # If there's messages in transmit queue
                 # send them
-                while True:
-                    packet = self._get_from_send_queue()
-                    if not packet:
-                        break
-                    self.logger.debug("send msg: %s", packet)
-                    self.__ser.write(bytearray(packet.build()))
+                self._transmit_pending(self.__ser.write)
 
                 # Read chars from serial port as hex numbers
-                self._buffer.extend(bytearray(self.__ser.read(16)))
+                # read everything which is available (at least one byte or until timeout)
+                self._buffer.extend(bytearray(self.__ser.read(max(1, self.__ser.in_waiting))))
+                self._flush_rate_limiter()
                 self.parse()
                 time.sleep(0)
 
             except (serial.SerialException, IOError) as e:
                 self._fire_status_change_handler(connected=False)
                 self.is_serial_connected.clear()
-                self.logger.error(e)
+                if isinstance(e, ReconnectRequested):
+                    self.logger.info(e)
+                else:
+                    self.logger.error(e)
+                if self.__ser is not None:
+                    self.__ser.close()
                 self.__ser = None
-                if self._auto_reconnect:
-                    self.logger.info("Serial communication crashed. Wait %s seconds for reconnection.", self.__recon_time)
-                    time.sleep(self.__recon_time)
+                self._fail_pending_sends(f"Connection to {self._filename} lost.")
+                if self._auto_reconnect or isinstance(e, ReconnectRequested):
+                    self._wait_for_reconnection(e)
                 else:
                     self._stop_flag.set()
 
@@ -238,6 +591,8 @@ class ESP3SerialCommunicator(Communicator):
             self.__ser = None
         self.is_serial_connected.clear()
         self._fire_status_change_handler(connected=False)
+        self._fail_pending_sends("Communicator stopped.")
+        self._stop_delivery()
         self.logger.info('SerialCommunicator stopped')
 
 
@@ -245,14 +600,32 @@ class ESP3SerialCommunicator(Communicator):
         ''' Parses messages and puts them to receive queue '''
         # Loop while we get new messages
         while True:
-            status, self._buffer, packet = Packet.parse_msg(self._buffer)
+            buffer = self._buffer
+            status, self._buffer, packet = Packet.parse_msg(buffer)
             # If message is incomplete -> break the loop
             if status == PARSE_RESULT.INCOMPLETE:
+                if self._callback_batching:
+                    self._flush_callback_batch()
                 return status
 
             # If message is OK, add it to receive queue or send to the callback method
             if status == PARSE_RESULT.OK and packet:
                 packet.received = datetime.datetime.now()
+                # keep the original telegram bytes (header, data, optional data and crcs) for forwarding
+                frame_end = len(buffer) - len(self._buffer)
+                packet.raw = bytes(buffer[frame_end - 7 - len(packet.data) - len(packet.optional):frame_end])
+                if self._frame_ring is not None:
+                    self._frame_ring.write_message(packet)
+
+                if packet.packet_type == PACKET.RESPONSE:
+                    if self._send_window > 0:
+                        self._on_send_response(packet)
+                    self._dispatch_response(packet)
+                else:
+                    if self._state_cache is not None:
+                        self._state_cache.update(packet, self._gateway_id)
+                    if self._link_quality is not None:
+                        self._link_quality.update(packet, self._gateway_id)
 
                 if isinstance(packet, UTETeachInPacket) and self.teach_in:
                     response_packet = packet.create_response_packet(self.base_id)
@@ -261,7 +634,7 @@ class ESP3SerialCommunicator(Communicator):
 
                 if self._outside_callback is None:
                     self.receive.put(packet)
-                else:
+                if self._outside_callback is not None or self._message_hub.has_subscribers:
                     self.__callback_wrapper(packet)
                 self.logger.debug(packet)
 
@@ -282,71 +655,74 @@ class ESP3SerialCommunicator(Communicator):
 
     @property
     def base_id(self):
-        asyncio.run(self.async_base_id)
+        return asyncio.run(self.async_base_id)
 
     @property
     async def async_base_id(self):
         ''' Fetches Base ID from the transmitter, if required. Otherwise returns the currently set Base ID. '''
-        try:
-            callback = self._outside_callback
-            self._outside_callback = None
-
-            # If base id is already set, return it.
-            if self._base_id is not None:
-                return self._base_id
-
-            # Send COMMON_COMMAND 0x08, CO_RD_IDBASE request to the module
-            await self.send_base_id_request()
-            # Loop over 10 times, to make sure we catch the response.
-            # Thanks to timeout, shouldn't take more than a second.
-            # Unfortunately, all other messages received during this time are ignored.
-            for i in range(0, 10):
-                try:
-                    packet = self.receive.get(block=True, timeout=0.1)
-                    # We're only interested in responses to the request in question.
-                    if packet.packet_type == PACKET.RESPONSE and packet.response == RETURN_CODE.OK and len(packet.response_data) == 4:  # noqa: E501
-                        # Base ID is set in the response data.
-                        self._base_id = packet.response_data
-                        # Put packet back to the Queue, so the user can also react to it if required...
-                        self.receive.put(packet)
-                        break
-                    # Put other packets back to the Queue.
-                    self.receive.put(packet)
-                except queue.Empty:
-                    continue
-            # Return the current Base ID (might be None).
+        # If base id is already set, return it.
+        if self._base_id is not None:
             return self._base_id
-        finally:
-            self._outside_callback = callback
+
+        # Send COMMON_COMMAND 0x08, CO_RD_IDBASE request to the module
+        # We're only interested in responses to the request in question. All other messages are delivered as usual.
+        packet = await self._request_response([0x08], lambda p: p.response == RETURN_CODE.OK and len(p.response_data) == 4)
+        if packet is not None:
+            # Base ID is set in the response data.
+            self._base_id = packet.response_data
+        # Return the current Base ID (might be None).
+        return self._base_id
+
+    async def async_version(self) -> GatewayVersion | None:
+        ''' Requests app and api version, chip id and app description (CO_RD_VERSION). None if the gateway does not answer. '''
+        packet = await self._request_response([0x03], lambda p: p.response == RETURN_CODE.OK and len(p.response_data) == 32)
+        if packet is None:
+            return None
+        data = bytes(packet.response_data)
+        return GatewayVersion(
+            app_version='.'.join(str(b) for b in data[0:4]),
+            api_version='.'.join(str(b) for b in data[4:8]),
+            chip_id=data[8:12],
+            chip_version=data[12:16],
+            app_description=data[16:32].split(b'\x00')[0].decode('ascii', errors='replace'))
 
     async def get_repeater_mode(self) -> int | None:
+        ''' Returns repeater mode: 0 = disabled, 1 = repeater level 1, 2 = repeater level 2. None if the gateway does not answer. '''
+        # Send COMMON_COMMAND 0x0a, CO_RD_REPEATER request to the module
+        packet = await self._request_response([0x0A], lambda p: p.response == RETURN_CODE.OK and len(p.response_data) == 2)
+        if packet is None:
+            return None
+        # response data: [enabled, level]
+        return packet.response_data[1] if packet.response_data[0] else 0
+
+    async def _request_response(self, command:list, predicate:Callable[[Packet], bool], timeout:float=1.0) -> Packet | None:
+        ''' Sends a common command and waits for the matching response. Returns None if no response arrives within the timeout. '''
+        future = concurrent.futures.Future()
+        waiter = (predicate, future)
+        with self._response_waiters_lock:
+            self._response_waiters.append(waiter)
         try:
-            callback = self._outside_callback
-            self._outside_callback = None
-
-            # Send COMMON_COMMAND 0x0a, CO_RD_IDBASE request to the module
-            super().send(Packet(PACKET.COMMON_COMMAND, data=[0x08]))
-            # Loop over 10 times, to make sure we catch the response.
-            # Thanks to timeout, shouldn't take more than a second.
-            # Unfortunately, all other messages received during this time are ignored.
-            for i in range(0, 10):
-                try:
-                    packet = self.receive.get(block=True, timeout=0.1)
-                    # We're only interested in responses to the request in question.
-                    if packet.packet_type == PACKET.RESPONSE and packet.response == RETURN_CODE.OK and len(packet.response_data) == 4:  # noqa: E501
-                        # Base ID is set in the response data.
-                        self._base_id = packet.response_data
-                        # Put packet back to the Queue, so the user can also react to it if required...
-                        self.receive.put(packet)
-                        break
-                    # Put other packets back to the Queue.
-                    self.receive.put(packet)
-                except queue.Empty:
-                    continue
-            # Return the current Base ID (might be None).
-            return self._base_id
+            super().send(Packet(PACKET.COMMON_COMMAND, data=command, optional=[]))
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            return None
         finally:
-            self._outside_callback = callback
+            with self._response_waiters_lock:
+                if waiter in self._response_waiters:
+                    self._response_waiters.remove(waiter)
+
+    def _dispatch_response(self, packet:Packet) -> None:
+        ''' Hands a response over to the first request which is waiting for it. '''
+        with self._response_waiters_lock:
+            for waiter in self._response_waiters:
+                if waiter[0](packet):
+                    self._response_waiters.remove(waiter)
+                    break
+            else:
+                return
+        # future could have been cancelled by a timeout in the meantime
+        if waiter[1].set_running_or_notify_cancel():
+            waiter[1].set_result(packet)
 
     
 if __name__ == '__main__':
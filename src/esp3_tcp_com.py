@@ -1,19 +1,30 @@
 import asyncio
-import socket
+import selectors
 import time
 import logging
-import select
-from typing import Callable, Union
+from typing import Callable, NamedTuple, Union
 from enocean.protocol.packet import Packet, PACKET
+from enocean.protocol.constants import PARSE_RESULT, RETURN_CODE
 from eltakobus.message import ESP2Message
 
 from zeroconf import ServiceBrowser, Zeroconf, ServiceStateChange
 
-## only for debug
-if __name__ == '__main__':
-    from esp3_serial_com import ESP3SerialCommunicator
-else:
-    from .esp3_serial_com import ESP3SerialCommunicator
+## only for debug (allows to run this file directly, e.g. python src/esp3_tcp_com.py)
+if not __package__:
+    import os
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = 'src'
+
+from .esp3_serial_com import ESP3SerialCommunicator
+from .bounded_queue import DROP_OLDEST
+from .communicator_mixin import TCPConnectionMixin
+from .tcp_utils import enable_tcp_keepalive, remember_addresses
+from .state_cache import DeviceStateCache
+from .rate_limiter import AddressRateLimiter
+from .frame_ring import FrameRingWriter
+from .lifecycle import ReconnectRequested
+from .link_quality import LinkQualityIndex
 
 
 def detect_lan_gateways() -> list[str]:
@@ -40,6 +51,10 @@ def detect_lan_gateways() -> list[str]:
                 if ip_adr not in result:
                     result.append(ip_adr)
 
+        # communicators configured with the hostname connect without another mDNS lookup
+        if result:
+            remember_addresses(service_name, result)
+
         zeroconf.close()
         
     except Exception:
@@ -48,7 +63,88 @@ def detect_lan_gateways() -> list[str]:
     return result
 
 
-class TCP2SerialCommunicator(ESP3SerialCommunicator):
+class GatewayProbeResult(NamedTuple):
+    host: str
+    port: int
+    connect_time: float                 # seconds until TCP connection was established
+    round_trip_time: float | None       # seconds until CO_RD_IDBASE was answered, None if there was no answer
+    base_id: bytes | None
+
+    @property
+    def latency(self) -> float:
+        return self.connect_time + (self.round_trip_time or 0)
+
+
+async def probe_lan_gateway(host:str, port:int, timeout:float=2) -> GatewayProbeResult | None:
+    ''' Measures TCP connect time and round trip time of a CO_RD_IDBASE request. Returns None if the gateway is not reachable. '''
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    connect_time = time.perf_counter() - started
+
+    round_trip_time = None
+    base_id = None
+    try:
+        started = time.perf_counter()
+        writer.write(bytes(Packet(PACKET.COMMON_COMMAND, data=[0x08], optional=[]).build()))
+        await writer.drain()
+
+        deadline = started + timeout
+        buffer = []
+        while base_id is None:
+            data = await asyncio.wait_for(reader.read(1024), max(0, deadline - time.perf_counter()))
+            if not data:
+                break
+            buffer.extend(data)
+            while True:
+                status, buffer, packet = Packet.parse_msg(buffer)
+                if status == PARSE_RESULT.INCOMPLETE:
+                    break
+                # radio telegrams received in the meantime are ignored
+                if status == PARSE_RESULT.OK and packet.packet_type == PACKET.RESPONSE and packet.response == RETURN_CODE.OK and len(packet.response_data) == 4:
+                    round_trip_time = time.perf_counter() - started
+                    base_id = bytes(packet.response_data)
+                    break
+    except (OSError, asyncio.TimeoutError):
+        pass
+    finally:
+        writer.close()
+
+    return GatewayProbeResult(host, port, connect_time, round_trip_time, base_id)
+
+
+async def rank_lan_gateways(hosts:list[str], port:int=5100, timeout:float=2) -> list[GatewayProbeResult]:
+    """Probes all gateways concurrently and returns the reachable ones, fastest first.
+    Gateways which answered with a base id come before the ones which did not. If several addresses lead to the same gateway (same base id) only the fastest is kept.
+
+    Args:
+        hosts (list[str]): IP addresses or hostnames e.g. of detect_lan_gateways().
+        port (int, optional): Port of the gateways. Defaults to 5100.
+        timeout (float, optional): Max time for connect and for the base id request. Defaults to 2.
+    """
+    results = await asyncio.gather(*(probe_lan_gateway(host, port, timeout) for host in hosts))
+    results = sorted((r for r in results if r is not None), key=lambda r: (r.base_id is None, r.latency))
+
+    ranked = []
+    known_base_ids = set()
+    for result in results:
+        if result.base_id is not None:
+            if result.base_id in known_base_ids:
+                continue
+            known_base_ids.add(result.base_id)
+        ranked.append(result)
+    return ranked
+
+
+async def detect_ranked_lan_gateways(port:int=5100, timeout:float=2) -> list[GatewayProbeResult]:
+    ''' Detects gateways via mDNS and returns them ranked by latency (see rank_lan_gateways). '''
+    hosts = await asyncio.get_running_loop().run_in_executor(None, detect_lan_gateways)
+    return await rank_lan_gateways(hosts, port, timeout)
+
+
+class TCP2SerialCommunicator(TCPConnectionMixin, ESP3SerialCommunicator):
     
     KEEP_ALIVE_MESSAGES = [
         b'IM2M'     # keep-alive-message for PioTek LAN Gateway
@@ -61,9 +157,25 @@ class TCP2SerialCommunicator(ESP3SerialCommunicator):
         callback:Callable[Union[ESP2Message, Packet], None]=None, 
         auto_reconnect=True,
         reconnection_timeout:float=60,
+        reconnection_initial_delay:float=0.5,
         tcp_keep_alive_timeout:float=60,
         tcp_connection_timeout:float = 1,
-        esp2_translation_enabled:bool=False): 
+        esp2_translation_enabled:bool=False,
+        callback_batching:bool=False,
+        callback_batch_interval:float=0,
+        receive_queue_size:int=0,
+        receive_drop_policy:str=DROP_OLDEST,
+        kernel_keep_alive:bool=False,
+        state_cache:DeviceStateCache=None,
+        send_cache_size:int=128,
+        send_window:int=0,
+        send_timeout:float=1,
+        send_retries:int=2,
+        rate_limiter:AddressRateLimiter=None,
+        frame_ring:FrameRingWriter=None,
+        connect_timeout:float=3,
+        link_quality:LinkQualityIndex=None,
+        gateway_id:int=0): 
         """TCP2SerialCommunicator can connect to e.g. a Wifi bridge and transfer EnOcean telegrams to serial so that e.g. Home Assistant can consume it.
 
         Args:
@@ -72,14 +184,31 @@ class TCP2SerialCommunicator(ESP3SerialCommunicator):
             loggr (logging.Logger, optional): Logger. Defaults to logging.getLogger('eltakobus.tcp2serial').
             callback (Callable[Union[ESP2Message, Packet], None], optional): Callback function which takes received message for data processing. Defaults to None.
             auto_reconnect (bool, optional): When enabled tries to restart the connection after unwanted disconnect. Defaults to True.
-            reconnection_timeout (float, optional): When there is a disconnect this adapter will wait for X seconds before trying to restart. Defaults to 60.
+            reconnection_timeout (float, optional): Max time in seconds to wait between two reconnection attempts. Defaults to 60.
+            reconnection_initial_delay (float, optional): Time to wait before the first reconnection attempt. It doubles (with random jitter) after every failed attempt up to reconnection_timeout. Defaults to 0.5.
+            tcp_keep_alive_timeout (float, optional): A connection without any received data for X seconds is considered dead. Before that a base id request is sent as probe. Defaults to 60.
             tcp_connection_timeout (float, optional): Connection timeout of TCP operation to avoid endless waiting for response. Defaults to 0. (https://docs.python.org/3/library/socket.html#socket.socket.settimeout)
+            connect_timeout (float, optional): Max time for establishing the TCP connection. All resolved addresses of host are tried in parallel and resolved addresses are cached. Defaults to 3.
             esp2_translation_enabled (bool, optional): Converts ESP3 messages into ESP2 and passes it to the callback function otherwise ESP3 message will be passed. Defaults to False.
+            callback_batching (bool, optional): Callback receives a list of all messages parsed from one read instead of single messages. Defaults to False.
+            callback_batch_interval (float, optional): When batching is enabled messages are collected for at least X seconds before the callback is called. Defaults to 0.
+            receive_queue_size (int, optional): Capacity of the receive queue which is filled when no callback is set. 0 means unbounded. Defaults to 0.
+            receive_drop_policy (str, optional): What to drop when the receive queue is full: 'drop_oldest' or 'drop_newest'. Defaults to 'drop_oldest'.
+            state_cache (DeviceStateCache, optional): Keeps the latest telegram of every device so that states are available via get_device_states() right after startup. Defaults to None.
+            kernel_keep_alive (bool, optional): Dead connections are detected by TCP keep-alive of the OS within tcp_keep_alive_timeout instead of sending probe telegrams. Application-level probes are only used if the OS does not support it. Defaults to False.
+            send_cache_size (int, optional): Number of ESP2 messages for which the translated ESP3 telegram is kept. 0 disables the cache. Defaults to 128.
+            send_window (int, optional): Max number of telegrams which wait for their response from the gateway at the same time. When enabled send() waits for RET_OK and raises SendError otherwise. 0 disables acknowledgement tracking. Defaults to 0.
+            send_timeout (float, optional): Time to wait for the response of a telegram when send_window is enabled. After a timeout all telegrams in flight are sent again after a quiet period of the same length. Defaults to 1.
+            send_retries (int, optional): How often a telegram is sent again after RET_ERROR, no free buffer or timeout when send_window is enabled. Defaults to 2.
+            rate_limiter (AddressRateLimiter, optional): Limits how often telegrams of one address are passed to the callback and subscribers. Only the latest telegram within an interval is passed. Defaults to None.
+            frame_ring (FrameRingWriter, optional): Publishes every received telegram into a shared memory ring buffer which other processes on the same host can follow with FrameRingReader. Defaults to None.
+            link_quality (LinkQualityIndex, optional): Collects signal strength and sub-telegram counts of received radio telegrams per sender. Defaults to None.
+            gateway_id (int, optional): Identifies this gateway in the link quality index and state cache when they are shared by several communicators. Defaults to 0.
         """
         
+        self._kernel_keep_alive = kernel_keep_alive
+        self._app_level_keep_alive = True
         self._tcp_keep_alive_timeout = tcp_keep_alive_timeout
-        self._tcp_connection_timeout = tcp_connection_timeout
-        self.__recon_time = reconnection_timeout
         self.esp2_translation_enabled = esp2_translation_enabled
         self._outside_callback = callback
         self._auto_reconnect = auto_reconnect
@@ -90,16 +219,31 @@ class TCP2SerialCommunicator(ESP3SerialCommunicator):
             callback = callback, 
             baud_rate = None, 
             reconnection_timeout = reconnection_timeout, 
+            reconnection_initial_delay = reconnection_initial_delay,
             esp2_translation_enabled = esp2_translation_enabled, 
-            auto_reconnect = auto_reconnect)
+            auto_reconnect = auto_reconnect,
+            callback_batching = callback_batching,
+            callback_batch_interval = callback_batch_interval,
+            receive_queue_size = receive_queue_size,
+            receive_drop_policy = receive_drop_policy,
+            state_cache = state_cache,
+            send_cache_size = send_cache_size,
+            send_window = send_window,
+            send_timeout = send_timeout,
+            send_retries = send_retries,
+            rate_limiter = rate_limiter,
+            frame_ring = frame_ring,
+            link_quality = link_quality,
+            gateway_id = gateway_id)
 
-        self._host = host
-        self._port = port
         self.log = logger
 
         self.daemon = True
         self.__ser = None
 
+        # transmit queue of ESP3SerialCommunicator wakes up the selector via _interrupt_wait()
+        self._init_tcp_connection(host, port, connect_timeout, tcp_connection_timeout)
+        self._keep_alive_probe_sent = False
 
     @property
     def host(self):
@@ -124,79 +268,119 @@ class TCP2SerialCommunicator(ESP3SerialCommunicator):
         self.last_message_received = time.time()
         self.log.info('TCP2SerialCommunicator started')
         self._fire_status_change_handler(connected=False)
+        selector = None
         while not self._stop_flag.is_set():
             try:
+                if self._reconnect_requested and self.__ser is not None:
+                    raise ReconnectRequested(f"Reconnect to {self._host}:{self._port} requested.")
+
                 # Initialize serial port
                 if self.__ser is None:
-                    
-                    self.__ser = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    self.__ser.connect((self._host, self._port))
-                    if self._auto_reconnect:
-                        self.__ser.settimeout(self._tcp_connection_timeout)
-                    else:
-                        self.__ser.settimeout(None)
+                    self._reconnect_requested = False
+                    self.__ser = self._open_connection()
+
+                    self._app_level_keep_alive = True
+                    if self._kernel_keep_alive:
+                        self._app_level_keep_alive = not enable_tcp_keepalive(self.__ser, self._tcp_keep_alive_timeout)
 
-                    self.log.info(f"Established TCP connection to {self._host}:{self._port} (blocking: {not self._auto_reconnect}, tcp timeout: {self._tcp_connection_timeout} sec, serial timeout: {self._tcp_keep_alive_timeout} sec)")
+                    selector = selectors.DefaultSelector()
+                    selector.register(self.__ser, selectors.EVENT_READ)
+                    selector.register(self._wakeup, selectors.EVENT_READ)
+                    self.last_message_received = time.time()
+                    self._keep_alive_probe_sent = False
+
+                    self.log.info(f"Established TCP connection to {self._host}:{self._port} (blocking: {not self._auto_reconnect}, tcp timeout: {self._tcp_connection_timeout} sec, serial timeout: {self._tcp_keep_alive_timeout} sec, kernel keep-alive: {not self._app_level_keep_alive})")
                     
                     self.is_serial_connected.set()
                     self._fire_status_change_handler(connected=True)
                 
-                self._check_timeout_on_application_level()
+                timeout = self._check_timeout_on_application_level()
 
                 # If there's messages in transmit queue
                 # send them
-                while True:
-                    packet = self._get_from_send_queue()
-                    if not packet:
-                        break
-                    self.log.debug("send msg: %s", packet)
-                    self.__ser.sendall( bytearray(packet.build()) )
+                self._transmit_pending(self.__ser.sendall)
+
+                send_timeout = self._next_send_deadline()
+                if send_timeout is not None:
+                    timeout = send_timeout if timeout is None else min(timeout, send_timeout)
+                timeout = self._next_delivery_timeout(timeout)
+
+                # Wait until data arrives, something needs to be sent or a timer is due.
+                # Without application-level keep-alive this blocks until there is something to do.
+                ready_to_read = False
+                for key, _ in selector.select(timeout):
+                    if key.fileobj is self._wakeup:
+                        self._wakeup.clear()
+                    else:
+                        ready_to_read = True
 
-                
-                # Read chars from serial port as hex numbers
-                # prevent to block recv operation
-                ready_to_read, _, _ = select.select([self.__ser], [], [], 1) # timeout 1sec
+                self._flush_rate_limiter()
 
                 if ready_to_read:
                     data = self.__ser.recv(1024)
+                    if not data:
+                        raise ConnectionError(f"Connection closed by {self._host}:{self._port}")
                     # print(hex(int.from_bytes(data, "big")))
                     if data not in self.KEEP_ALIVE_MESSAGES:
-                        self._buffer = data
+                        # keep incomplete telegrams of previous reads
+                        self._buffer.extend(data)
                         self.parse()
                     self.last_message_received = time.time()
-                        
-                time.sleep(0)
+                    self._keep_alive_probe_sent = False
+                elif self._callback_batching:
+                    self._flush_callback_batch()
 
             except Exception as e:
+                self._connection_lost()
                 self._fire_status_change_handler(connected=False)
                 self.is_serial_connected.clear()
-                self.log.exception(e)
+                if isinstance(e, ReconnectRequested):
+                    self.log.info(e)
+                else:
+                    self.log.exception(e)
+                if selector is not None:
+                    selector.close()
+                    selector = None
                 if self.__ser is not None:
                     self.__ser.close()
                 self.__ser = None
-                if self._auto_reconnect:
-                    self.log.info("TCP2Serial communication crashed. Wait %s seconds for reconnection.", self.__recon_time)
-                    time.sleep(self.__recon_time)
+                self._buffer = []
+                self._fail_pending_sends(f"Connection to {self._host}:{self._port} lost.")
+                if self._auto_reconnect or isinstance(e, ReconnectRequested):
+                    self._wait_for_reconnection(e)
                 else:
                     self.log.debug(f"auto-reconnect is disabled ({self._auto_reconnect})")
                     self._stop_flag.set()
 
+        if selector is not None:
+            selector.close()
         if self.__ser is not None:
             self.__ser.close()
             self.__ser = None
         self.is_serial_connected.clear()
         self._fire_status_change_handler(connected=False)
+        self._fail_pending_sends("Communicator stopped.")
+        self._stop_delivery()
         self.logger.info('TCP2SerialCommunicator stopped')
 
 
-    def _check_timeout_on_application_level(self):
-        if self._auto_reconnect:
-            if time.time() - self.last_message_received > self._tcp_keep_alive_timeout:  # after 10s without receiving something disconnect
-                self.last_message_received = 0
-                self.__ser.close()
-            elif self.transmit.empty() and time.time() - self.last_message_received > self._tcp_keep_alive_timeout -1:
+    def _check_timeout_on_application_level(self) -> float | None:
+        ''' Sends a probe telegram shortly before the keep-alive timeout and closes the connection when the timeout is reached. Returns seconds until the next check is due or None if no check is needed. '''
+        if not self._auto_reconnect or not self._app_level_keep_alive:
+            return None
+
+        idle_time = time.time() - self.last_message_received
+        if idle_time > self._tcp_keep_alive_timeout:
+            raise ConnectionError(f"No data received from {self._host}:{self._port} for {self._tcp_keep_alive_timeout} seconds.")
+        
+        if idle_time > self._tcp_keep_alive_timeout -1:
+            if not self._keep_alive_probe_sent and self.transmit.empty():
                 self.log.debug(f"Request base id to check if connection is still alive.")
+                self._keep_alive_probe_sent = True
                 self.transmit.put(Packet(PACKET.COMMON_COMMAND, data=[0x08]))
+            return self._tcp_keep_alive_timeout - idle_time
+
+        return self._tcp_keep_alive_timeout - 1 - idle_time
                 
 
 
@@ -0,0 +1,218 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterator, Union
+
+from enocean.protocol.packet import Packet
+
+from eltakobus.message import ESP2Message
+
+from .frames import FRAME_HEADER, Frame, encode_message
+
+# magic, capacity of data area and positions in the stream of all bytes ever written:
+# end of the last complete frame (commit), end up to which the writer may be writing (reserve), oldest complete frame (tail)
+RING_HEADER = struct.Struct('<8sQQQQ')
+_POSITION = struct.Struct('<Q')
+_COMMIT_POS_OFFSET = 16
+_RESERVE_POS_OFFSET = 24
+_TAIL_POS_OFFSET = 32
+RING_MAGIC = b'ESPRING1'
+# data area starts cache line aligned
+RING_DATA_OFFSET = 64
+# protocol of a frame which only fills the rest of the data area before the writer wraps around
+_PADDING = 0xFF
+
+
+class FrameRingWriter():
+    ''' Publishes received telegrams as frames (see frames.py) into a file-backed shared memory ring buffer.
+
+    There is exactly one writer per file, any number of processes on the same host can follow it with FrameRingReader.
+    The writer never waits for readers: readers which are too slow lose the overwritten frames. Use a file on a
+    memory file system (e.g. /dev/shm) to avoid disk writes.
+    '''
+
+    def __init__(self, path:str, capacity:int=1 << 20, gateway_id:int=0):
+        """_summary_
+
+        Args:
+            path (str): File which is mapped into memory. It is created if it does not exist.
+            capacity (int, optional): Size of the data area in bytes. Defaults to 1 MiB.
+            gateway_id (int, optional): Gateway id which is written into every frame. Defaults to 0.
+        """
+        if capacity < 2 * FRAME_HEADER.size:
+            raise ValueError(f"Capacity of ring buffer must be at least {2 * FRAME_HEADER.size} bytes")
+        self.path = path
+        self.capacity = capacity
+        self.gateway_id = gateway_id
+        self._lock = threading.Lock()
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, RING_DATA_OFFSET + capacity)
+            self._mmap = mmap.mmap(fd, RING_DATA_OFFSET + capacity)
+        finally:
+            os.close(fd)
+
+        # continue the stream of a previous writer so that running readers stay in sync
+        magic, old_capacity, write_pos, _, tail_pos = RING_HEADER.unpack_from(self._mmap, 0)
+        if magic != RING_MAGIC or old_capacity != capacity:
+            write_pos = tail_pos = 0
+        self._write_pos = write_pos
+        self._tail_pos = tail_pos
+        RING_HEADER.pack_into(self._mmap, 0, RING_MAGIC, capacity, write_pos, write_pos, tail_pos)
+
+    @property
+    def write_pos(self) -> int:
+        return self._write_pos
+
+    def write_message(self, msg:Union[ESP2Message, Packet]) -> None:
+        ''' Publishes a received ESP2Message or ESP3 Packet. '''
+        self.write_frame(encode_message(self.gateway_id, msg))
+
+    def write_frame(self, frame:bytes) -> None:
+        ''' Publishes an encoded frame. '''
+        size = len(frame)
+        if size > self.capacity:
+            raise ValueError(f"Frame of {size} bytes does not fit into ring buffer of {self.capacity} bytes")
+
+        with self._lock:
+            write_pos = self._write_pos
+            offset = write_pos % self.capacity
+            rest = self.capacity - offset
+            padding_offset = None
+            if rest < size:
+                # frames are never split, fill the rest of the data area and continue at its beginning
+                if rest >= FRAME_HEADER.size:
+                    padding_offset = offset
+                write_pos += rest
+                offset = 0
+
+            # the region is released before anything is written into it: readers check the reserve position to detect
+            # frames (including the one under the padding header) which are overwritten while they read them
+            self._advance_tail(write_pos, write_pos + size)
+            _POSITION.pack_into(self._mmap, _RESERVE_POS_OFFSET, write_pos + size)
+            if padding_offset is not None:
+                FRAME_HEADER.pack_into(self._mmap, RING_DATA_OFFSET + padding_offset, 0, 0, 0, _PADDING, 0, rest - FRAME_HEADER.size)
+            start = RING_DATA_OFFSET + offset
+            self._mmap[start:start + size] = frame
+            # publish the frame after the data is written
+            self._write_pos = write_pos + size
+            _POSITION.pack_into(self._mmap, _COMMIT_POS_OFFSET, self._write_pos)
+
+    def _advance_tail(self, start_pos:int, end_pos:int) -> None:
+        ''' Moves the tail behind all frames which are overwritten by a frame written from start_pos to end_pos. '''
+        tail_pos = self._tail_pos
+        while tail_pos < end_pos - self.capacity:
+            if tail_pos >= self._write_pos:
+                # all written frames and the padding in front of the new frame are overwritten
+                tail_pos = start_pos
+                break
+            offset = tail_pos % self.capacity
+            rest = self.capacity - offset
+            if rest < FRAME_HEADER.size:
+                tail_pos += rest
+                continue
+            protocol, length = struct.unpack_from('<BxH', self._mmap, RING_DATA_OFFSET + offset + 14)
+            tail_pos += rest if protocol == _PADDING else FRAME_HEADER.size + length
+        if tail_pos != self._tail_pos:
+            self._tail_pos = tail_pos
+            _POSITION.pack_into(self._mmap, _TAIL_POS_OFFSET, tail_pos)
+
+    def close(self) -> None:
+        with self._lock:
+            self._mmap.close()
+
+
+class FrameRingReader():
+    ''' Follows a ring buffer written by FrameRingWriter.
+
+    Returned frames do not copy the telegram bytes: raw is a memoryview into the shared memory. It stays valid until
+    the writer wrapped around once, so copy it (bytes(frame.raw)) if it is kept longer. Frames overwritten before they
+    were read are counted in lost_bytes.
+    '''
+
+    def __init__(self, path:str, from_start:bool=False):
+        """_summary_
+
+        Args:
+            path (str): File of the ring buffer.
+            from_start (bool, optional): Starts with the oldest frame which is still in the buffer instead of only new frames. Defaults to False.
+        """
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+        magic, self.capacity, write_pos, _, tail_pos = RING_HEADER.unpack_from(self._mmap, 0)
+        if magic != RING_MAGIC:
+            raise ValueError(f"{path} is not a frame ring buffer")
+
+        self._read_pos = tail_pos if from_start else write_pos
+        self.lost_bytes = 0
+        self.overruns = 0
+
+    def poll(self, max_frames:int=None) -> list[Frame]:
+        ''' Returns all frames which were written since the last call. '''
+        write_pos = _POSITION.unpack_from(self._mmap, _COMMIT_POS_OFFSET)[0]
+        if _POSITION.unpack_from(self._mmap, _RESERVE_POS_OFFSET)[0] < self._read_pos:
+            # a new writer started with an empty buffer (the read position can be ahead of the commit position after
+            # an overrun, but never ahead of the reserve position)
+            self._read_pos = 0
+        self._skip_overwritten()
+
+        frames = []
+        read_pos = self._read_pos
+        while read_pos < write_pos and (max_frames is None or len(frames) < max_frames):
+            offset = read_pos % self.capacity
+            rest = self.capacity - offset
+            if rest < FRAME_HEADER.size:
+                read_pos += rest
+                continue
+            frame, next_offset = self._decode(offset)
+            if frame.protocol == _PADDING:
+                read_pos += rest
+                continue
+            frames.append(frame)
+            read_pos += next_offset - offset
+
+        # the writer may have overwritten the region while it was read
+        if self._skip_overwritten():
+            return []
+
+        self._read_pos = read_pos
+        return frames
+
+    def _decode(self, offset:int) -> tuple[Frame, int]:
+        start = RING_DATA_OFFSET + offset
+        timestamp, sender, gateway_id, protocol, rorg, length = FRAME_HEADER.unpack_from(self._mmap, start)
+        raw_start = start + FRAME_HEADER.size
+        frame = Frame(timestamp, sender, gateway_id, protocol, rorg, self._view[raw_start:raw_start + length])
+        return frame, offset + FRAME_HEADER.size + length
+
+    def _skip_overwritten(self) -> bool:
+        ''' Continues with the oldest complete frame if the writer overwrote frames which were not read yet. '''
+        reserve_pos = _POSITION.unpack_from(self._mmap, _RESERVE_POS_OFFSET)[0]
+        if reserve_pos - self._read_pos <= self.capacity:
+            return False
+        tail_pos = _POSITION.unpack_from(self._mmap, _TAIL_POS_OFFSET)[0]
+        self.overruns += 1
+        self.lost_bytes += tail_pos - self._read_pos
+        self._read_pos = tail_pos
+        return True
+
+    def follow(self, poll_interval:float=0.01, stop_event:threading.Event=None) -> Iterator[Frame]:
+        ''' Yields frames as they are written until stop_event is set. '''
+        while stop_event is None or not stop_event.is_set():
+            frames = self.poll()
+            if not frames:
+                time.sleep(poll_interval)
+            yield from frames
+
+    def close(self) -> None:
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # frames handed out are still referenced, the mapping is released with them
+            pass
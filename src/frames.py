@@ -0,0 +1,71 @@
+import struct
+from typing import Iterator, NamedTuple, Union
+
+from enocean.protocol.packet import Packet
+from enocean.protocol.constants import PARSE_RESULT
+
+from eltakobus.message import ESP2Message, prettify
+
+from .telegram import sender_address, telegram_rorg
+
+PROTOCOL_STATUS = 0     # connection status of a gateway, raw is b'\x01' (connected) or b'\x00'
+PROTOCOL_SEND_FAILED = 1    # a command could not be sent by a gateway, raw is length of telegram (uint16), telegram and error message (utf-8)
+PROTOCOL_ESP2 = 2
+PROTOCOL_ESP3 = 3
+
+# timestamp, sender address, gateway id, protocol, rorg, length of raw telegram
+FRAME_HEADER = struct.Struct('<dIHBBH')
+
+
+class Frame(NamedTuple):
+    ''' Compact representation of a received telegram: original telegram bytes plus pre-parsed header fields. '''
+    timestamp: float
+    sender: int
+    gateway_id: int
+    protocol: int
+    rorg: int
+    raw: Union[bytes, memoryview]
+
+    def to_message(self) -> Union[ESP2Message, Packet, None]:
+        ''' Parses the telegram bytes into an ESP2Message or ESP3 Packet. '''
+        if self.protocol == PROTOCOL_ESP2:
+            return prettify(ESP2Message.parse(bytes(self.raw)))
+        if self.protocol == PROTOCOL_ESP3:
+            status, _, packet = Packet.parse_msg(list(self.raw))
+            return packet if status == PARSE_RESULT.OK else None
+        return None
+
+
+def encode_frame(timestamp:float, gateway_id:int, protocol:int, raw:bytes, sender:int=0, rorg:int=0) -> bytes:
+    return FRAME_HEADER.pack(timestamp, sender, gateway_id, protocol, rorg, len(raw)) + raw
+
+
+def encode_message(gateway_id:int, msg:Union[ESP2Message, Packet]) -> bytes:
+    ''' Encodes a received ESP2Message or ESP3 Packet into a frame. '''
+    if isinstance(msg, ESP2Message):
+        protocol = PROTOCOL_ESP2
+        raw = msg.serialize()
+    else:
+        protocol = PROTOCOL_ESP3
+        raw = getattr(msg, 'raw', None) or bytes(msg.build())
+
+    received = getattr(msg, 'received', None)
+    timestamp = received.timestamp() if received is not None else 0.0
+
+    return encode_frame(timestamp, gateway_id, protocol, raw, sender_address(msg) or 0, telegram_rorg(msg) or 0)
+
+
+def decode_frame(buffer:Union[bytes, memoryview], offset:int=0) -> tuple[Frame, int]:
+    ''' Decodes the frame at the given offset and returns it together with the offset of the next frame. raw is a slice of the given buffer. '''
+    timestamp, sender, gateway_id, protocol, rorg, length = FRAME_HEADER.unpack_from(buffer, offset)
+    start = offset + FRAME_HEADER.size
+    return Frame(timestamp, sender, gateway_id, protocol, rorg, buffer[start:start + length]), start + length
+
+
+def iter_frames(buffer:Union[bytes, memoryview]) -> Iterator[Frame]:
+    ''' Iterates over all frames which are concatenated in buffer. '''
+    offset = 0
+    end = len(buffer)
+    while offset + FRAME_HEADER.size <= end:
+        frame, offset = decode_frame(buffer, offset)
+        yield frame
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import struct
+import threading
+import time
+from typing import Callable, Union
+
+from enocean.protocol.packet import Packet
+
+from eltakobus.message import ESP2Message
+from eltakobus.util import b2s
+
+from .esp3_serial_com import ESP3SerialCommunicator
+from .frames import Frame, PROTOCOL_ESP2, PROTOCOL_ESP3, PROTOCOL_SEND_FAILED, PROTOCOL_STATUS, encode_frame, encode_message, iter_frames
+
+_TELEGRAM_LENGTH = struct.Struct('<H')
+# data length, optional data length, packet type
+_ESP3_HEADER = struct.Struct('>HBB')
+
+
+def _esp3_packet(raw:bytes) -> Packet:
+    ''' Rebuilds an ESP3 packet from its wire bytes without parsing the content (RPS and 1BS telegrams without optional data cannot be parsed as RadioPacket). '''
+    data_length, optional_length, packet_type = _ESP3_HEADER.unpack_from(raw, 1)
+    data_end = 6 + data_length
+    return Packet(packet_type, list(raw[6:data_end]), list(raw[data_end:data_end + optional_length]))
+
+
+def _encode_send_failure(gateway_id:int, telegram:bytes, error:str) -> bytes:
+    return encode_frame(time.time(), gateway_id, PROTOCOL_SEND_FAILED, _TELEGRAM_LENGTH.pack(len(telegram)) + telegram + error.encode('utf-8'))
+
+
+def _decode_send_failure(frame:Frame) -> tuple[bytes, str]:
+    raw = bytes(frame.raw)
+    length = _TELEGRAM_LENGTH.unpack_from(raw)[0]
+    start = _TELEGRAM_LENGTH.size
+    return raw[start:start + length], raw[start + length:].decode('utf-8', errors='replace')
+
+
+def _run_worker(shard:list, conn:multiprocessing.connection.Connection, batch_interval:float):
+    ''' Entry point of a worker process. Runs the communicators of one shard and forwards received telegrams as frames to the supervisor. '''
+    logger = logging.getLogger('esp2_gateway_adapter.gateway_supervisor')
+    send_lock = threading.Lock()
+    communicators = {}
+
+    def forward(data:bytes):
+        try:
+            with send_lock:
+                conn.send_bytes(data)
+        except OSError:
+            # supervisor is gone, main thread of the worker will stop the communicators
+            pass
+
+    def report_failure(gateway_id:int, raw:bytes, error):
+        logger.error("Gateway %d could not send telegram %s: %s", gateway_id, b2s(raw), error)
+        forward(_encode_send_failure(gateway_id, raw, str(error) or type(error).__name__))
+
+    for gateway_id, communicator_class, kwargs in shard:
+        def on_messages(batch, gateway_id=gateway_id):
+            forward(b''.join(encode_message(gateway_id, msg) for msg in batch))
+
+        def on_status_changed(connected:bool, gateway_id=gateway_id):
+            forward(encode_frame(time.time(), gateway_id, PROTOCOL_STATUS, b'\x01' if connected else b'\x00'))
+
+        com = communicator_class(**kwargs, callback=on_messages, callback_batching=True, callback_batch_interval=batch_interval)
+        com.set_status_changed_handler(on_status_changed)
+        com.start()
+        communicators[gateway_id] = com
+
+    # send() of ESP3 communicators is a coroutine, it runs on its own event loop so that the command loop is not
+    # blocked by a slow or disconnected gateway
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, name='GatewayWorkerSend', daemon=True)
+    loop_thread.start()
+
+    def on_sent(future, gateway_id:int, raw:bytes):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            report_failure(gateway_id, raw, error)
+        elif future.result() is False:
+            report_failure(gateway_id, raw, "Telegram was not accepted by the communicator.")
+
+    try:
+        # commands from the supervisor: (gateway id, protocol, telegram bytes)
+        # ESP2 messages for ESP3 gateways are already converted by the supervisor
+        while True:
+            gateway_id, protocol, raw = conn.recv()
+            com = communicators.get(gateway_id)
+            if com is None:
+                continue
+            try:
+                if hasattr(com, 'send_message'):
+                    if protocol != PROTOCOL_ESP2:
+                        raise ValueError("ESP2 gateway cannot send ESP3 telegrams.")
+                    com.send_message(ESP2Message.parse(raw))
+                else:
+                    if protocol != PROTOCOL_ESP3:
+                        raise ValueError("ESP3 gateway cannot send ESP2 telegrams.")
+                    future = asyncio.run_coroutine_threadsafe(com.send(_esp3_packet(raw)), loop)
+                    future.add_done_callback(lambda f, gateway_id=gateway_id, raw=raw: on_sent(f, gateway_id, raw))
+            except Exception as e:
+                # a bad command must not take down the other gateways of this worker
+                report_failure(gateway_id, raw, e)
+    except (EOFError, OSError):
+        # supervisor is gone
+        pass
+    finally:
+        for com in communicators.values():
+            com.stop()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+class _Worker():
+
+    def __init__(self, index:int, shard:list):
+        self.index = index
+        self.shard = shard
+        self.process:multiprocessing.Process = None
+        self.conn:multiprocessing.connection.Connection = None
+        self.send_lock = threading.Lock()
+        self.died_at:float = None
+        self.restarts = 0
+        self.frames = 0
+        self.send_failures = 0
+
+
+class GatewaySupervisor():
+    ''' Shards gateway connections across worker processes.
+
+    Every worker process runs the communicators of its shard (TCP2SerialCommunicator, ESP2TCP2SerialCommunicator or
+    ESP3SerialCommunicator) and forwards received telegrams as compact frames (see frames.py) over a pipe.
+    Parsing and ESP2 translation happen in the workers, so throughput scales across cores. A crashed worker is
+    restarted without touching the others.
+    '''
+
+    def __init__(self,
+                 callback:Callable[[Frame], None]=None,
+                 status_callback:Callable[[int, bool], None]=None,
+                 send_failed_callback:Callable[[int, bytes, str], None]=None,
+                 processes:int=None,
+                 batch_interval:float=0,
+                 restart_delay:float=1,
+                 logger:logging.Logger=logging.getLogger('esp2_gateway_adapter.gateway_supervisor')):
+        """_summary_
+
+        Args:
+            callback (Callable[[Frame], None], optional): Is called for every received telegram. Frame.to_message() parses it. Defaults to None.
+            status_callback (Callable[[int, bool], None], optional): Is called with gateway id and connection status when a gateway connects or disconnects. Defaults to None.
+            send_failed_callback (Callable[[int, bytes, str], None], optional): Is called with gateway id, telegram bytes and error message when a gateway could not send a telegram passed to send(). Defaults to None.
+            processes (int, optional): Number of worker processes. Defaults to number of cpus.
+            batch_interval (float, optional): Workers collect telegrams for X seconds before forwarding them in one pipe message. Defaults to 0 (one pipe message per read).
+            restart_delay (float, optional): Wait time before a crashed worker is restarted. Defaults to 1.
+            logger (logging.Logger, optional): Logger. Defaults to logging.getLogger('esp2_gateway_adapter.gateway_supervisor').
+        """
+        self._callback = callback
+        self._status_callback = status_callback
+        self._send_failed_callback = send_failed_callback
+        self._processes = processes or os.cpu_count() or 1
+        self._batch_interval = batch_interval
+        self._restart_delay = restart_delay
+        self.logger = logger
+
+        self._gateways = []
+        self._communicator_classes:dict[int, type] = {}
+        self._workers:list[_Worker] = []
+        self._worker_by_gateway:dict[int, _Worker] = {}
+        self._context = multiprocessing.get_context('spawn')
+        self._stop_flag = threading.Event()
+        self._thread:threading.Thread = None
+
+    def add_gateway(self, communicator_class:type, **kwargs) -> int:
+        ''' Registers a gateway connection. kwargs are passed to the communicator constructor (except callback). Returns the gateway id used in frames. '''
+        if self._thread is not None:
+            raise RuntimeError("Gateways must be added before the supervisor is started.")
+        gateway_id = len(self._gateways)
+        self._gateways.append((gateway_id, communicator_class, kwargs))
+        self._communicator_classes[gateway_id] = communicator_class
+        return gateway_id
+
+    def start(self):
+        shard_count = min(self._processes, len(self._gateways)) or 1
+        for index in range(shard_count):
+            worker = _Worker(index, self._gateways[index::shard_count])
+            self._workers.append(worker)
+            for gateway_id, _, _ in worker.shard:
+                self._worker_by_gateway[gateway_id] = worker
+            self._start_worker(worker)
+
+        self._thread = threading.Thread(target=self._run, name='GatewaySupervisor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_flag.set()
+        if self._thread is not None:
+            self._thread.join()
+        for worker in self._workers:
+            self._stop_worker(worker)
+
+    def send(self, gateway_id:int, msg:Union[ESP2Message, Packet]) -> bool:
+        ''' Hands a message over to the worker of the given gateway. Returns False if it cannot be sent via this gateway.
+        Errors of the gateway itself are reported asynchronously to send_failed_callback. '''
+        worker = self._worker_by_gateway.get(gateway_id)
+        if worker is None or worker.conn is None:
+            return False
+
+        command = self._build_command(gateway_id, msg)
+        if command is None:
+            return False
+        try:
+            with worker.send_lock:
+                worker.conn.send(command)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def _build_command(self, gateway_id:int, msg:Union[ESP2Message, Packet]) -> tuple | None:
+        ''' Serializes the message in the form the gateway sends it. ESP2 messages for ESP3 gateways are converted here
+        because the type of the message (e.g. Regular4BSMessage) cannot be restored reliably from its bytes. '''
+        if hasattr(self._communicator_classes[gateway_id], 'send_message'):
+            if not isinstance(msg, ESP2Message):
+                self.logger.error("Gateway %d only sends ESP2 messages (%s).", gateway_id, msg)
+                return None
+            return (gateway_id, PROTOCOL_ESP2, msg.serialize())
+
+        if isinstance(msg, ESP2Message):
+            packet = ESP3SerialCommunicator.convert_esp2_to_esp3_message(msg)
+            if packet is None:
+                self.logger.error("Cannot convert to esp3 message (%s).", msg)
+                return None
+            msg = packet
+        return (gateway_id, PROTOCOL_ESP3, bytes(msg.build()))
+
+    def get_statistics(self) -> dict:
+        return {
+            'workers': [
+                {
+                    'pid': w.process.pid if w.process else None,
+                    'alive': w.process is not None and w.process.is_alive(),
+                    'gateways': [g[0] for g in w.shard],
+                    'frames': w.frames,
+                    'send_failures': w.send_failures,
+                    'restarts': w.restarts,
+                } for w in self._workers
+            ]
+        }
+
+    def _start_worker(self, worker:_Worker):
+        parent_conn, child_conn = self._context.Pipe(duplex=True)
+        worker.process = self._context.Process(
+            target=_run_worker,
+            args=(worker.shard, child_conn, self._batch_interval),
+            name=f'GatewayWorker-{worker.index}',
+            daemon=True)
+        worker.process.start()
+        child_conn.close()
+        worker.conn = parent_conn
+        worker.died_at = None
+        self.logger.info("Started worker %d (pid %s) for gateways %s", worker.index, worker.process.pid, [g[0] for g in worker.shard])
+
+    def _stop_worker(self, worker:_Worker):
+        if worker.conn is not None:
+            worker.conn.close()
+            worker.conn = None
+        if worker.process is not None:
+            # workers stop their communicators when the pipe is closed
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+    def _run(self):
+        while not self._stop_flag.is_set():
+            conns = {w.conn: w for w in self._workers if w.conn is not None}
+            for conn in multiprocessing.connection.wait(list(conns), timeout=0.5):
+                worker = conns[conn]
+                try:
+                    self._process_frames(worker, conn.recv_bytes())
+                except (EOFError, OSError):
+                    self._on_worker_died(worker)
+
+            for worker in self._workers:
+                if worker.conn is not None and not worker.process.is_alive():
+                    self._on_worker_died(worker)
+                elif worker.conn is None and worker.died_at is not None and time.time() - worker.died_at >= self._restart_delay:
+                    worker.restarts += 1
+                    self._start_worker(worker)
+
+    def _on_worker_died(self, worker:_Worker):
+        self.logger.error("Worker %d (pid %s) died with exit code %s. Restart in %s seconds.", worker.index, worker.process.pid, worker.process.exitcode, self._restart_delay)
+        worker.conn.close()
+        worker.conn = None
+        worker.died_at = time.time()
+        if self._status_callback:
+            for gateway_id, _, _ in worker.shard:
+                self._status_callback(gateway_id, False)
+
+    def _process_frames(self, worker:_Worker, data:bytes):
+        for frame in iter_frames(data):
+            try:
+                if frame.protocol == PROTOCOL_STATUS:
+                    if self._status_callback:
+                        self._status_callback(frame.gateway_id, frame.raw == b'\x01')
+                elif frame.protocol == PROTOCOL_SEND_FAILED:
+                    worker.send_failures += 1
+                    if self._send_failed_callback:
+                        self._send_failed_callback(frame.gateway_id, *_decode_send_failure(frame))
+                else:
+                    worker.frames += 1
+                    if self._callback:
+                        self._callback(frame)
+            except Exception:
+                self.logger.exception("Callback of gateway supervisor failed")
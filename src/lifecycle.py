@@ -0,0 +1,47 @@
+import random
+import threading
+
+
+class ReconnectRequested(ConnectionError):
+    ''' Raised in the communicator thread to drop the current connection when reconnect() was called. '''
+
+
+class ReconnectBackoff():
+    ''' Delay between reconnection attempts which grows exponentially with every failed attempt and is randomized so that
+    several gateways do not reconnect in lockstep. The wait can be interrupted from another thread, e.g. by stop(). '''
+
+    def __init__(self, initial_delay:float=0.5, max_delay:float=60, factor:float=2, jitter:float=0.5):
+        """_summary_
+
+        Args:
+            initial_delay (float, optional): Delay in seconds before the first attempt. Defaults to 0.5.
+            max_delay (float, optional): Upper limit of the delay in seconds. Defaults to 60.
+            factor (float, optional): The delay is multiplied by it after every failed attempt. Defaults to 2.
+            jitter (float, optional): Fraction by which the delay is randomly shortened. Defaults to 0.5.
+        """
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.failures = 0
+        self._interrupted = threading.Event()
+
+    def next_delay(self) -> float:
+        delay = min(self.max_delay, self.initial_delay * self.factor ** min(self.failures, 64))
+        return delay * (1 - self.jitter * random.random())
+
+    def wait(self, delay:float=None) -> None:
+        ''' Waits the given delay (default: next_delay()) before the next attempt or until interrupted. '''
+        if delay is None:
+            delay = self.next_delay()
+        self.failures += 1
+        self._interrupted.wait(delay)
+        self._interrupted.clear()
+
+    def interrupt(self) -> None:
+        self._interrupted.set()
+
+    def reset(self) -> None:
+        ''' Called after a connection was established. '''
+        self.failures = 0
+        self._interrupted.clear()
@@ -0,0 +1,133 @@
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import NamedTuple
+
+from enocean.protocol.packet import Packet
+from enocean.protocol.constants import PACKET
+
+from .telegram import normalize_address, sender_address
+
+
+class LinkQuality(NamedTuple):
+    ''' Reception statistics of one sender at one gateway. dBm values are negative, closer to 0 is better. '''
+    address: int
+    gateway_id: int
+    telegrams: int
+    subtelegrams: int           # sum of sub-telegram counts, more than telegrams means repeated or redundant transmissions were received
+    last_dbm: int
+    mean_dbm: float             # exponential moving average
+    std_dbm: float              # exponential moving standard deviation
+    min_dbm: int
+    max_dbm: int
+    last_seen: float
+
+
+class LinkQualityIndex():
+    ''' Collects signal strength (dBm) and sub-telegram count of ESP3 radio telegrams per sender address and receiving gateway.
+
+    Statistics are kept in fixed size arrays so that an update costs O(1) and no objects are created per telegram. It can
+    be shared by several communicators which are distinguished by their gateway id. When all slots are used the link
+    which was not seen for the longest time is replaced.
+    '''
+
+    def __init__(self, max_links:int=1024, smoothing:float=0.1):
+        """_summary_
+
+        Args:
+            max_links (int, optional): Max number of (sender, gateway) pairs. Defaults to 1024.
+            smoothing (float, optional): Weight of a new value in the moving average and deviation of dBm. Defaults to 0.1.
+        """
+        self._max_links = max_links
+        self._smoothing = smoothing
+        self._lock = threading.Lock()
+        # (address << 16 | gateway id) -> slot in the arrays, least recently seen link first
+        self._slots:OrderedDict[int, int] = OrderedDict()
+
+        self._keys = array('Q', [0]) * max_links
+        self._telegrams = array('I', [0]) * max_links
+        self._subtelegrams = array('I', [0]) * max_links
+        self._last_dbm = array('b', [0]) * max_links
+        self._min_dbm = array('b', [0]) * max_links
+        self._max_dbm = array('b', [0]) * max_links
+        self._mean_dbm = array('f', [0]) * max_links
+        self._var_dbm = array('f', [0]) * max_links
+        self._last_seen = array('d', [0]) * max_links
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def update(self, packet:Packet, gateway_id:int=0, now:float=None) -> None:
+        ''' Adds a received ESP3 radio telegram. Other packets are ignored. '''
+        optional = packet.optional
+        # optional data of RADIO_ERP1: sub-telegram count, destination id (4 bytes), dBm (positive value), security level
+        if packet.packet_type != PACKET.RADIO_ERP1 or len(optional) < 6:
+            return
+        address = sender_address(packet)
+        if address is None:
+            return
+        dbm = max(-128, -optional[5])
+        key = (address << 16) | gateway_id
+        now = time.time() if now is None else now
+
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._allocate(key)
+                self._telegrams[slot] = 0
+                self._subtelegrams[slot] = 0
+                self._min_dbm[slot] = dbm
+                self._max_dbm[slot] = dbm
+                self._mean_dbm[slot] = dbm
+                self._var_dbm[slot] = 0
+            else:
+                self._slots.move_to_end(key)
+                a = self._smoothing
+                mean = self._mean_dbm[slot]
+                diff = dbm - mean
+                self._mean_dbm[slot] = mean + a * diff
+                self._var_dbm[slot] = (1 - a) * (self._var_dbm[slot] + a * diff * diff)
+                if dbm < self._min_dbm[slot]:
+                    self._min_dbm[slot] = dbm
+                if dbm > self._max_dbm[slot]:
+                    self._max_dbm[slot] = dbm
+
+            self._telegrams[slot] += 1
+            self._subtelegrams[slot] += optional[0]
+            self._last_dbm[slot] = dbm
+            self._last_seen[slot] = now
+
+    def _allocate(self, key:int) -> int:
+        if len(self._slots) < self._max_links:
+            slot = len(self._slots)
+        else:
+            # replace the least recently seen link
+            _, slot = self._slots.popitem(last=False)
+        self._keys[slot] = key
+        self._slots[key] = slot
+        return slot
+
+    def _row(self, slot:int) -> LinkQuality:
+        key = self._keys[slot]
+        return LinkQuality(key >> 16, key & 0xFFFF,
+                           self._telegrams[slot], self._subtelegrams[slot],
+                           self._last_dbm[slot], self._mean_dbm[slot], math.sqrt(self._var_dbm[slot]),
+                           self._min_dbm[slot], self._max_dbm[slot], self._last_seen[slot])
+
+    def get(self, address) -> list[LinkQuality]:
+        ''' Returns the statistics of the given sender at every gateway which received it, best mean signal first. '''
+        address = normalize_address(address)
+        with self._lock:
+            rows = [self._row(slot) for key, slot in self._slots.items() if key >> 16 == address]
+        return sorted(rows, key=lambda r: r.mean_dbm, reverse=True)
+
+    def snapshot(self) -> list[LinkQuality]:
+        ''' Returns the statistics of all links. '''
+        with self._lock:
+            return [self._row(slot) for slot in self._slots.values()]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._slots.clear()
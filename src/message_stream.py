@@ -0,0 +1,180 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Callable, Iterable
+
+from .telegram import normalize_address, sender_address, telegram_rorg
+
+
+def build_message_filter(addresses:Iterable=None, rorgs:Iterable[int]=None, predicate:Callable=None) -> Callable | None:
+    ''' Combines the optional filter criteria into one predicate. Returns None if nothing needs to be filtered. '''
+    address_set = None if addresses is None else frozenset(normalize_address(a) for a in addresses)
+    rorg_set = None if rorgs is None else frozenset(int(r) for r in rorgs)
+
+    if address_set is None and rorg_set is None and predicate is None:
+        return None
+
+    def _filter(msg) -> bool:
+        if address_set is not None and sender_address(msg) not in address_set:
+            return False
+        if rorg_set is not None and telegram_rorg(msg) not in rorg_set:
+            return False
+        if predicate is not None and not predicate(msg):
+            return False
+        return True
+
+    return _filter
+
+
+class MessageSubscription():
+    ''' Bridges messages from the communicator thread to an asyncio event loop.
+
+    Messages are collected on the communicator thread and handed over to the event loop in batches.
+    Only one call_soon_threadsafe is issued until the event loop picked up the pending messages,
+    so that a burst of telegrams wakes up the consumer only once.
+    '''
+
+    def __init__(self, loop:asyncio.AbstractEventLoop, message_filter:Callable=None, maxsize:int=0):
+        self._loop = loop
+        self._filter = message_filter
+        self._maxsize = maxsize
+
+        # communicator thread side
+        self._lock = threading.Lock()
+        self._pending = []
+        self._scheduled = False
+        self._closed = False
+
+        # event loop side
+        self._ready = deque()
+        self._wakeup = asyncio.Event()
+        self.dropped = 0
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def publish(self, msg) -> None:
+        ''' Called from the communicator thread. '''
+        if self._filter is not None and not self._filter(msg):
+            return
+        with self._lock:
+            if self._closed:
+                return
+            self._pending.append(msg)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._schedule_transfer()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._schedule_transfer()
+
+    def _schedule_transfer(self) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._transfer)
+        except RuntimeError:
+            # event loop is already closed, nobody is listening anymore
+            self._closed = True
+
+    def _transfer(self) -> None:
+        ''' Runs in the event loop and moves all pending messages to the consumer side. '''
+        with self._lock:
+            batch = self._pending
+            self._pending = []
+            self._scheduled = False
+
+        self._ready.extend(batch)
+        if self._maxsize > 0:
+            while len(self._ready) > self._maxsize:
+                self._ready.popleft()
+                self.dropped += 1
+        self._wakeup.set()
+
+    async def get_batch(self) -> list:
+        ''' Returns all messages which are available. Waits if there are none. Returns an empty list when the subscription is closed. '''
+        while not self._ready:
+            if self._closed:
+                # pick up what might have been published right before closing
+                self._transfer()
+                if not self._ready:
+                    return []
+                break
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+        batch = list(self._ready)
+        self._ready.clear()
+        return batch
+
+
+class MessageHub():
+    ''' Distributes received messages to all asyncio subscribers. '''
+
+    def __init__(self):
+        # replaced on every change so that the communicator thread can iterate without locking
+        self._subscriptions:tuple[MessageSubscription, ...] = ()
+        self._lock = threading.Lock()
+
+    @property
+    def has_subscribers(self) -> bool:
+        return len(self._subscriptions) > 0
+
+    def subscribe(self, message_filter:Callable=None, maxsize:int=0) -> MessageSubscription:
+        subscription = MessageSubscription(asyncio.get_running_loop(), message_filter, maxsize)
+        with self._lock:
+            self._subscriptions = self._subscriptions + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription:MessageSubscription) -> None:
+        with self._lock:
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+        subscription.close()
+
+    def publish(self, msg) -> None:
+        for subscription in self._subscriptions:
+            subscription.publish(msg)
+
+    def close(self) -> None:
+        ''' Ends all running subscriptions e.g. when the communicator is stopped. '''
+        with self._lock:
+            subscriptions = self._subscriptions
+            self._subscriptions = ()
+        for subscription in subscriptions:
+            subscription.close()
+
+    async def messages(self,
+                       addresses:Iterable=None,
+                       rorgs:Iterable[int]=None,
+                       predicate:Callable=None,
+                       batched:bool=False,
+                       maxsize:int=0):
+        """Async iterator over received messages.
+
+        Args:
+            addresses (Iterable, optional): Only messages from these sender addresses are passed. Defaults to None.
+            rorgs (Iterable[int], optional): Only radio telegrams of these RORGs (ESP2 org is mapped to RORG) are passed. Defaults to None.
+            predicate (Callable, optional): Custom filter which is called on the communicator thread. Defaults to None.
+            batched (bool, optional): Yields lists of all messages received in one burst instead of single messages. Defaults to False.
+            maxsize (int, optional): Max number of messages buffered for a slow consumer, oldest are dropped. 0 means unbounded. Defaults to 0.
+        """
+        subscription = self.subscribe(build_message_filter(addresses, rorgs, predicate), maxsize)
+        try:
+            while True:
+                batch = await subscription.get_batch()
+                if not batch:
+                    return
+                if batched:
+                    yield batch
+                else:
+                    for msg in batch:
+                        yield msg
+        finally:
+            self.unsubscribe(subscription)
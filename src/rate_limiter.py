@@ -0,0 +1,136 @@
+import heapq
+import itertools
+from typing import Callable, Iterable, Union
+
+from enocean.protocol.constants import RORG
+
+from enocean.protocol.packet import Packet
+
+from eltakobus.message import ESP2Message
+
+from .telegram import normalize_address, sender_address, telegram_rorg
+
+
+def telegram_channel(msg: Union[ESP2Message, Packet]) -> tuple:
+    ''' Default key of AddressRateLimiter: RORG and for 4BS telegrams the bits 7-2 of DB0.
+
+    Meters (e.g. A5-12) report several quantities from one address and tell them apart by channel/tariff (bits 7-4)
+    and data type (bit 2). Bit 3 is the learn bit, so teach-in telegrams are never replaced by data telegrams.
+    '''
+    rorg = telegram_rorg(msg)
+    if rorg != RORG.BS4:
+        return (rorg, None)
+    db0 = msg.data[4] if isinstance(msg, Packet) else msg.body[5]
+    return (rorg, db0 & 0xFC)
+
+
+class AddressRateLimiter():
+    ''' Limits how often telegrams of one sender address are delivered.
+
+    The first telegram of an address is delivered right away and starts an interval. Telegrams received within the
+    interval are coalesced: only the latest one is kept and delivered when the interval ends. So the final value is
+    never lost. Telegrams of one address with different keys (by default RORG and channel) have their own intervals.
+    All methods are called from the communicator thread.
+    '''
+
+    def __init__(self, interval:float=0, intervals:dict=None, rorgs:Iterable[int]=(RORG.BS4,), key:Callable=telegram_channel):
+        """_summary_
+
+        Args:
+            interval (float, optional): Default interval in seconds for all addresses. 0 means not limited. Defaults to 0.
+            intervals (dict, optional): Interval per address, overrides the default interval. Defaults to None.
+            rorgs (Iterable[int], optional): Only telegrams of these RORGs are limited (ESP2 org is mapped to RORG). None limits all. Defaults to 4BS, so that button presses are never coalesced.
+            key (Callable, optional): Returns for a telegram which values of its address it carries. Only telegrams with the same address and key are coalesced. Defaults to telegram_channel.
+        """
+        self._interval = interval
+        self._intervals = {normalize_address(a): i for a, i in (intervals or {}).items()}
+        self._rorgs = None if rorgs is None else frozenset(int(r) for r in rorgs)
+        self._key = key
+
+        # (address, key) -> [end of interval, pending message]
+        self._windows:dict[tuple, list] = {}
+        # (end of interval, sequence, (address, key)) of windows with a pending message, entries of windows which were
+        # delivered by offer() are removed lazily
+        self._deadlines:list[tuple[float, int, tuple]] = []
+        self._sequence = itertools.count()
+        self._pending = 0
+
+        self.passed = 0
+        self.coalesced = 0
+        self.flushed = 0
+
+    def offer(self, msg, now:float) -> list:
+        ''' Returns the messages which can be delivered now. '''
+        address = sender_address(msg)
+        if address is None:
+            return [msg]
+        interval = self._intervals.get(address, self._interval)
+        if interval <= 0 or (self._rorgs is not None and telegram_rorg(msg) not in self._rorgs):
+            return [msg]
+
+        window_key = (address, self._key(msg))
+        window = self._windows.get(window_key)
+        if window is None or now >= window[0]:
+            result = []
+            if window is not None and window[1] is not None:
+                # interval is over but was not flushed yet
+                result.append(window[1])
+                self.flushed += 1
+                self._pending -= 1
+            self._windows[window_key] = [now + interval, None]
+            self.passed += 1
+            result.append(msg)
+            return result
+
+        if window[1] is None:
+            heapq.heappush(self._deadlines, (window[0], next(self._sequence), window_key))
+            self._pending += 1
+        else:
+            self.coalesced += 1
+        window[1] = msg
+        return []
+
+    def due(self, now:float) -> list:
+        ''' Returns the latest messages of all intervals which are over. '''
+        result = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            end, _, window_key = heapq.heappop(self._deadlines)
+            window = self._windows.get(window_key)
+            if window is None or window[0] != end or window[1] is None:
+                # already delivered by offer()
+                continue
+            result.append(window[1])
+            self.flushed += 1
+            self._pending -= 1
+            # the delivered message starts a new interval
+            window[0] = now + self._intervals.get(window_key[0], self._interval)
+            window[1] = None
+        return result
+
+    def flush_all(self) -> list:
+        ''' Returns all pending messages e.g. when the communicator stops. '''
+        result = [w[1] for w in self._windows.values() if w[1] is not None]
+        self.flushed += len(result)
+        self._windows.clear()
+        self._deadlines.clear()
+        self._pending = 0
+        return result
+
+    def next_deadline(self, now:float) -> float | None:
+        ''' Returns seconds until the next interval with a pending message is over. '''
+        while self._deadlines:
+            end, _, window_key = self._deadlines[0]
+            window = self._windows.get(window_key)
+            if window is not None and window[0] == end and window[1] is not None:
+                return max(0, end - now)
+            # already delivered by offer()
+            heapq.heappop(self._deadlines)
+        return None
+
+    def get_statistics(self) -> dict:
+        return {
+            'rate_limit_passed': self.passed,
+            'rate_limit_coalesced': self.coalesced,
+            'rate_limit_flushed': self.flushed,
+            'rate_limit_pending': self._pending,
+        }
@@ -0,0 +1,52 @@
+from collections import OrderedDict
+
+
+class PrebuiltTelegram():
+    ''' ESP3 telegram which is already serialized. It can be put into the transmit queue instead of a Packet. '''
+
+    __slots__ = ('wire', 'description')
+
+    def __init__(self, wire:bytes, description:str):
+        self.wire = wire
+        self.description = description
+
+    def build(self) -> bytes:
+        return self.wire
+
+    def __str__(self):
+        return self.description
+
+
+class TelegramLRUCache():
+    ''' Bounded LRU cache which maps serialized ESP2 messages to finished ESP3 telegrams. '''
+
+    def __init__(self, max_entries:int=128):
+        self._max_entries = max_entries
+        self._entries:OrderedDict[bytes, PrebuiltTelegram] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def get(self, key:bytes) -> PrebuiltTelegram | None:
+        telegram = self._entries.get(key)
+        if telegram is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return telegram
+
+    def put(self, key:bytes, telegram:PrebuiltTelegram) -> None:
+        if self._max_entries <= 0:
+            return
+        self._entries[key] = telegram
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
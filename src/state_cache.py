@@ -0,0 +1,143 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Union
+
+from enocean.protocol.packet import Packet
+
+from eltakobus.message import ESP2Message
+
+from .frames import Frame, decode_frame, encode_frame, encode_message, iter_frames
+from .telegram import normalize_address, sender_address, telegram_rorg
+
+
+class DeviceStateCache():
+    ''' Keeps the latest radio telegram per sender address, RORG and gateway so that device states are known right after a (re)start.
+
+    Telegrams are stored as encoded frames (see frames.py). The cache is bounded, the least recently updated device is
+    removed first. When a path is given the cache is loaded from and saved to that file.
+    '''
+
+    def __init__(self,
+                 max_entries:int=1024,
+                 path:str=None,
+                 persist_interval:float=60,
+                 logger:logging.Logger=logging.getLogger('esp2_gateway_adapter.state_cache')):
+        """_summary_
+
+        Args:
+            max_entries (int, optional): Max number of cached telegrams. Defaults to 1024.
+            path (str, optional): File in which the cache is persisted. None disables persistence. Defaults to None.
+            persist_interval (float, optional): Changes are written to the file at most every X seconds. Defaults to 60.
+            logger (logging.Logger, optional): Logger. Defaults to logging.getLogger('esp2_gateway_adapter.state_cache').
+        """
+        self._max_entries = max_entries
+        self._path = path
+        self._persist_interval = persist_interval
+        self.logger = logger
+
+        self._entries:OrderedDict[int, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_saved = time.monotonic()
+
+        if path is not None:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(address:int, rorg:int, gateway_id:int) -> int:
+        # gateway_id is 16 bits wide in the frame header
+        return (address << 24) | (gateway_id << 8) | rorg
+
+    def update(self, msg:Union[ESP2Message, Packet], gateway_id:int=0) -> None:
+        ''' Stores the telegram if it is a radio telegram. '''
+        address = sender_address(msg)
+        if address is None:
+            return
+        key = self._key(address, telegram_rorg(msg) or 0, gateway_id)
+        frame = encode_message(gateway_id, msg)
+
+        with self._lock:
+            self._entries[key] = frame
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+        if self._path is not None and time.monotonic() - self._last_saved >= self._persist_interval:
+            self.save()
+
+    def get(self, address, rorg:int=None, gateway_id:int=None) -> Frame | None:
+        ''' Returns the latest telegram of the given address (and RORG and gateway). '''
+        address = normalize_address(address)
+        with self._lock:
+            if rorg is not None and gateway_id is not None:
+                frame = self._entries.get(self._key(address, rorg, gateway_id))
+                return decode_frame(frame)[0] if frame is not None else None
+
+            latest = None
+            for key, frame in self._entries.items():
+                if key >> 24 != address:
+                    continue
+                if (rorg is None or key & 0xFF == rorg) and (gateway_id is None or (key >> 8) & 0xFFFF == gateway_id):
+                    decoded = decode_frame(frame)[0]
+                    if latest is None or decoded.timestamp > latest.timestamp:
+                        latest = decoded
+            return latest
+
+    def snapshot(self, gateway_id:int=None) -> list[Frame]:
+        ''' Returns the latest telegrams of all known devices (received by the given gateway), oldest first. '''
+        with self._lock:
+            frames = [f for k, f in self._entries.items() if gateway_id is None or (k >> 8) & 0xFFFF == gateway_id]
+        return [decode_frame(f)[0] for f in frames]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def load(self) -> None:
+        try:
+            with open(self._path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            self.logger.error("Cannot load device state cache from %s: %s", self._path, e)
+            return
+
+        with self._lock:
+            try:
+                for frame in sorted(iter_frames(data), key=lambda f: f.timestamp):
+                    key = self._key(frame.sender, frame.rorg, frame.gateway_id)
+                    self._entries[key] = encode_frame(frame.timestamp, frame.gateway_id, frame.protocol, bytes(frame.raw), frame.sender, frame.rorg)
+                    self._entries.move_to_end(key)
+                    if len(self._entries) > self._max_entries:
+                        self._entries.popitem(last=False)
+            except Exception as e:
+                self.logger.error("Device state cache file %s is corrupt: %s", self._path, e)
+            self._dirty = False
+
+    def save(self) -> None:
+        ''' Writes the cache to the file if there are changes. '''
+        if self._path is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = b''.join(self._entries.values())
+            self._dirty = False
+            self._last_saved = time.monotonic()
+
+        try:
+            tmp_path = self._path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            self.logger.error("Cannot save device state cache to %s: %s", self._path, e)
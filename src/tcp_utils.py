@@ -0,0 +1,199 @@
+import errno
+import ipaddress
+import os
+import selectors
+import socket
+import threading
+import time
+
+# (host, port) -> (expiry time, [(family, sockaddr)])
+_resolved_addresses:dict[tuple[str, int], tuple[float, list]] = {}
+_resolved_addresses_lock = threading.Lock()
+# hostnames of which the addresses are known e.g. from zeroconf discovery, valid for all ports
+_known_host_addresses:dict[str, tuple[float, list[str]]] = {}
+
+_CONNECT_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN)
+
+
+def enable_tcp_keepalive(sock:socket.socket, timeout:float, probe_count:int=3) -> bool:
+    """Lets the kernel detect dead TCP connections within the given timeout.
+
+    Keep-alive probes start after half of the timeout without traffic and are repeated probe_count times within
+    the other half. TCP_USER_TIMEOUT additionally bounds how long sent data may stay unacknowledged.
+
+    Args:
+        sock (socket.socket): Connected TCP socket.
+        timeout (float): Max time in seconds until a dead connection is reported as error on the socket.
+        probe_count (int, optional): Number of unanswered keep-alive probes before the connection is dropped. Defaults to 3.
+
+    Returns:
+        bool: True if idle time and probe interval could be configured. Otherwise only SO_KEEPALIVE with system defaults (usually hours) is active and application-level probing is needed.
+    """
+    idle = max(1, int(timeout / 2))
+    interval = max(1, int((timeout - idle) / probe_count))
+
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    if hasattr(socket, 'TCP_KEEPIDLE') and hasattr(socket, 'TCP_KEEPINTVL') and hasattr(socket, 'TCP_KEEPCNT'):
+        # Linux and recent macOS / Windows
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, probe_count)
+    elif hasattr(socket, 'SIO_KEEPALIVE_VALS'):
+        # older Windows: (on/off, idle in ms, interval in ms)
+        sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, interval * 1000))
+    else:
+        return False
+
+    if hasattr(socket, 'TCP_USER_TIMEOUT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, int(timeout * 1000))
+
+    return True
+
+
+class SelectorWakeup():
+    ''' Socket pair which can be registered in a selector to interrupt a blocking select() from another thread. '''
+
+    def __init__(self):
+        self._reader, self._writer = socket.socketpair()
+        self._reader.setblocking(False)
+        self._writer.setblocking(False)
+
+    def fileno(self) -> int:
+        return self._reader.fileno()
+
+    def wake(self) -> None:
+        try:
+            self._writer.send(b'\x00')
+        except OSError:
+            # buffer is full (there are enough wakeups pending) or wakeup is already closed
+            pass
+
+    def clear(self) -> None:
+        try:
+            while self._reader.recv(1024):
+                pass
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        self._reader.close()
+        self._writer.close()
+
+
+def remember_addresses(host:str, addresses:list[str], ttl:float=3600) -> None:
+    ''' Seeds the address cache e.g. with the IP addresses of a hostname found by zeroconf discovery. '''
+    host = host.rstrip('.')
+    with _resolved_addresses_lock:
+        _known_host_addresses[host] = (time.monotonic() + ttl, list(addresses))
+        for key in [k for k in _resolved_addresses if k[0] == host]:
+            del _resolved_addresses[key]
+
+
+def forget_addresses(host:str) -> None:
+    ''' Removes cached addresses of a host so that it is resolved again on the next connect. '''
+    host = host.rstrip('.')
+    with _resolved_addresses_lock:
+        _known_host_addresses.pop(host, None)
+        for key in [k for k in _resolved_addresses if k[0] == host]:
+            del _resolved_addresses[key]
+
+
+def resolve_address(host:str, port:int, ttl:float=300) -> list[tuple[int, tuple]]:
+    """Resolves host into a list of (address family, socket address). Results are cached so that reconnects do not need a (often slow mDNS) lookup.
+    If the lookup fails, expired addresses of a previous lookup are returned.
+
+    Args:
+        host (str): IP address or hostname.
+        port (int): TCP port.
+        ttl (float, optional): Seconds for which a resolved address is used. Defaults to 300.
+    """
+    try:
+        ip = ipaddress.ip_address(host)
+        return [(socket.AF_INET6 if ip.version == 6 else socket.AF_INET, (host, port))]
+    except ValueError:
+        pass
+
+    key = (host.rstrip('.'), port)
+    now = time.monotonic()
+    with _resolved_addresses_lock:
+        cached = _resolved_addresses.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        known = _known_host_addresses.get(key[0])
+        if known is not None and known[0] > now:
+            addresses = [(socket.AF_INET6 if ':' in ip else socket.AF_INET, (ip, port)) for ip in known[1]]
+            _resolved_addresses[key] = (known[0], addresses)
+            return addresses
+
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        if cached is not None:
+            return cached[1]
+        raise
+
+    addresses = []
+    for family, _, _, _, sockaddr in infos:
+        if (family, sockaddr) not in addresses:
+            addresses.append((family, sockaddr))
+    with _resolved_addresses_lock:
+        _resolved_addresses[key] = (now + ttl, addresses)
+    return addresses
+
+
+def connect_tcp(host:str, port:int, timeout:float=None) -> socket.socket:
+    """Connects to all resolved addresses of host in parallel and returns the first established connection as blocking socket.
+    If no address can be reached, the cached addresses of host are dropped.
+
+    Args:
+        host (str): IP address or hostname.
+        port (int): TCP port.
+        timeout (float, optional): Max time in seconds for establishing the connection (without name resolution). None waits until the OS gives up. Defaults to None.
+
+    Raises:
+        TimeoutError: No connection was established within timeout.
+        OSError: All addresses refused the connection.
+    """
+    addresses = resolve_address(host, port)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    selector = selectors.DefaultSelector()
+    pending = []
+    error = None
+    try:
+        for family, sockaddr in addresses:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            result = sock.connect_ex(sockaddr)
+            if result == 0:
+                sock.setblocking(True)
+                return sock
+            if result not in _CONNECT_IN_PROGRESS:
+                error = OSError(result, f"Cannot connect to {sockaddr}: {os.strerror(result)}")
+                sock.close()
+                continue
+            selector.register(sock, selectors.EVENT_WRITE)
+            pending.append(sock)
+
+        while pending:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                error = TimeoutError(f"Connection to {host}:{port} timed out after {timeout} seconds")
+                break
+            for key, _ in selector.select(remaining):
+                sock = key.fileobj
+                selector.unregister(sock)
+                pending.remove(sock)
+                result = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if result == 0:
+                    sock.setblocking(True)
+                    return sock
+                error = OSError(result, f"Cannot connect to {host}:{port}: {os.strerror(result)}")
+                sock.close()
+    finally:
+        selector.close()
+        for sock in pending:
+            sock.close()
+
+    forget_addresses(host)
+    raise error or OSError(f"No address found for {host}")
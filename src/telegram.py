@@ -0,0 +1,52 @@
+from typing import Union
+
+from enocean.protocol.packet import Packet
+from enocean.protocol.constants import PACKET, RORG
+
+from eltakobus.message import ESP2Message
+
+
+# ESP2 org byte of radio telegrams mapped to the corresponding ESP3 RORG
+ESP2_ORG_TO_RORG = {
+    0x05: RORG.RPS,
+    0x06: RORG.BS1,
+    0x07: RORG.BS4,
+}
+
+
+def normalize_address(address) -> int:
+    ''' Converts an address given as int, bytes, list of ints, hex string (e.g. "FF-D6-30-01") or AddressExpression into an int. '''
+    if isinstance(address, int):
+        return address
+    if isinstance(address, tuple):
+        # eltakobus AddressExpression: (bytes, discriminator)
+        address = address[0]
+    if isinstance(address, str):
+        return int(address.replace('-', '').replace(':', '').replace(' ', ''), 16)
+    return int.from_bytes(bytes(address), 'big')
+
+
+def sender_address(msg: Union[ESP2Message, Packet]) -> int | None:
+    ''' Returns the sender address of an ESP3 radio packet or an ESP2 radio message. Returns None for all other messages. '''
+    if isinstance(msg, Packet):
+        if msg.packet_type == PACKET.RADIO_ERP1 and len(msg.data) >= 6:
+            return int.from_bytes(bytes(msg.data[-5:-1]), 'big')
+        return None
+
+    if isinstance(msg, ESP2Message) and len(msg.body) >= 10 and msg.body[1] in ESP2_ORG_TO_RORG:
+        return int.from_bytes(msg.body[6:10], 'big')
+
+    return None
+
+
+def telegram_rorg(msg: Union[ESP2Message, Packet]) -> int | None:
+    ''' Returns the RORG of an ESP3 radio packet or an ESP2 radio message (ESP2 org is mapped to RORG). '''
+    if isinstance(msg, Packet):
+        if msg.packet_type == PACKET.RADIO_ERP1 and len(msg.data) > 0:
+            return msg.data[0]
+        return None
+
+    if isinstance(msg, ESP2Message) and len(msg.body) > 1:
+        return ESP2_ORG_TO_RORG.get(msg.body[1])
+
+    return None
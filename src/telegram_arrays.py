@@ -0,0 +1,208 @@
+import struct
+from typing import NamedTuple, Union
+
+# numpy is an optional dependency (pip install esp2_gateway_adapter[numpy])
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .frames import FRAME_HEADER, PROTOCOL_ESP2, PROTOCOL_ESP3
+from .telegram import ESP2_ORG_TO_RORG
+
+_ESP3_SYNC = 0x55
+_ESP2_SYNC = (0xA5, 0x5A)
+_ESP2_LENGTH = 14
+_RADIO_ERP1 = 0x01
+# longer ESP3 packets are no radio telegrams and are not checked
+_ESP3_MAX_DATA = 1024
+
+
+class TelegramColumns(NamedTuple):
+    ''' Radio telegrams as columns. Row i of every array belongs to the same telegram. '''
+    timestamp: 'np.ndarray'     # float64, seconds since epoch, NaN if the capture has no timestamps
+    gateway_id: 'np.ndarray'    # uint16
+    sender: 'np.ndarray'        # uint32
+    rorg: 'np.ndarray'          # uint8, ESP2 org is mapped to RORG
+    data: 'np.ndarray'          # uint8 (n, 4), 4BS data bytes, RPS and 1BS only use the first column
+    status: 'np.ndarray'        # uint8
+    dbm: 'np.ndarray'           # int16, 0 if unknown (ESP2 or no optional data)
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError("numpy is required for telegram arrays: pip install esp2_gateway_adapter[numpy]")
+
+
+def _as_array(buffer) -> 'np.ndarray':
+    ''' Returns the capture as uint8 array with some zero bytes appended so that gathers never leave the array. '''
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    return np.concatenate((raw, np.zeros(_ESP3_MAX_DATA + 64, dtype=np.uint8)))
+
+
+def _crc8_table() -> 'np.ndarray':
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return np.array(table, dtype=np.uint8)
+
+
+def _org_to_rorg_table() -> 'np.ndarray':
+    table = np.zeros(256, dtype=np.uint8)
+    for org, rorg in ESP2_ORG_TO_RORG.items():
+        table[org] = int(rorg)
+    return table
+
+
+def _gather_uint32(buf:'np.ndarray', positions:'np.ndarray') -> 'np.ndarray':
+    ''' Big endian uint32 starting at every position. '''
+    b = buf[positions[:, None] + np.arange(4)].astype(np.uint32)
+    return (b[:, 0] << 24) | (b[:, 1] << 16) | (b[:, 2] << 8) | b[:, 3]
+
+
+def _remove_overlapping(starts:'np.ndarray', ends:'np.ndarray') -> 'np.ndarray':
+    ''' Drops candidates which start inside a previous candidate (sync bytes within telegram data). '''
+    if len(starts) == 0:
+        return np.ones(0, dtype=bool)
+    previous_end = np.concatenate(([0], np.maximum.accumulate(ends)[:-1]))
+    return starts >= previous_end
+
+
+def _decode_esp3(buf:'np.ndarray', starts:'np.ndarray') -> tuple['np.ndarray', tuple]:
+    ''' Decodes the ESP3 packets at the given positions. Returns a mask of radio telegrams and the columns of them. '''
+    data_length = (buf[starts + 1].astype(np.int64) << 8) | buf[starts + 2]
+    optional_length = buf[starts + 3].astype(np.int64)
+    is_radio = (buf[starts + 4] == _RADIO_ERP1) & (data_length >= 6)
+    starts, data_length, optional_length = starts[is_radio], data_length[is_radio], optional_length[is_radio]
+
+    data_start = starts + 6
+    data_end = data_start + data_length
+    rorg = buf[data_start]
+    sender = _gather_uint32(buf, data_end - 5)
+    status = buf[data_end - 1]
+    columns = np.arange(4)
+    data = np.where(columns < (data_length - 6)[:, None], buf[data_start[:, None] + 1 + columns], 0).astype(np.uint8)
+    dbm = np.where(optional_length >= 6, -buf[data_end + 5].astype(np.int16), 0).astype(np.int16)
+    return is_radio, (sender, rorg, data, status, dbm)
+
+
+def _decode_esp2(buf:'np.ndarray', starts:'np.ndarray') -> tuple['np.ndarray', tuple]:
+    ''' Decodes the ESP2 telegrams at the given positions. Returns a mask of radio telegrams and the columns of them. '''
+    rorg = _org_to_rorg_table()[buf[starts + 3]]
+    is_radio = rorg != 0
+    starts, rorg = starts[is_radio], rorg[is_radio]
+
+    data = buf[starts[:, None] + 4 + np.arange(4)]
+    sender = _gather_uint32(buf, starts + 8)
+    status = buf[starts + 12]
+    dbm = np.zeros(len(starts), dtype=np.int16)
+    return is_radio, (sender, rorg, data, status, dbm)
+
+
+def _columns(count:int, timestamp, gateway_id, decoded) -> TelegramColumns:
+    sender, rorg, data, status, dbm = decoded
+    if timestamp is None:
+        timestamp = np.full(count, np.nan)
+    if gateway_id is None:
+        gateway_id = np.zeros(count, dtype=np.uint16)
+    return TelegramColumns(timestamp.astype(np.float64), gateway_id.astype(np.uint16), sender.astype(np.uint32),
+                           rorg.astype(np.uint8), data.astype(np.uint8).reshape(count, 4), status.astype(np.uint8), dbm)
+
+
+def find_esp3_telegrams(buffer:Union[bytes, bytearray, memoryview]) -> 'np.ndarray':
+    ''' Returns the start positions of all ESP3 packets with valid header and data CRC in a raw capture. '''
+    _require_numpy()
+    buf = _as_array(buffer)
+    size = len(buffer)
+    crc8 = _crc8_table()
+
+    starts = np.flatnonzero(buf[:max(0, size - 6)] == _ESP3_SYNC)
+    crc = np.zeros(len(starts), dtype=np.uint8)
+    for i in range(1, 5):
+        crc = crc8[crc ^ buf[starts + i]]
+    starts = starts[crc == buf[starts + 5]]
+
+    length = ((buf[starts + 1].astype(np.int64) << 8) | buf[starts + 2]) + buf[starts + 3]
+    valid = (length <= _ESP3_MAX_DATA) & (starts + 7 + length <= size)
+    starts, length = starts[valid], length[valid]
+
+    # data CRC of all candidates at the same time, one byte position per step
+    crc = np.zeros(len(starts), dtype=np.uint8)
+    for i in range(int(length.max()) if len(length) else 0):
+        crc = np.where(i < length, crc8[crc ^ buf[starts + 6 + i]], crc)
+    valid = crc == buf[starts + 6 + length]
+    starts, length = starts[valid], length[valid]
+
+    return starts[_remove_overlapping(starts, starts + 7 + length)]
+
+
+def find_esp2_telegrams(buffer:Union[bytes, bytearray, memoryview]) -> 'np.ndarray':
+    ''' Returns the start positions of all ESP2 telegrams with valid checksum in a raw capture. '''
+    _require_numpy()
+    buf = _as_array(buffer)
+    size = len(buffer)
+
+    starts = np.flatnonzero((buf[:max(0, size - _ESP2_LENGTH + 1)] == _ESP2_SYNC[0]) & (buf[1:max(1, size - _ESP2_LENGTH + 2)] == _ESP2_SYNC[1]))
+    body = buf[starts[:, None] + 2 + np.arange(11)]
+    checksum = body.sum(axis=1, dtype=np.uint32) & 0xFF
+    valid = (checksum == buf[starts + 13]) & ((body[:, 0] & 0x1F) == 0x0B)
+    starts = starts[valid]
+
+    return starts[_remove_overlapping(starts, starts + _ESP2_LENGTH)]
+
+
+def decode_esp3_capture(buffer:Union[bytes, bytearray, memoryview]) -> TelegramColumns:
+    ''' Decodes all radio telegrams of a raw ESP3 byte stream (e.g. recorded from the serial port). Timestamps are NaN. '''
+    _require_numpy()
+    buf = _as_array(buffer)
+    _, decoded = _decode_esp3(buf, find_esp3_telegrams(buffer))
+    return _columns(len(decoded[0]), None, None, decoded)
+
+
+def decode_esp2_capture(buffer:Union[bytes, bytearray, memoryview]) -> TelegramColumns:
+    ''' Decodes all radio telegrams of a raw ESP2 byte stream. Timestamps are NaN. '''
+    _require_numpy()
+    buf = _as_array(buffer)
+    _, decoded = _decode_esp2(buf, find_esp2_telegrams(buffer))
+    return _columns(len(decoded[0]), None, None, decoded)
+
+
+def decode_frames(buffer:Union[bytes, bytearray, memoryview]) -> TelegramColumns:
+    ''' Decodes all radio telegrams of concatenated frames (see frames.py), e.g. a state cache file or a recorded supervisor stream. '''
+    _require_numpy()
+    size = len(buffer)
+    unpack_length = struct.Struct('<H').unpack_from
+    length_offset = FRAME_HEADER.size - 2
+
+    # frames have variable length, only the walk along the length fields is sequential
+    offsets = []
+    offset = 0
+    while offset + FRAME_HEADER.size <= size:
+        offsets.append(offset)
+        offset += FRAME_HEADER.size + unpack_length(buffer, offset + length_offset)[0]
+    if offset > size:
+        # last frame is incomplete
+        offsets.pop()
+
+    buf = _as_array(buffer)
+    offsets = np.array(offsets, dtype=np.int64)
+    timestamp = buf[offsets[:, None] + np.arange(8)].copy().view('<f8').ravel()
+    gateway_id = buf[offsets[:, None] + np.arange(12, 14)].copy().view('<u2').ravel()
+    protocol = buf[offsets + 14]
+    raw_start = offsets + FRAME_HEADER.size
+
+    parts = []
+    for proto, decode in ((PROTOCOL_ESP3, _decode_esp3), (PROTOCOL_ESP2, _decode_esp2)):
+        selected = np.flatnonzero(protocol == proto)
+        is_radio, decoded = decode(buf, raw_start[selected])
+        selected = selected[is_radio]
+        parts.append((selected, decoded))
+
+    # restore the order of the capture
+    order = np.argsort(np.concatenate([p[0] for p in parts]), kind='stable')
+    rows = np.concatenate([p[0] for p in parts])[order]
+    decoded = tuple(np.concatenate([p[1][i] for p in parts])[order] for i in range(5))
+    return _columns(len(rows), timestamp[rows], gateway_id[rows], decoded)
@@ -0,0 +1,272 @@
+import logging
+import os
+import random
+import select
+import threading
+import time
+import tty
+from array import array
+from collections import deque
+
+from enocean.protocol import crc8
+from enocean.protocol.packet import Packet
+from enocean.protocol.constants import PACKET, RETURN_CODE, RORG
+
+# ESP3 common commands answered by the emulator
+CO_WR_REPEATER = 0x09
+CO_RD_REPEATER = 0x0A
+CO_RD_VERSION = 0x03
+CO_RD_IDBASE = 0x08
+
+# size of the ring which keeps the send timestamps of synthetic telegrams
+_TIMESTAMP_RING_SIZE = 65536
+
+
+class VirtualUSBStick(threading.Thread):
+    ''' Emulates an ESP3 USB stick (USB300/USB400) on a pseudo terminal (POSIX only).
+
+    ESP3SerialCommunicator can connect to the path in property 'port' like to a real device.
+    The stick answers CO_RD_IDBASE, CO_RD_VERSION, CO_RD_REPEATER and CO_WR_REPEATER, acknowledges radio telegrams
+    with RET_OK and streams synthetic 4BS radio traffic. The 4BS data bytes of synthetic telegrams contain a sequence
+    number so that the time when it was written can be looked up with sent_time() for latency measurements.
+    '''
+
+    def __init__(self,
+                 base_id:bytes=b'\xFF\x80\x00\x00',
+                 chip_id:bytes=b'\x01\x02\x03\x04',
+                 app_version:bytes=b'\x02\x0B\x01\x00',
+                 api_version:bytes=b'\x02\x06\x03\x00',
+                 app_description:str='GATEWAYCTRL',
+                 baud_rate:int=57600,
+                 telegram_rate:float=0,
+                 telegram_count:int=None,
+                 sender_count:int=16,
+                 first_sender:int=0x01000000,
+                 logger:logging.Logger=logging.getLogger('esp2_gateway_adapter.usb_stick_emulator')):
+        """_summary_
+
+        Args:
+            base_id (bytes, optional): Base id reported for CO_RD_IDBASE. Defaults to b'\\xFF\\x80\\x00\\x00'.
+            chip_id (bytes, optional): Chip id reported for CO_RD_VERSION. Defaults to b'\\x01\\x02\\x03\\x04'.
+            app_version (bytes, optional): App version reported for CO_RD_VERSION. Defaults to b'\\x02\\x0B\\x01\\x00'.
+            api_version (bytes, optional): Api version reported for CO_RD_VERSION. Defaults to b'\\x02\\x06\\x03\\x00'.
+            app_description (str, optional): App description reported for CO_RD_VERSION (max 16 chars). Defaults to 'GATEWAYCTRL'.
+            baud_rate (int, optional): Outgoing bytes are paced like on a serial line with this baud rate. None disables pacing. Defaults to 57600.
+            telegram_rate (float, optional): Synthetic radio telegrams per second. 0 disables synthetic traffic. Defaults to 0.
+            telegram_count (int, optional): Stops synthetic traffic after X telegrams. None means endless. Defaults to None.
+            sender_count (int, optional): Number of different sender addresses used for synthetic traffic. Defaults to 16.
+            first_sender (int, optional): First sender address of synthetic traffic. Defaults to 0x01000000.
+            logger (logging.Logger, optional): Logger. Defaults to logging.getLogger('esp2_gateway_adapter.usb_stick_emulator').
+        """
+        super(VirtualUSBStick, self).__init__()
+        self.daemon = True
+        self.logger = logger
+
+        self.base_id = bytes(base_id)
+        self.chip_id = bytes(chip_id)
+        self.app_version = bytes(app_version)
+        self.api_version = bytes(api_version)
+        self.app_description = app_description.encode('ascii')[:16].ljust(16, b'\x00')
+        self.repeater_enabled = 0
+        self.repeater_level = 0
+
+        self.baud_rate = baud_rate
+        self.telegram_rate = telegram_rate
+        self.telegram_count = telegram_count
+        self.sender_count = max(1, sender_count)
+        self.first_sender = first_sender
+
+        # return codes for the next received radio telegrams e.g. to simulate a busy gateway
+        self.radio_response_codes = deque()
+
+        self.received_commands = 0
+        self.received_radio_telegrams = 0
+        self.sent_radio_telegrams = 0
+        self.received_telegrams:deque[Packet] = deque(maxlen=1000)
+
+        self._stop_flag = threading.Event()
+        self._line_free_at = 0
+        self._sent_times = array('d', [0.0]) * _TIMESTAMP_RING_SIZE
+
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        self._port = os.ttyname(self._slave_fd)
+
+    @property
+    def port(self) -> str:
+        ''' Path of the serial device which can be used by ESP3SerialCommunicator. '''
+        return self._port
+
+    def stop(self):
+        self._stop_flag.set()
+
+    def sent_time(self, sequence:int) -> float:
+        ''' Returns time.perf_counter() of the moment when the synthetic telegram with the given sequence number was written. '''
+        return self._sent_times[sequence % _TIMESTAMP_RING_SIZE]
+
+    @classmethod
+    def sequence_number(cls, packet:Packet) -> int:
+        ''' Extracts the sequence number of a synthetic 4BS telegram. '''
+        return int.from_bytes(bytes(packet.data[1:5]), 'big')
+
+    def run(self):
+        self.logger.info('Virtual USB stick started on %s', self._port)
+        buffer = bytearray()
+        interval = 1.0 / self.telegram_rate if self.telegram_rate > 0 else None
+        next_telegram = time.perf_counter()
+        sequence = 0
+
+        try:
+            while not self._stop_flag.is_set():
+                timeout = 0.1
+                if interval is not None:
+                    timeout = min(timeout, max(0, next_telegram - time.perf_counter()))
+
+                ready_to_read, _, _ = select.select([self._master_fd], [], [], timeout)
+                if ready_to_read:
+                    buffer.extend(os.read(self._master_fd, 4096))
+                    buffer = self._process_requests(buffer)
+
+                if interval is not None and time.perf_counter() >= next_telegram:
+                    if self.telegram_count is not None and sequence >= self.telegram_count:
+                        interval = None
+                    else:
+                        self._send_synthetic_telegram(sequence)
+                        sequence += 1
+                        next_telegram += interval
+
+        except OSError as e:
+            self.logger.error(e)
+        finally:
+            os.close(self._master_fd)
+            os.close(self._slave_fd)
+            self.logger.info('Virtual USB stick stopped')
+
+    def _process_requests(self, buffer:bytearray) -> bytearray:
+        ''' Splits received bytes into ESP3 telegrams. Base class Packet is used because outgoing radio telegrams can come without optional data which RadioPacket cannot parse. '''
+        while True:
+            start = buffer.find(0x55)
+            if start < 0:
+                return bytearray()
+            del buffer[:start]
+            if len(buffer) < 6:
+                return buffer
+            if crc8.calc(buffer[1:5]) != buffer[5]:
+                del buffer[:1]
+                continue
+
+            data_len = (buffer[1] << 8) | buffer[2]
+            opt_len = buffer[3]
+            msg_len = 7 + data_len + opt_len
+            if len(buffer) < msg_len:
+                return buffer
+
+            msg = buffer[:msg_len]
+            del buffer[:msg_len]
+            if crc8.calc(msg[6:-1]) != msg[-1]:
+                self.logger.error('Data CRC error!')
+                continue
+
+            self._handle_request(Packet(msg[4], list(msg[6:6 + data_len]), list(msg[6 + data_len:-1])))
+
+    def _handle_request(self, packet:Packet):
+        self.received_telegrams.append(packet)
+
+        if packet.packet_type == PACKET.RADIO_ERP1:
+            self.received_radio_telegrams += 1
+            code = self.radio_response_codes.popleft() if self.radio_response_codes else RETURN_CODE.OK
+            self._send_response(code)
+
+        elif packet.packet_type == PACKET.COMMON_COMMAND and len(packet.data) > 0:
+            self.received_commands += 1
+            command = packet.data[0]
+            if command == CO_RD_IDBASE:
+                # optional data: remaining write cycles for base id
+                self._send_response(RETURN_CODE.OK, list(self.base_id), [0x0A])
+            elif command == CO_RD_VERSION:
+                self._send_response(RETURN_CODE.OK, list(self.app_version + self.api_version + self.chip_id + b'\x00\x00\x00\x00' + self.app_description))
+            elif command == CO_RD_REPEATER:
+                self._send_response(RETURN_CODE.OK, [self.repeater_enabled, self.repeater_level])
+            elif command == CO_WR_REPEATER and len(packet.data) >= 3:
+                self.repeater_enabled = packet.data[1]
+                self.repeater_level = packet.data[2]
+                self._send_response(RETURN_CODE.OK)
+            else:
+                self._send_response(RETURN_CODE.NOT_SUPPORTED)
+
+        else:
+            self._send_response(RETURN_CODE.NOT_SUPPORTED)
+
+    def _send_response(self, code:int, response_data:list=[], optional:list=[]):
+        self._write(Packet(PACKET.RESPONSE, [int(code)] + list(response_data), list(optional)).build())
+
+    def _send_synthetic_telegram(self, sequence:int):
+        sender = self.first_sender + (sequence % self.sender_count)
+        data = [RORG.BS4] + list(sequence.to_bytes(4, 'big')) + list(sender.to_bytes(4, 'big')) + [0x00]
+        # sub telegram count, destination broadcast, dBm, security level
+        optional = [0x01, 0xFF, 0xFF, 0xFF, 0xFF, random.randint(40, 95), 0x00]
+        frame = Packet(PACKET.RADIO_ERP1, data, optional).build()
+        self._write(frame, sequence)
+        self.sent_radio_telegrams += 1
+
+    def _write(self, frame:list, sequence:int=None):
+        if self.baud_rate:
+            # pace like a serial line: 10 bits per byte (start bit, 8 data bits, stop bit)
+            now = time.perf_counter()
+            if self._line_free_at > now:
+                time.sleep(self._line_free_at - now)
+            self._line_free_at = max(now, self._line_free_at) + len(frame) * 10 / self.baud_rate
+        if sequence is not None:
+            self._sent_times[sequence % _TIMESTAMP_RING_SIZE] = time.perf_counter()
+        os.write(self._master_fd, bytes(frame))
+
+
+if __name__ == '__main__':
+    # measures throughput and latency of the serial read path without hardware
+    import argparse
+    import statistics
+    if not __package__:
+        from esp3_serial_com import ESP3SerialCommunicator
+    else:
+        from .esp3_serial_com import ESP3SerialCommunicator
+
+    parser = argparse.ArgumentParser(description='Measure ESP3SerialCommunicator against a virtual USB stick.')
+    parser.add_argument('--rate', type=float, default=200, help='synthetic telegrams per second')
+    parser.add_argument('--count', type=int, default=2000, help='number of synthetic telegrams')
+    parser.add_argument('--baud', type=int, default=57600, help='baud rate used for pacing, 0 disables pacing')
+    parser.add_argument('--esp2', action='store_true', help='enable esp2 translation')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    stick = VirtualUSBStick(baud_rate=args.baud or None, telegram_rate=args.rate, telegram_count=args.count)
+    latencies = []
+
+    def cb(msg):
+        received = time.perf_counter()
+        if args.esp2:
+            sequence = int.from_bytes(msg.body[2:6], 'big')
+        else:
+            sequence = VirtualUSBStick.sequence_number(msg)
+        latencies.append(received - stick.sent_time(sequence))
+
+    com = ESP3SerialCommunicator(stick.port, callback=cb, esp2_translation_enabled=args.esp2)
+    com.start()
+    com.is_serial_connected.wait(timeout=10)
+
+    started = time.perf_counter()
+    stick.start()
+    while len(latencies) < args.count and time.perf_counter() - started < args.count / args.rate + 10:
+        time.sleep(0.1)
+    duration = time.perf_counter() - started
+
+    com.stop()
+    stick.stop()
+
+    print(f"received {len(latencies)}/{args.count} telegrams in {duration:.2f} s ({len(latencies) / duration:.0f} telegrams/s)")
+    if latencies:
+        latencies.sort()
+        print(f"latency mean: {statistics.mean(latencies) * 1000:.2f} ms, "
+              f"p50: {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+              f"p99: {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms, "
+              f"max: {latencies[-1] * 1000:.2f} ms")
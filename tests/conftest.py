@@ -0,0 +1,62 @@
+import importlib.util
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+# setup.py maps the package esp2_gateway_adapter to src/, make it importable without installation
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+if 'esp2_gateway_adapter' not in sys.modules:
+    spec = importlib.util.spec_from_file_location('esp2_gateway_adapter', os.path.join(SRC_DIR, '__init__.py'), submodule_search_locations=[SRC_DIR])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules['esp2_gateway_adapter'] = package
+    spec.loader.exec_module(package)
+
+
+class LocalGateway():
+    ''' TCP server on localhost which stands in for a LAN gateway. Accepted connections are kept in 'connections'. '''
+
+    def __init__(self):
+        self._server = socket.create_server(('127.0.0.1', 0))
+        self._server.settimeout(0.05)
+        self.port = self._server.getsockname()[1]
+        self.connections:list[socket.socket] = []
+        self._accepted = threading.Condition()
+        self._stop_flag = threading.Event()
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def _accept(self):
+        while not self._stop_flag.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            conn.settimeout(5)
+            with self._accepted:
+                self.connections.append(conn)
+                self._accepted.notify_all()
+        self._server.close()
+
+    def wait_for_connection(self, count:int=1, timeout:float=5) -> socket.socket | None:
+        ''' Returns the count-th accepted connection. '''
+        with self._accepted:
+            if not self._accepted.wait_for(lambda: len(self.connections) >= count, timeout):
+                return None
+            return self.connections[count - 1]
+
+    def close(self):
+        self._stop_flag.set()
+        self._thread.join()
+        for conn in self.connections:
+            conn.close()
+
+
+@pytest.fixture
+def gateway():
+    gateway = LocalGateway()
+    yield gateway
+    gateway.close()
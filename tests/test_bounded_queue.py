@@ -0,0 +1,52 @@
+import queue
+import threading
+
+import pytest
+
+from esp2_gateway_adapter.bounded_queue import DROP_NEWEST, DROP_OLDEST, BoundedReceiveQueue
+
+
+def test_drop_oldest():
+    q = BoundedReceiveQueue(3, DROP_OLDEST)
+    for i in range(5):
+        q.put(i)
+    assert q.dropped == 2
+    assert [q.get_nowait() for _ in range(3)] == [2, 3, 4]
+    with pytest.raises(queue.Empty):
+        q.get_nowait()
+
+
+def test_drop_newest():
+    q = BoundedReceiveQueue(3, DROP_NEWEST)
+    for i in range(5):
+        q.put(i)
+    assert q.dropped == 2
+    assert [q.get_nowait() for _ in range(3)] == [0, 1, 2]
+
+
+def test_unbounded():
+    q = BoundedReceiveQueue()
+    for i in range(1000):
+        q.put(i)
+    assert q.qsize() == 1000
+    assert q.dropped == 0
+
+
+def test_full_queue_never_blocks_and_join_returns():
+    q = BoundedReceiveQueue(2)
+    # a blocking put on a full queue.Queue would wait forever
+    thread = threading.Thread(target=lambda: [q.put(i, timeout=None) for i in range(10)])
+    thread.start()
+    thread.join(2)
+    assert not thread.is_alive()
+
+    # dropped items are counted as done
+    while not q.empty():
+        q.get_nowait()
+        q.task_done()
+    q.join()
+
+
+def test_unknown_drop_policy():
+    with pytest.raises(ValueError):
+        BoundedReceiveQueue(1, 'drop_random')
@@ -0,0 +1,68 @@
+import time
+
+import pytest
+from eltakobus.message import Regular4BSMessage, RPSMessage
+
+from esp2_gateway_adapter.esp2_tcp_com import ESP2TCP2SerialCommunicator
+from esp2_gateway_adapter.state_cache import DeviceStateCache
+
+
+def wait_until(condition, timeout:float=5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def communicators():
+    created = []
+    yield created
+    for com in created:
+        com.stop()
+        com.join(5)
+
+
+def connect(communicators, gateway, **kwargs) -> ESP2TCP2SerialCommunicator:
+    com = ESP2TCP2SerialCommunicator('127.0.0.1', gateway.port, **kwargs)
+    communicators.append(com)
+    com.start()
+    assert com.is_serial_connected.wait(5)
+    return com
+
+
+def test_receive_and_send(gateway, communicators):
+    received = []
+    com = connect(communicators, gateway, callback=received.append)
+    conn = gateway.wait_for_connection()
+
+    button = RPSMessage(b'\x01\x00\x00\x01', 0x30, b'\x50', True)
+    # garbage in front of a telegram is skipped
+    conn.sendall(b'\x00\x01' + button.serialize())
+    assert wait_until(lambda: len(received) == 1)
+    assert received[0].serialize() == button.serialize()
+
+    command = Regular4BSMessage(b'\xFF\x80\x00\x01', 0x00, b'\x01\x02\x03\x08', True)
+    com.send_message(command)
+    assert conn.recv(100) == command.serialize()
+
+
+def test_shared_state_cache(gateway, communicators):
+    cache = DeviceStateCache()
+    connect(communicators, gateway, state_cache=cache, gateway_id=1)
+    conn = gateway.wait_for_connection()
+    second = connect(communicators, gateway, state_cache=cache, gateway_id=2)
+    second_conn = gateway.wait_for_connection(2)
+
+    conn.sendall(RPSMessage(b'\x01\x00\x00\x01', 0x30, b'\x50', True).serialize())
+    second_conn.sendall(RPSMessage(b'\x01\x00\x00\x01', 0x30, b'\x70', True).serialize())
+    assert wait_until(lambda: len(cache) == 2)
+
+    # every gateway only reports the telegrams it received itself
+    states = second.get_device_states()
+    assert len(states) == 1
+    assert states[0].data == b'\x70'
+    assert states[0].received is not None
+    assert cache.get('01-00-00-01', gateway_id=1).to_message().data == b'\x50'
@@ -0,0 +1,334 @@
+import asyncio
+import os
+import sys
+import time
+import tty
+
+import pytest
+from enocean.protocol.constants import PACKET, RETURN_CODE, RORG
+from enocean.protocol.packet import Packet
+from eltakobus.message import Regular4BSMessage
+
+from esp2_gateway_adapter.bounded_queue import DROP_NEWEST, DROP_OLDEST
+from esp2_gateway_adapter.esp3_serial_com import RET_NO_FREE_BUFFER, ESP3SerialCommunicator, SendError, SendTimeoutError
+from esp2_gateway_adapter.link_quality import LinkQualityIndex
+from esp2_gateway_adapter.rate_limiter import AddressRateLimiter
+from esp2_gateway_adapter.telegram import telegram_rorg
+from esp2_gateway_adapter.usb_stick_emulator import VirtualUSBStick
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason="tests need a pseudo terminal")
+
+
+def radio(i:int) -> Packet:
+    return Packet(PACKET.RADIO_ERP1, [0xF6, i, 0xFF, 0xD6, 0x30, 0x01, 0x30], [])
+
+
+def bs4(sender:int, value:int) -> Packet:
+    return Packet(PACKET.RADIO_ERP1, [RORG.BS4, 0, 0, value, 0x08] + list(sender.to_bytes(4, 'big')) + [0x00], [0x01, 0xFF, 0xFF, 0xFF, 0xFF, 0x40, 0x00])
+
+
+def wait_until(condition, timeout:float=5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class SerialLine():
+    ''' Pseudo terminal which ESP3SerialCommunicator opens like a USB stick. Telegrams are written by the test. '''
+
+    def __init__(self):
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        self.port = os.ttyname(self._slave_fd)
+
+    def write(self, *packets:Packet):
+        os.write(self._master_fd, b''.join(bytes(p.build()) for p in packets))
+
+    def close(self):
+        os.close(self._master_fd)
+        os.close(self._slave_fd)
+
+
+@pytest.fixture
+def serial_line():
+    line = SerialLine()
+    yield line
+    line.close()
+
+
+@pytest.fixture
+def communicators():
+    created = []
+    yield created
+    for com in created:
+        com.stop()
+        com.join(5)
+
+
+def open_serial_line(communicators, serial_line, **kwargs) -> ESP3SerialCommunicator:
+    com = ESP3SerialCommunicator(serial_line.port, **kwargs)
+    communicators.append(com)
+    com.start()
+    assert com.is_serial_connected.wait(5)
+    return com
+
+
+def test_messages(serial_line, communicators):
+    com = open_serial_line(communicators, serial_line)
+
+    async def main():
+        async def collect(iterator, count:int):
+            result = []
+            async for msg in iterator:
+                result.append(msg)
+                if len(result) == count:
+                    break
+            return result
+
+        sensor = asyncio.ensure_future(collect(com.messages(addresses=['01-00-00-02']), 2))
+        batches = asyncio.ensure_future(collect(com.messages(batched=True), 1))
+        await asyncio.sleep(0)
+        serial_line.write(bs4(0x01000001, 1), bs4(0x01000002, 2), bs4(0x01000001, 3), bs4(0x01000002, 4))
+        return await asyncio.wait_for(asyncio.gather(sensor, batches), 5)
+
+    sensor, batches = asyncio.run(main())
+    assert [m.data[3] for m in sensor] == [2, 4]
+    assert all(m.received is not None for m in sensor)
+    assert 1 <= len(batches[0]) <= 4
+
+
+def test_messages_end_when_stopped(serial_line, communicators):
+    com = open_serial_line(communicators, serial_line)
+
+    async def main():
+        async def consume():
+            return [msg async for msg in com.messages()]
+
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0)
+        serial_line.write(bs4(0x01000001, 1))
+        await asyncio.sleep(0.3)
+        com.stop()
+        return await asyncio.wait_for(task, 5)
+
+    assert [m.data[3] for m in asyncio.run(main())] == [1]
+
+
+def test_callback_batching(serial_line, communicators):
+    batches = []
+    open_serial_line(communicators, serial_line, callback=batches.append, callback_batching=True, callback_batch_interval=0.2)
+
+    for i in range(4):
+        serial_line.write(*[bs4(0x01000001, i * 10 + j) for j in range(10)])
+        time.sleep(0.02)
+
+    assert wait_until(lambda: sum(len(b) for b in batches) == 40)
+    assert all(isinstance(b, list) for b in batches)
+    # reads within the batch interval are collected into one batch
+    assert len(batches) < 4
+    assert [m.data[3] for b in batches for m in b] == list(range(40))
+    assert all(m.received is not None for b in batches for m in b)
+
+
+@pytest.fixture
+def stick():
+    stick = VirtualUSBStick(baud_rate=None)
+    yield stick
+    stick.stop()
+
+
+def connect(communicators, stick, **kwargs) -> ESP3SerialCommunicator:
+    com = ESP3SerialCommunicator(stick.port, **kwargs)
+    communicators.append(com)
+    com.start()
+    assert com.is_serial_connected.wait(5)
+    return com
+
+
+def test_virtual_usb_stick_traffic(stick, communicators):
+    received = []
+    stick.baud_rate = 57600
+    stick.telegram_rate = 500
+    stick.telegram_count = 100
+    stick.sender_count = 4
+    connect(communicators, stick, callback=received.append)
+    stick.start()
+
+    assert wait_until(lambda: len(received) == 100)
+    assert [VirtualUSBStick.sequence_number(p) for p in received] == list(range(100))
+    assert {p.sender_int for p in received} == {0x01000000, 0x01000001, 0x01000002, 0x01000003}
+    assert stick.sent_radio_telegrams == 100
+    assert all(stick.sent_time(i) > 0 for i in range(100))
+
+
+@pytest.mark.parametrize('drop_policy, kept', [(DROP_OLDEST, list(range(15, 20))), (DROP_NEWEST, list(range(5)))])
+def test_receive_queue_drop_policy(stick, communicators, drop_policy, kept):
+    stick.telegram_rate = 500
+    stick.telegram_count = 20
+    com = connect(communicators, stick, receive_queue_size=5, receive_drop_policy=drop_policy)
+    stick.start()
+
+    assert wait_until(lambda: com.receive.dropped == 15)
+    assert [VirtualUSBStick.sequence_number(com.receive.get_nowait()) for _ in range(5)] == kept
+    assert com.get_statistics()['receive_queue_dropped'] == 15
+
+
+def test_base_id_request_keeps_delivering(stick, communicators):
+    received = []
+    stick.telegram_rate = 500
+    stick.telegram_count = 20
+    com = connect(communicators, stick, callback=received.append)
+    stick.start()
+
+    assert com.base_id == list(stick.base_id)
+    assert asyncio.run(com.get_repeater_mode()) is not None
+    # telegrams received while waiting for the responses still reach the callback
+    assert wait_until(lambda: sum(p.packet_type == PACKET.RADIO_ERP1 for p in received) == 20)
+
+
+def test_send_cache(stick, communicators):
+    stick.start()
+    com = connect(communicators, stick, esp2_translation_enabled=True)
+    msg = Regular4BSMessage(b'\xFF\x80\x00\x01', 0x00, b'\x01\x02\x03\x08', True)
+
+    assert asyncio.run(com.send(msg)) is True
+    assert asyncio.run(com.send(msg)) is True
+    assert wait_until(lambda: stick.received_radio_telegrams == 2)
+    # the second message is not converted again
+    statistics = com.get_statistics()
+    assert (statistics['send_cache_hits'], statistics['send_cache_misses']) == (1, 1)
+    first, second = list(stick.received_telegrams)[-2:]
+    assert first.data == second.data == [RORG.BS4, 0x01, 0x02, 0x03, 0x08, 0xFF, 0x80, 0x00, 0x01, 0x00]
+
+
+def test_send_window_acknowledged(stick, communicators):
+    stick.start()
+    com = connect(communicators, stick, send_window=2)
+
+    async def send_all():
+        return await asyncio.gather(*[com.send(radio(i)) for i in range(5)])
+
+    assert asyncio.run(send_all()) == [True] * 5
+    assert stick.received_radio_telegrams == 5
+    assert com.get_statistics()['send_in_flight'] == 0
+
+
+def test_send_window_retries_busy_gateway(stick, communicators):
+    stick.start()
+    stick.radio_response_codes.extend([RET_NO_FREE_BUFFER, RETURN_CODE.ERROR])
+    com = connect(communicators, stick, send_window=1, send_retries=2)
+
+    assert asyncio.run(com.send(radio(0))) is True
+    assert stick.received_radio_telegrams == 3
+    assert com.get_statistics()['send_retries'] == 2
+
+
+def test_send_window_rejected(stick, communicators):
+    stick.start()
+    stick.radio_response_codes.append(RETURN_CODE.NOT_SUPPORTED)
+    com = connect(communicators, stick, send_window=1)
+
+    with pytest.raises(SendError) as e:
+        asyncio.run(com.send(radio(0)))
+    assert e.value.return_code == RETURN_CODE.NOT_SUPPORTED
+    assert com.get_statistics()['send_failures'] == 1
+
+
+def test_send_window_timeout(stick, communicators):
+    # stick is not started, nobody answers
+    com = connect(communicators, stick, send_window=2, send_timeout=0.1, send_retries=1)
+
+    async def send_all():
+        return await asyncio.gather(*[com.send(radio(i)) for i in range(3)], return_exceptions=True)
+
+    results = asyncio.run(send_all())
+    assert all(isinstance(r, SendTimeoutError) for r in results)
+    # the communicator thread gives up on the telegrams as well
+    assert wait_until(lambda: com.get_statistics()['send_in_flight'] == 0, timeout=2)
+
+
+def test_stop_fails_pending_sends(stick, communicators):
+    com = connect(communicators, stick, send_window=1, send_timeout=5)
+
+    async def send_and_stop():
+        tasks = [asyncio.ensure_future(com.send(radio(i))) for i in range(3)]
+        await asyncio.sleep(0.2)
+        com.stop()
+        return await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), 2)
+
+    results = asyncio.run(send_and_stop())
+    assert all(isinstance(r, SendError) for r in results)
+
+
+def test_send_without_connection_fails(stick):
+    com = ESP3SerialCommunicator(stick.port, send_window=1)
+    with pytest.raises(SendError):
+        asyncio.run(com.send(radio(0)))
+
+
+def test_rate_limiter_coalesces(stick, communicators):
+    received = []
+    stick.telegram_rate = 200
+    stick.telegram_count = 20
+    stick.sender_count = 2
+    # synthetic telegrams carry the sequence number in DB3-DB0, so they are only keyed by sender and RORG
+    rate_limiter = AddressRateLimiter(interval=10, key=telegram_rorg)
+    com = connect(communicators, stick, callback=received.append, rate_limiter=rate_limiter)
+    stick.start()
+
+    # first telegram of each sender is passed, the latest of the other 9 is kept and 8 are replaced
+    assert wait_until(lambda: rate_limiter.get_statistics()['rate_limit_coalesced'] == 16)
+    assert len(received) == 2
+    assert com.get_statistics()['rate_limit_pending'] == 2
+
+    com.stop()
+    com.join(5)
+    # latest telegram of every sender is passed when the communicator stops
+    assert len(received) == 4
+    assert [VirtualUSBStick.sequence_number(p) for p in received[2:]] == [18, 19]
+
+
+def test_async_start_returns_identity(stick, communicators):
+    stick.start()
+    com = ESP3SerialCommunicator(stick.port)
+    communicators.append(com)
+
+    identity = asyncio.run(com.async_start(timeout=5))
+
+    assert identity.base_id == list(stick.base_id)
+    assert identity.version.app_description == 'GATEWAYCTRL'
+    assert identity.version.chip_id == stick.chip_id
+    assert identity.repeater_mode is not None
+    assert identity.timings['total'] >= identity.timings['connect']
+    assert com.base_id == list(stick.base_id)
+
+
+def test_async_start_restarts_stopped_communicator(stick, communicators):
+    stick.start()
+    com = ESP3SerialCommunicator(stick.port)
+    communicators.append(com)
+
+    asyncio.run(com.async_start(timeout=5))
+    com.stop()
+    com.join(5)
+    assert not com.is_alive()
+
+    identity = asyncio.run(com.async_start(timeout=5))
+    assert com.is_alive()
+    assert identity.base_id == list(stick.base_id)
+
+
+def test_link_quality(stick, communicators):
+    index = LinkQualityIndex()
+    stick.telegram_rate = 500
+    stick.telegram_count = 20
+    stick.sender_count = 4
+    connect(communicators, stick, link_quality=index, gateway_id=7)
+    stick.start()
+
+    assert wait_until(lambda: sum(q.telegrams for q in index.snapshot()) == 20)
+    assert sorted(q.address for q in index.snapshot()) == [0x01000000, 0x01000001, 0x01000002, 0x01000003]
+    assert all(q.gateway_id == 7 and -95 <= q.min_dbm <= q.max_dbm <= -40 for q in index.snapshot())
@@ -0,0 +1,192 @@
+import asyncio
+import socket
+import sys
+import time
+
+import pytest
+from enocean.protocol.constants import PACKET, RORG
+from enocean.protocol.packet import Packet
+
+from esp2_gateway_adapter.esp3_tcp_com import TCP2SerialCommunicator, rank_lan_gateways
+
+BASE_ID_REQUEST = bytes(Packet(PACKET.COMMON_COMMAND, data=[0x08], optional=[]).build())
+
+
+def bs4(sender:int, value:int) -> bytes:
+    return bytes(Packet(PACKET.RADIO_ERP1, [RORG.BS4, 0, 0, value, 0x08] + list(sender.to_bytes(4, 'big')) + [0x00], [0x01, 0xFF, 0xFF, 0xFF, 0xFF, 0x40, 0x00]).build())
+
+
+@pytest.fixture
+def communicators():
+    created = []
+    yield created
+    for com in created:
+        com.stop()
+        com.join(5)
+
+
+def connect(communicators, gateway, **kwargs) -> TCP2SerialCommunicator:
+    com = TCP2SerialCommunicator('127.0.0.1', gateway.port, **kwargs)
+    communicators.append(com)
+    com.start()
+    assert com.is_serial_connected.wait(5)
+    return com
+
+
+def test_receive(gateway, communicators):
+    received = []
+    connect(communicators, gateway, callback=received.append)
+    conn = gateway.wait_for_connection()
+    # telegrams can be split across reads
+    data = bs4(0x01000001, 1) + bs4(0x01000001, 2)
+    conn.sendall(data[:5])
+    time.sleep(0.05)
+    conn.sendall(data[5:])
+
+    deadline = time.monotonic() + 5
+    while len(received) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [p.data[3] for p in received] == [1, 2]
+
+
+def test_idle_connection_is_probed_and_dropped(gateway, communicators):
+    connect(communicators, gateway, tcp_keep_alive_timeout=1.5, reconnection_initial_delay=0.05)
+    conn = gateway.wait_for_connection()
+
+    # shortly before the timeout the gateway is asked for its base id
+    started = time.monotonic()
+    assert conn.recv(100) == BASE_ID_REQUEST
+    assert 0.3 < time.monotonic() - started < 1.5
+
+    # nothing is answered, so the connection is considered dead and a new one is established
+    assert gateway.wait_for_connection(2, timeout=3) is not None
+    assert conn.recv(100) == b''
+
+
+def test_answered_probe_keeps_connection(gateway, communicators):
+    com = connect(communicators, gateway, tcp_keep_alive_timeout=1.5)
+    conn = gateway.wait_for_connection()
+
+    for _ in range(2):
+        assert conn.recv(100) == BASE_ID_REQUEST
+        conn.sendall(bytes(Packet(PACKET.RESPONSE, data=[0x00, 0xFF, 0x80, 0x00, 0x00], optional=[0x0A]).build()))
+    assert gateway.wait_for_connection(2, timeout=0.5) is None
+    assert com.is_serial_connected.is_set()
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="kernel keep-alive timing is configured for Linux")
+def test_kernel_keep_alive_replaces_probes(gateway, communicators):
+    com = connect(communicators, gateway, tcp_keep_alive_timeout=1.5, kernel_keep_alive=True)
+    conn = gateway.wait_for_connection()
+
+    # the kernel answers keep-alive probes of the peer, no telegrams are sent and the idle connection stays open
+    conn.settimeout(2.5)
+    with pytest.raises(socket.timeout):
+        conn.recv(100)
+    assert gateway.wait_for_connection(2, timeout=0) is None
+    assert com.is_serial_connected.is_set()
+
+
+async def serve_base_id(host:str, port:int, base_id:bytes | None, delay:float) -> asyncio.AbstractServer:
+    ''' Fake LAN gateway which answers CO_RD_IDBASE after the given delay (never if base_id is None). '''
+    async def handle(reader, writer):
+        await reader.read(100)
+        if base_id is not None:
+            await asyncio.sleep(delay)
+            writer.write(bytes(Packet(PACKET.RESPONSE, data=[0x00] + list(base_id), optional=[0x0A]).build()))
+            await writer.drain()
+        await reader.read(100)
+        writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="needs the loopback addresses 127.0.0.2-5")
+def test_rank_lan_gateways():
+    async def main():
+        first = await serve_base_id('127.0.0.1', 0, b'\xFF\x80\x00\x00', 0.3)
+        port = first.sockets[0].getsockname()[1]
+        servers = [
+            first,
+            # same gateway as 127.0.0.1 via another address
+            await serve_base_id('127.0.0.2', port, b'\xFF\x80\x00\x00', 0),
+            await serve_base_id('127.0.0.3', port, b'\xFF\x90\x00\x00', 0.1),
+            # reachable but does not answer
+            await serve_base_id('127.0.0.4', port, None, 0),
+        ]
+        try:
+            # nothing listens on 127.0.0.5
+            return await rank_lan_gateways(['127.0.0.1', '127.0.0.2', '127.0.0.3', '127.0.0.4', '127.0.0.5'], port, timeout=1)
+        finally:
+            for server in servers:
+                server.close()
+
+    ranked = asyncio.run(main())
+    assert [r.host for r in ranked] == ['127.0.0.2', '127.0.0.3', '127.0.0.4']
+    assert ranked[0].base_id == b'\xFF\x80\x00\x00'
+    assert ranked[0].latency < ranked[1].latency
+    assert ranked[2].base_id is None and ranked[2].round_trip_time is None
+
+
+def test_reconnect_after_connection_loss(gateway, communicators):
+    com = connect(communicators, gateway, reconnection_initial_delay=0.05)
+    statistics = com.get_statistics()
+    assert statistics['connect_time'] is not None
+    assert statistics['reconnects'] == 0
+
+    gateway.wait_for_connection().close()
+    assert gateway.wait_for_connection(2) is not None
+    assert com.is_serial_connected.wait(5)
+    statistics = com.get_statistics()
+    assert statistics['reconnects'] == 1
+    assert 0 < statistics['reconnect_time'] < 1
+
+
+def test_reconnect_requested(gateway, communicators):
+    statuses = []
+    com = connect(communicators, gateway, reconnection_initial_delay=10)
+    com.set_status_changed_handler(statuses.append)
+    conn = gateway.wait_for_connection()
+
+    # the connection is replaced right away, there is no reconnection delay
+    com.reconnect()
+    assert gateway.wait_for_connection(2, timeout=1) is not None
+    assert conn.recv(100) == b''
+    assert com.is_serial_connected.wait(1)
+    time.sleep(0.05)
+    assert statuses[-2:] == [False, True]
+
+
+def test_stop_interrupts_reconnection_delay(gateway, communicators):
+    com = connect(communicators, gateway, reconnection_initial_delay=30, reconnection_timeout=60)
+    gateway.close()
+
+    # wait until the communicator noticed the closed connection and waits for the next attempt
+    deadline = time.monotonic() + 5
+    while com.is_serial_connected.is_set() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+
+    started = time.monotonic()
+    com.stop()
+    com.join(5)
+    assert not com.is_alive()
+    assert time.monotonic() - started < 1
+
+
+def test_restart(gateway, communicators):
+    com = connect(communicators, gateway)
+    with pytest.raises(RuntimeError):
+        com.start()
+
+    com.restart()
+    assert gateway.wait_for_connection(2) is not None
+    assert com.is_serial_connected.wait(5)
+
+    com.stop()
+    com.join(5)
+    assert not com.is_alive()
+    # a stopped communicator can be started again
+    com.restart()
+    assert gateway.wait_for_connection(3) is not None
+    assert com.is_alive()
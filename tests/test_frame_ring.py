@@ -0,0 +1,151 @@
+import pytest
+
+from esp2_gateway_adapter.frame_ring import FrameRingReader, FrameRingWriter
+from esp2_gateway_adapter.frames import FRAME_HEADER, PROTOCOL_ESP2, encode_frame
+
+# 18 bytes header + 14 bytes ESP2 telegram
+FRAME_SIZE = FRAME_HEADER.size + 14
+
+
+def frame(i:int) -> bytes:
+    return encode_frame(float(i), 1, PROTOCOL_ESP2, bytes([i]) * 14, sender=i)
+
+
+@pytest.fixture
+def ring_path(tmp_path):
+    return str(tmp_path / 'ring')
+
+
+def test_read_new_frames(ring_path):
+    writer = FrameRingWriter(ring_path, capacity=1024)
+    writer.write_frame(frame(0))
+    reader = FrameRingReader(ring_path)
+    writer.write_frame(frame(1))
+    writer.write_frame(frame(2))
+
+    frames = reader.poll()
+    assert [f.sender for f in frames] == [1, 2]
+    assert bytes(frames[0].raw) == bytes([1]) * 14
+    assert frames[0].gateway_id == 1
+    assert reader.poll() == []
+
+    reader.close()
+    writer.close()
+
+
+def test_from_start(ring_path):
+    writer = FrameRingWriter(ring_path, capacity=1024)
+    for i in range(3):
+        writer.write_frame(frame(i))
+    reader = FrameRingReader(ring_path, from_start=True)
+    assert [f.sender for f in reader.poll(max_frames=2)] == [0, 1]
+    assert [f.sender for f in reader.poll()] == [2]
+    reader.close()
+    writer.close()
+
+
+def test_wraparound(ring_path):
+    # 3 frames fit, the rest of the data area is too small for a header and is skipped
+    writer = FrameRingWriter(ring_path, capacity=3 * FRAME_SIZE + 4)
+    reader = FrameRingReader(ring_path)
+
+    received = []
+    for i in range(10):
+        writer.write_frame(frame(i))
+        received.extend(f.sender for f in reader.poll())
+    assert received == list(range(10))
+    assert reader.overruns == 0
+    reader.close()
+    writer.close()
+
+    # rest of the data area is big enough for a padding frame
+    writer = FrameRingWriter(ring_path + '2', capacity=3 * FRAME_SIZE + FRAME_HEADER.size)
+    reader = FrameRingReader(ring_path + '2')
+    received = []
+    for i in range(10):
+        writer.write_frame(frame(i))
+        writer.write_frame(frame(i + 100))
+        received.extend(f.sender for f in reader.poll())
+    assert received == [s for i in range(10) for s in (i, i + 100)]
+    assert reader.overruns == 0
+    reader.close()
+    writer.close()
+
+
+def test_overrun(ring_path):
+    writer = FrameRingWriter(ring_path, capacity=4 * FRAME_SIZE)
+    reader = FrameRingReader(ring_path)
+    for i in range(10):
+        writer.write_frame(frame(i))
+
+    # slow reader loses the overwritten frames and continues with the oldest one in the buffer
+    assert [f.sender for f in reader.poll()] == [6, 7, 8, 9]
+    assert reader.overruns == 1
+    assert reader.lost_bytes == 6 * FRAME_SIZE
+
+    writer.write_frame(frame(10))
+    assert [f.sender for f in reader.poll()] == [10]
+    reader.close()
+    writer.close()
+
+
+def test_frame_too_big(ring_path):
+    writer = FrameRingWriter(ring_path, capacity=2 * FRAME_SIZE)
+    with pytest.raises(ValueError):
+        writer.write_frame(encode_frame(0, 0, PROTOCOL_ESP2, bytes(3 * FRAME_SIZE)))
+    writer.close()
+
+
+def test_new_writer_continues_stream(ring_path):
+    writer = FrameRingWriter(ring_path, capacity=1024)
+    writer.write_frame(frame(0))
+    reader = FrameRingReader(ring_path)
+    writer.close()
+
+    writer = FrameRingWriter(ring_path, capacity=1024)
+    writer.write_frame(frame(1))
+    assert [f.sender for f in reader.poll()] == [1]
+    reader.close()
+    writer.close()
+
+
+def test_overrun_by_padding(ring_path, monkeypatch):
+    # frames of different sizes: the padding in front of the last frame overwrites a frame the reader did not read yet
+    from esp2_gateway_adapter import frame_ring
+
+    def sized_frame(i:int, size:int) -> bytes:
+        return encode_frame(float(i), 1, PROTOCOL_ESP2, bytes([i]) * (size - FRAME_HEADER.size), sender=i)
+
+    writer = FrameRingWriter(ring_path, capacity=100)
+    reader = FrameRingReader(ring_path)
+    received = []
+
+    def poll():
+        # raw points into the ring, copy it before the writer continues
+        received.extend((f.timestamp, f.sender, bytes(f.raw)) for f in reader.poll())
+
+    class PollingHeader():
+        ''' Lets the reader poll right after the padding header was written. '''
+        size = FRAME_HEADER.size
+        unpack_from = FRAME_HEADER.unpack_from
+
+        def pack_into(self, buffer, offset, *values):
+            FRAME_HEADER.pack_into(buffer, offset, *values)
+            poll()
+
+    writer.write_frame(sized_frame(1, 30))
+    writer.write_frame(sized_frame(2, 30))
+    poll()
+    writer.write_frame(sized_frame(3, 30))
+    writer.write_frame(sized_frame(4, 50))
+    monkeypatch.setattr(frame_ring, 'FRAME_HEADER', PollingHeader())
+    writer.write_frame(sized_frame(5, 60))
+    poll()
+
+    for timestamp, sender, raw in received:
+        assert timestamp == sender
+        assert raw == bytes([sender]) * len(raw)
+    assert [sender for _, sender, _ in received] == [1, 2, 5]
+    assert reader.overruns == 1
+    reader.close()
+    writer.close()
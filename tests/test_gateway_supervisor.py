@@ -0,0 +1,94 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+from eltakobus.message import RPSMessage
+
+from esp2_gateway_adapter.gateway_supervisor import GatewaySupervisor
+
+
+class FakeGateway():
+    ''' Stands in for a communicator in the worker process. Reports itself as connected and passes one telegram of its
+    sender to the callback. Sending a message kills the worker process. '''
+
+    def __init__(self, sender:int, callback, callback_batching:bool, callback_batch_interval:float):
+        self._sender = sender
+        self._callback = callback
+        self._status_handler = None
+
+    def set_status_changed_handler(self, handler):
+        self._status_handler = handler
+
+    def start(self):
+        self._status_handler(True)
+        self._callback([RPSMessage(self._sender.to_bytes(4, 'big'), 0x30, b'\x50', True)])
+
+    def send_message(self, msg):
+        os._exit(3)
+
+    def stop(self):
+        pass
+
+
+@pytest.fixture
+def importable_package(tmp_path, monkeypatch):
+    # worker processes are spawned and import the package by name, which is not installed (see conftest.py)
+    src_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+    os.symlink(src_dir, tmp_path / 'esp2_gateway_adapter')
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+
+def wait_until(condition, timeout:float=30) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="needs symlinks")
+def test_sharding_and_worker_restart(importable_package):
+    frames = []
+    status = []
+    lock = threading.Lock()
+
+    def on_frame(frame):
+        with lock:
+            frames.append((frame.gateway_id, frame.sender))
+
+    def on_status(gateway_id, connected):
+        with lock:
+            status.append((gateway_id, connected))
+
+    supervisor = GatewaySupervisor(callback=on_frame, status_callback=on_status, processes=2, restart_delay=0.1)
+    for i in range(5):
+        assert supervisor.add_gateway(FakeGateway, sender=0x01000000 + i) == i
+    supervisor.start()
+    try:
+        assert wait_until(lambda: len(frames) == 5)
+        # every telegram is tagged with the id of the gateway which received it
+        assert sorted(frames) == [(i, 0x01000000 + i) for i in range(5)]
+
+        workers = supervisor.get_statistics()['workers']
+        assert [w['gateways'] for w in workers] == [[0, 2, 4], [1, 3]]
+        assert workers[0]['pid'] != workers[1]['pid']
+        pid = workers[1]['pid']
+
+        # the worker of gateways 1 and 3 crashes and is started again, the other worker is not affected
+        assert supervisor.send(3, RPSMessage(b'\xFF\x80\x00\x01', 0x30, b'\x10', True))
+        assert wait_until(lambda: supervisor.get_statistics()['workers'][1]['restarts'] == 1)
+        assert wait_until(lambda: len(frames) == 7)
+        assert sorted(frames[5:]) == [(1, 0x01000001), (3, 0x01000003)]
+        assert (1, False) in status and (3, False) in status
+        assert status.count((0, True)) == 1
+        assert status.count((3, True)) == 2
+
+        workers = supervisor.get_statistics()['workers']
+        assert workers[1]['pid'] != pid
+        assert workers[1]['alive']
+        assert workers[0]['restarts'] == 0
+    finally:
+        supervisor.stop()
@@ -0,0 +1,44 @@
+import threading
+import time
+
+from esp2_gateway_adapter.lifecycle import ReconnectBackoff
+
+
+def test_delay_grows_up_to_max_delay():
+    backoff = ReconnectBackoff(initial_delay=0.5, max_delay=3, factor=2, jitter=0)
+    delays = []
+    for _ in range(5):
+        delays.append(backoff.next_delay())
+        backoff.failures += 1
+    assert delays == [0.5, 1, 2, 3, 3]
+
+    backoff.reset()
+    assert backoff.next_delay() == 0.5
+
+
+def test_jitter_shortens_delay():
+    backoff = ReconnectBackoff(initial_delay=1, jitter=0.5)
+    delays = [backoff.next_delay() for _ in range(100)]
+    assert all(0.5 <= d <= 1 for d in delays)
+    assert len(set(delays)) > 1
+
+
+def test_wait_counts_failures():
+    backoff = ReconnectBackoff(initial_delay=0.01, jitter=0)
+    backoff.wait()
+    backoff.wait()
+    assert backoff.failures == 2
+    assert backoff.next_delay() == 0.04
+
+
+def test_interrupt():
+    backoff = ReconnectBackoff()
+    threading.Timer(0.05, backoff.interrupt).start()
+    started = time.monotonic()
+    backoff.wait(30)
+    assert time.monotonic() - started < 1
+
+    # the interrupt only ends the current wait
+    started = time.monotonic()
+    backoff.wait(0.1)
+    assert time.monotonic() - started >= 0.1
@@ -0,0 +1,52 @@
+import pytest
+from enocean.protocol.constants import PACKET, RORG
+from enocean.protocol.packet import Packet
+
+from esp2_gateway_adapter.link_quality import LinkQualityIndex
+
+
+def radio(sender:int, dbm:int, subtelegrams:int=1) -> Packet:
+    return Packet(PACKET.RADIO_ERP1, [RORG.BS4, 0, 0, 0, 0x08] + list(sender.to_bytes(4, 'big')) + [0x00], [subtelegrams, 0xFF, 0xFF, 0xFF, 0xFF, -dbm, 0x00])
+
+
+def test_statistics_per_gateway():
+    index = LinkQualityIndex(smoothing=0.5)
+    index.update(radio(1, -60), gateway_id=1, now=100)
+    index.update(radio(1, -70, subtelegrams=3), gateway_id=1, now=101)
+    index.update(radio(1, -50), gateway_id=2, now=102)
+
+    best, worst = index.get('00-00-00-01')
+    assert (best.gateway_id, best.telegrams, best.mean_dbm) == (2, 1, -50)
+    assert worst.gateway_id == 1
+    assert worst.telegrams == 2
+    assert worst.subtelegrams == 4
+    assert (worst.last_dbm, worst.min_dbm, worst.max_dbm) == (-70, -70, -60)
+    assert worst.mean_dbm == -65
+    assert worst.std_dbm == pytest.approx(5)
+    assert worst.last_seen == 101
+
+
+def test_ignores_packets_without_dbm():
+    index = LinkQualityIndex()
+    index.update(Packet(PACKET.RADIO_ERP1, [RORG.RPS, 0x50, 0, 0, 0, 1, 0x30], []))
+    index.update(Packet(PACKET.RESPONSE, [0x00], []))
+    assert len(index) == 0
+
+
+def test_evicts_least_recently_seen_link():
+    index = LinkQualityIndex(max_links=2)
+    index.update(radio(1, -60), now=1)
+    index.update(radio(2, -60), now=2)
+    # 1 is seen again, so 2 is the least recently seen link
+    index.update(radio(1, -61), now=3)
+    index.update(radio(3, -62), now=4)
+
+    assert len(index) == 2
+    assert index.get(2) == []
+    assert [q.address for q in index.snapshot()] == [1, 3]
+    # the slot of the evicted link starts with fresh statistics
+    assert index.get(3)[0].telegrams == 1
+    assert index.get(1)[0].telegrams == 2
+
+    index.clear()
+    assert index.snapshot() == []
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+
+from enocean.protocol.constants import PACKET, RORG
+from enocean.protocol.packet import Packet
+
+from esp2_gateway_adapter.message_stream import MessageHub
+
+
+def radio(sender:int, rorg:int=RORG.BS4, value:int=0) -> Packet:
+    data = [rorg, value] if rorg == RORG.RPS else [rorg, 0, 0, value, 0x08]
+    return Packet(PACKET.RADIO_ERP1, data + list(sender.to_bytes(4, 'big')) + [0x00], [])
+
+
+def publish_from_thread(hub:MessageHub, messages:list) -> threading.Thread:
+    thread = threading.Thread(target=lambda: [hub.publish(m) for m in messages])
+    thread.start()
+    return thread
+
+
+def test_messages_from_other_thread():
+    hub = MessageHub()
+    sent = [radio(1, value=i) for i in range(20)]
+
+    async def consume():
+        received = []
+        async for msg in hub.messages():
+            received.append(msg)
+            if len(received) == 1:
+                publish_from_thread(hub, sent[1:]).join()
+                hub.close()
+        return received
+
+    async def main():
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0)
+        # subscription exists after the first step of the consumer
+        assert hub.has_subscribers
+        hub.publish(sent[0])
+        return await asyncio.wait_for(task, 2)
+
+    assert asyncio.run(main()) == sent
+    assert not hub.has_subscribers
+
+
+def test_filters():
+    hub = MessageHub()
+    button = radio(1, RORG.RPS)
+    sensor = radio(2)
+    other = radio(3)
+
+    async def main():
+        async def collect(iterator):
+            return [msg async for msg in iterator]
+
+        tasks = [
+            asyncio.ensure_future(collect(hub.messages(addresses=['00-00-00-02', 3]))),
+            asyncio.ensure_future(collect(hub.messages(rorgs=[RORG.RPS]))),
+            asyncio.ensure_future(collect(hub.messages(predicate=lambda msg: msg is other))),
+        ]
+        await asyncio.sleep(0)
+        publish_from_thread(hub, [button, sensor, other]).join()
+        hub.close()
+        return await asyncio.wait_for(asyncio.gather(*tasks), 2)
+
+    by_address, by_rorg, by_predicate = asyncio.run(main())
+    assert by_address == [sensor, other]
+    assert by_rorg == [button]
+    assert by_predicate == [other]
+
+
+def test_batched_and_maxsize():
+    hub = MessageHub()
+    sent = [radio(1, value=i) for i in range(10)]
+
+    async def main():
+        iterator = hub.messages(batched=True, maxsize=4)
+        first = asyncio.ensure_future(iterator.__anext__())
+        await asyncio.sleep(0)
+        # one burst: all messages are handed over in one batch, the oldest beyond maxsize are dropped
+        for msg in sent:
+            hub.publish(msg)
+        batch = await asyncio.wait_for(first, 2)
+        await iterator.aclose()
+        return batch
+
+    assert asyncio.run(main()) == sent[-4:]
+    assert not hub.has_subscribers
+
+
+def test_close_ends_iteration():
+    hub = MessageHub()
+
+    async def main():
+        async def consume():
+            return [msg async for msg in hub.messages()]
+
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0)
+        threading.Thread(target=hub.close).start()
+        return await asyncio.wait_for(task, 2)
+
+    assert asyncio.run(main()) == []
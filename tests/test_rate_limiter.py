@@ -0,0 +1,93 @@
+from enocean.protocol.constants import PACKET, RORG
+from enocean.protocol.packet import Packet
+
+from eltakobus.message import ESP2Message
+
+from esp2_gateway_adapter.rate_limiter import AddressRateLimiter
+
+SENDER = [0xFF, 0xD6, 0x30, 0x01]
+
+
+def bs4(value:int, db0:int=0x08, sender:list=SENDER) -> Packet:
+    return Packet(PACKET.RADIO_ERP1, [RORG.BS4, 0, 0, value, db0] + sender + [0x00], [])
+
+
+def rps(value:int) -> Packet:
+    return Packet(PACKET.RADIO_ERP1, [RORG.RPS, value] + SENDER + [0x30], [])
+
+
+def test_coalesces_within_interval():
+    limiter = AddressRateLimiter(interval=1)
+    first, second, third = bs4(1), bs4(2), bs4(3)
+    assert limiter.offer(first, 0) == [first]
+    assert limiter.offer(second, 0.1) == []
+    assert limiter.offer(third, 0.2) == []
+    assert limiter.next_deadline(0.5) == 0.5
+
+    assert limiter.due(0.9) == []
+    # only the latest telegram is delivered when the interval is over
+    assert limiter.due(1.0) == [third]
+    assert limiter.get_statistics() == {
+        'rate_limit_passed': 1,
+        'rate_limit_coalesced': 1,
+        'rate_limit_flushed': 1,
+        'rate_limit_pending': 0,
+    }
+
+
+def test_not_limited_telegrams():
+    limiter = AddressRateLimiter(interval=1, intervals={'FF-D6-30-02': 0})
+    # button presses are not limited by default
+    assert len(limiter.offer(rps(0x30), 0)) == 1
+    assert len(limiter.offer(rps(0x10), 0)) == 1
+    # address without interval
+    assert len(limiter.offer(bs4(1, sender=[0xFF, 0xD6, 0x30, 0x02]), 0)) == 1
+    assert len(limiter.offer(bs4(2, sender=[0xFF, 0xD6, 0x30, 0x02]), 0)) == 1
+    assert limiter.next_deadline(0) is None
+
+
+def test_channels_of_one_address():
+    # A5-12 meter: tariff/channel in DB0 bits 7-4, data type (cumulative/current value) in bit 2
+    limiter = AddressRateLimiter(interval=1)
+    telegrams = [bs4(value, db0) for value in range(2) for db0 in (0x08, 0x0C, 0x18, 0x1C)]
+    delivered = []
+    for i, msg in enumerate(telegrams):
+        delivered.extend(limiter.offer(msg, i * 0.01))
+    assert delivered == telegrams[:4]
+    assert limiter.get_statistics()['rate_limit_pending'] == 4
+
+    # the latest value of every quantity is kept
+    assert limiter.due(2) == telegrams[4:]
+
+
+def test_esp2_channels():
+    limiter = AddressRateLimiter(interval=1)
+    current = ESP2Message(bytes([0x0B, 0x07, 0, 0, 1, 0x0C, *SENDER, 0x00]))
+    cumulative = ESP2Message(bytes([0x0B, 0x07, 0, 0, 2, 0x08, *SENDER, 0x00]))
+    assert limiter.offer(current, 0) == [current]
+    assert limiter.offer(cumulative, 0) == [cumulative]
+
+
+def test_custom_key():
+    limiter = AddressRateLimiter(interval=1, key=lambda msg: None)
+    assert len(limiter.offer(bs4(1, 0x08), 0)) == 1
+    assert limiter.offer(bs4(2, 0x0C), 0) == []
+
+
+def test_pending_after_early_delivery():
+    limiter = AddressRateLimiter(interval=1)
+    limiter.offer(bs4(1), 0)
+    limiter.offer(bs4(2), 0.5)
+    assert limiter.get_statistics()['rate_limit_pending'] == 1
+
+    # no due() call in between: the next telegram delivers the pending one and starts a new interval
+    latest = bs4(3)
+    assert len(limiter.offer(latest, 1.5)) == 2
+    assert limiter.get_statistics()['rate_limit_pending'] == 0
+    # the deadline of the delivered telegram is not reported anymore
+    assert limiter.next_deadline(1.5) is None
+
+    limiter.offer(bs4(4), 2)
+    assert limiter.get_statistics()['rate_limit_pending'] == 1
+    assert len(limiter.flush_all()) == 1
+    assert limiter.get_statistics()['rate_limit_pending'] == 0
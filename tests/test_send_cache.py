@@ -0,0 +1,37 @@
+from esp2_gateway_adapter.send_cache import PrebuiltTelegram, TelegramLRUCache
+
+
+def telegram(i:int) -> PrebuiltTelegram:
+    return PrebuiltTelegram(bytes([0x55, i]), f'telegram {i}')
+
+
+def test_hit_and_miss():
+    cache = TelegramLRUCache()
+    assert cache.get(b'a') is None
+    cache.put(b'a', telegram(1))
+    assert cache.get(b'a').wire == b'\x55\x01'
+    assert cache.get(b'a').build() == b'\x55\x01'
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert cache.hit_rate == 2 / 3
+
+
+def test_evicts_least_recently_used():
+    cache = TelegramLRUCache(max_entries=2)
+    cache.put(b'a', telegram(1))
+    cache.put(b'b', telegram(2))
+    # a is used, so b is the least recently used entry
+    cache.get(b'a')
+    cache.put(b'c', telegram(3))
+
+    assert len(cache) == 2
+    assert cache.get(b'b') is None
+    assert str(cache.get(b'a')) == 'telegram 1'
+    assert str(cache.get(b'c')) == 'telegram 3'
+
+
+def test_disabled():
+    cache = TelegramLRUCache(max_entries=0)
+    cache.put(b'a', telegram(1))
+    assert len(cache) == 0
+    assert cache.get(b'a') is None
+    assert cache.hit_rate == 0
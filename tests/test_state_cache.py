@@ -0,0 +1,118 @@
+import datetime
+
+from enocean.protocol.constants import PACKET, RORG
+from enocean.protocol.packet import Packet
+from eltakobus.message import RPSMessage
+
+from esp2_gateway_adapter.frames import PROTOCOL_ESP2, PROTOCOL_ESP3
+from esp2_gateway_adapter.state_cache import DeviceStateCache
+
+
+def esp3_4bs(sender:int, value:int, received:float) -> Packet:
+    packet = Packet(PACKET.RADIO_ERP1, [RORG.BS4, value, 0, 0, 0x08] + list(sender.to_bytes(4, 'big')) + [0x00], [0x01, 0xFF, 0xFF, 0xFF, 0xFF, 0x40, 0x00])
+    packet.received = datetime.datetime.fromtimestamp(received)
+    return packet
+
+
+def esp2_rps(sender:int, value:int, received:float) -> RPSMessage:
+    msg = RPSMessage(sender.to_bytes(4, 'big'), 0x30, bytes([value]), True)
+    msg.received = datetime.datetime.fromtimestamp(received)
+    return msg
+
+
+def test_keeps_latest_telegram_per_device():
+    cache = DeviceStateCache()
+    cache.update(esp3_4bs(0x01000001, 1, 1000))
+    cache.update(esp3_4bs(0x01000001, 2, 1001))
+    cache.update(esp2_rps(0x01000002, 0x50, 1002), gateway_id=3)
+
+    assert len(cache) == 2
+    frame = cache.get(0x01000001)
+    assert frame.protocol == PROTOCOL_ESP3
+    assert frame.timestamp == 1001
+    assert frame.to_message().data[1] == 2
+
+    frame = cache.get('01-00-00-02', rorg=RORG.RPS)
+    assert frame.protocol == PROTOCOL_ESP2
+    assert frame.gateway_id == 3
+    assert frame.to_message().data == b'\x50'
+    assert cache.get(0x01000003) is None
+
+
+def test_ignores_non_radio_packets():
+    cache = DeviceStateCache()
+    cache.update(Packet(PACKET.RESPONSE, [0x00], []))
+    assert len(cache) == 0
+
+
+def test_evicts_least_recently_updated():
+    cache = DeviceStateCache(max_entries=2)
+    cache.update(esp3_4bs(1, 0, 1000))
+    cache.update(esp3_4bs(2, 0, 1001))
+    cache.update(esp3_4bs(1, 1, 1002))
+    cache.update(esp3_4bs(3, 0, 1003))
+
+    assert [f.sender for f in cache.snapshot()] == [1, 3]
+
+
+def test_persistence(tmp_path):
+    path = str(tmp_path / 'states.bin')
+    cache = DeviceStateCache(path=path, persist_interval=3600)
+    cache.update(esp3_4bs(0x01000001, 7, 1000))
+    cache.update(esp2_rps(0x01000002, 0x70, 1001))
+    # not written before the persist interval is over
+    assert not (tmp_path / 'states.bin').exists()
+    cache.save()
+
+    loaded = DeviceStateCache(path=path)
+    assert len(loaded) == 2
+    assert [f.sender for f in loaded.snapshot()] == [0x01000001, 0x01000002]
+    assert loaded.get(0x01000001).to_message().data[1] == 7
+    assert loaded.get(0x01000002).timestamp == 1001
+
+
+def test_persistence_respects_max_entries(tmp_path):
+    path = str(tmp_path / 'states.bin')
+    cache = DeviceStateCache(path=path)
+    for i in range(5):
+        cache.update(esp3_4bs(i, 0, 1000 + i))
+    cache.save()
+
+    loaded = DeviceStateCache(max_entries=2, path=path)
+    assert [f.sender for f in loaded.snapshot()] == [3, 4]
+
+
+def test_save_when_persist_interval_is_over(tmp_path):
+    path = tmp_path / 'states.bin'
+    cache = DeviceStateCache(path=str(path), persist_interval=0)
+    cache.update(esp3_4bs(1, 0, 1000))
+    assert path.exists()
+
+
+def test_missing_and_corrupt_file(tmp_path):
+    path = tmp_path / 'states.bin'
+    assert len(DeviceStateCache(path=str(path))) == 0
+
+    path.write_bytes(b'\x00' * 7)
+    assert len(DeviceStateCache(path=str(path))) == 0
+
+
+def test_shared_by_gateways(tmp_path):
+    path = str(tmp_path / 'states.bin')
+    cache = DeviceStateCache(path=path)
+    # one device received by two gateways
+    cache.update(esp3_4bs(0x01000001, 1, 1000), gateway_id=1)
+    cache.update(esp3_4bs(0x01000001, 2, 1001), gateway_id=2)
+    cache.update(esp3_4bs(0x01000002, 3, 1002), gateway_id=2)
+
+    assert len(cache) == 3
+    assert [f.sender for f in cache.snapshot(1)] == [0x01000001]
+    assert [f.sender for f in cache.snapshot(2)] == [0x01000001, 0x01000002]
+    assert cache.get(0x01000001).gateway_id == 2
+    assert cache.get(0x01000001, gateway_id=1).to_message().data[1] == 1
+    assert cache.get(0x01000001, rorg=RORG.BS4, gateway_id=1).timestamp == 1000
+    assert cache.get(0x01000002, gateway_id=1) is None
+    cache.save()
+
+    loaded = DeviceStateCache(path=path)
+    assert [f.sender for f in loaded.snapshot(2)] == [0x01000001, 0x01000002]
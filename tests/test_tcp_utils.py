@@ -0,0 +1,130 @@
+import socket
+import sys
+import time
+
+import pytest
+
+from esp2_gateway_adapter import tcp_utils
+from esp2_gateway_adapter.tcp_utils import connect_tcp, enable_tcp_keepalive, forget_addresses, remember_addresses, resolve_address
+
+
+@pytest.fixture
+def connection():
+    server = socket.create_server(('127.0.0.1', 0))
+    client = socket.create_connection(server.getsockname())
+    peer, _ = server.accept()
+    yield client
+    for sock in (client, peer, server):
+        sock.close()
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="socket options are checked for Linux")
+def test_enable_tcp_keepalive(connection):
+    assert enable_tcp_keepalive(connection, 10)
+    assert connection.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE) == 1
+    # probes start after half of the timeout and are repeated 3 times within the other half
+    assert connection.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE) == 5
+    assert connection.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL) == 1
+    assert connection.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT) == 3
+    assert connection.getsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT) == 10000
+
+
+def test_enable_tcp_keepalive_short_timeout(connection):
+    # idle time and interval are at least one second
+    enable_tcp_keepalive(connection, 1, probe_count=5)
+    assert connection.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE) == 1
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        assert connection.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE) == 1
+        assert connection.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL) == 1
+
+
+class FakeResolver():
+    ''' Replaces socket.getaddrinfo and counts the lookups. '''
+
+    def __init__(self, monkeypatch, *ips:str):
+        self.ips = list(ips)
+        self.lookups = 0
+        monkeypatch.setattr(tcp_utils.socket, 'getaddrinfo', self.getaddrinfo)
+
+    def getaddrinfo(self, host, port, type=0):
+        self.lookups += 1
+        if not self.ips:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (ip, port)) for ip in self.ips]
+
+
+@pytest.fixture
+def host():
+    name = 'gateway.test'
+    yield name
+    forget_addresses(name)
+
+
+def test_resolve_address_is_cached(monkeypatch, host):
+    resolver = FakeResolver(monkeypatch, '192.0.2.1', '192.0.2.1', '192.0.2.2')
+    # duplicates are removed
+    assert resolve_address(host, 5100) == [(socket.AF_INET, ('192.0.2.1', 5100)), (socket.AF_INET, ('192.0.2.2', 5100))]
+    assert resolve_address(host + '.', 5100, ttl=60)[0] == (socket.AF_INET, ('192.0.2.1', 5100))
+    assert resolver.lookups == 1
+    # ip addresses are never looked up
+    assert resolve_address('192.0.2.9', 5100) == [(socket.AF_INET, ('192.0.2.9', 5100))]
+    assert resolve_address('::1', 5100) == [(socket.AF_INET6, ('::1', 5100))]
+    assert resolver.lookups == 1
+
+
+def test_resolve_address_ttl_and_stale_fallback(monkeypatch, host):
+    resolver = FakeResolver(monkeypatch, '192.0.2.1')
+    resolve_address(host, 5100, ttl=0.05)
+    time.sleep(0.1)
+
+    # expired: resolved again
+    resolver.ips = ['192.0.2.2']
+    assert resolve_address(host, 5100, ttl=0.05) == [(socket.AF_INET, ('192.0.2.2', 5100))]
+    assert resolver.lookups == 2
+    time.sleep(0.1)
+
+    # lookup fails: the expired addresses are still better than nothing
+    resolver.ips = []
+    assert resolve_address(host, 5100) == [(socket.AF_INET, ('192.0.2.2', 5100))]
+    assert resolver.lookups == 3
+
+    forget_addresses(host)
+    with pytest.raises(socket.gaierror):
+        resolve_address(host, 5100)
+
+
+def test_remember_addresses(monkeypatch, host):
+    resolver = FakeResolver(monkeypatch, '192.0.2.1')
+    remember_addresses(host + '.', ['192.0.2.7', 'fe80::7'])
+    assert resolve_address(host, 5100) == [(socket.AF_INET, ('192.0.2.7', 5100)), (socket.AF_INET6, ('fe80::7', 5100))]
+    assert resolver.lookups == 0
+
+
+def test_connect_tcp_uses_reachable_address(host):
+    server = socket.create_server(('127.0.0.1', 0))
+    port = server.getsockname()[1]
+    try:
+        # nothing listens on the first address, the second one is reachable
+        remember_addresses(host, ['127.0.0.2', '127.0.0.1'])
+        sock = connect_tcp(host, port, timeout=2)
+        assert sock.getpeername() == ('127.0.0.1', port)
+        assert sock.getblocking()
+        sock.close()
+    finally:
+        server.close()
+
+
+def test_connect_tcp_forgets_addresses_on_failure(monkeypatch, host):
+    closed = socket.create_server(('127.0.0.1', 0))
+    port = closed.getsockname()[1]
+    closed.close()
+
+    resolver = FakeResolver(monkeypatch, '127.0.0.1')
+    with pytest.raises(OSError):
+        connect_tcp(host, port, timeout=2)
+    assert resolver.lookups == 1
+
+    # the address is resolved again for the next attempt, e.g. because the gateway got a new address
+    with pytest.raises(OSError):
+        connect_tcp(host, port, timeout=2)
+    assert resolver.lookups == 2
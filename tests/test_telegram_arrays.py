@@ -0,0 +1,90 @@
+import datetime
+
+import pytest
+
+# numpy is an optional dependency (extra 'numpy')
+np = pytest.importorskip('numpy')
+
+from enocean.protocol.constants import PACKET, RORG
+from enocean.protocol.packet import Packet
+from eltakobus.message import Regular4BSMessage, RPSMessage
+
+from esp2_gateway_adapter.frames import PROTOCOL_STATUS, encode_frame, encode_message
+from esp2_gateway_adapter.telegram_arrays import (decode_esp2_capture, decode_esp3_capture, decode_frames,
+                                                  find_esp2_telegrams, find_esp3_telegrams)
+
+
+def esp3_4bs(sender:int, data:list, dbm:int) -> bytes:
+    return bytes(Packet(PACKET.RADIO_ERP1, [RORG.BS4] + data + list(sender.to_bytes(4, 'big')) + [0x00], [0x01, 0xFF, 0xFF, 0xFF, 0xFF, dbm, 0x00]).build())
+
+
+def esp3_rps(sender:int, value:int) -> bytes:
+    # without optional data, dBm is unknown
+    return bytes(Packet(PACKET.RADIO_ERP1, [RORG.RPS, value] + list(sender.to_bytes(4, 'big')) + [0x30], []).build())
+
+
+def test_decode_esp3_capture():
+    response = bytes(Packet(PACKET.RESPONSE, [0x00], []).build())
+    corrupt = bytearray(esp3_4bs(0x01000009, [9, 9, 9, 9], 50))
+    corrupt[-1] ^= 0xFF
+    # garbage and sync bytes between telegrams
+    capture = b'\x55\x00' + esp3_4bs(0x01000001, [1, 2, 3, 4], 60) + response + bytes(corrupt) + b'\x12\x55' + esp3_rps(0xFFD63001, 0x70)
+
+    columns = decode_esp3_capture(capture)
+
+    assert columns.sender.tolist() == [0x01000001, 0xFFD63001]
+    assert columns.rorg.tolist() == [RORG.BS4, RORG.RPS]
+    assert columns.data.tolist() == [[1, 2, 3, 4], [0x70, 0, 0, 0]]
+    assert columns.status.tolist() == [0x00, 0x30]
+    assert columns.dbm.tolist() == [-60, 0]
+    assert np.isnan(columns.timestamp).all()
+    assert columns.gateway_id.tolist() == [0, 0]
+
+
+def test_find_esp3_telegrams_with_sync_byte_in_data():
+    telegram = esp3_4bs(0x55555555, [0x55, 0x00, 0x07, 0x07], 0x55)
+    positions = find_esp3_telegrams(b'\x00' + telegram + telegram)
+    assert positions.tolist() == [1, 1 + len(telegram)]
+
+
+def test_decode_esp2_capture():
+    rps = RPSMessage(b'\x01\x00\x00\x01', 0x30, b'\x50', True).serialize()
+    bs4 = Regular4BSMessage(b'\x01\x00\x00\x02', 0x00, b'\x01\x02\x03\x08', True).serialize()
+    corrupt = bytearray(rps)
+    corrupt[-1] ^= 0xFF
+    capture = b'\xA5' + rps + bytes(corrupt) + b'\xA5\x5A' + bs4
+
+    assert find_esp2_telegrams(capture).tolist() == [1, 1 + 2 * len(rps) + 2]
+    columns = decode_esp2_capture(capture)
+    assert columns.sender.tolist() == [0x01000001, 0x01000002]
+    assert columns.rorg.tolist() == [RORG.RPS, RORG.BS4]
+    assert columns.data.tolist() == [[0x50, 0, 0, 0], [1, 2, 3, 8]]
+    assert columns.status.tolist() == [0x30, 0x00]
+    assert columns.dbm.tolist() == [0, 0]
+
+
+def test_decode_frames():
+    esp2 = RPSMessage(b'\x01\x00\x00\x01', 0x30, b'\x50', True)
+    esp2.received = datetime.datetime.fromtimestamp(1001)
+    esp3 = Packet(PACKET.RADIO_ERP1, [RORG.BS4, 1, 2, 3, 4, 0x01, 0x00, 0x00, 0x02, 0x00], [0x01, 0xFF, 0xFF, 0xFF, 0xFF, 0x40, 0x00])
+    esp3.received = datetime.datetime.fromtimestamp(1000)
+    buffer = (encode_message(2, esp3)
+              + encode_frame(1000.5, 2, PROTOCOL_STATUS, b'\x01')
+              + encode_message(1, esp2)
+              # incomplete frame at the end is ignored
+              + encode_message(1, esp2)[:20])
+
+    columns = decode_frames(buffer)
+
+    assert columns.timestamp.tolist() == [1000, 1001]
+    assert columns.gateway_id.tolist() == [2, 1]
+    assert columns.sender.tolist() == [0x01000002, 0x01000001]
+    assert columns.rorg.tolist() == [RORG.BS4, RORG.RPS]
+    assert columns.data.tolist() == [[1, 2, 3, 4], [0x50, 0, 0, 0]]
+    assert columns.dbm.tolist() == [-64, 0]
+
+
+def test_empty_capture():
+    assert len(decode_esp3_capture(b'').sender) == 0
+    assert len(decode_esp2_capture(b'').sender) == 0
+    assert len(decode_frames(b'').sender) == 0